@@ -0,0 +1,3 @@
+# Spotify Web API plumbing used by the extension: HTTP session, caches and the client wrapper,
+# and the extension's commands (engine.py), which also run from the command line (__main__.py).
+# Nothing in this package imports ulauncher, so it can be used outside of the launcher too.
@@ -0,0 +1,147 @@
+"""
+Command line frontend of the extension's commands, for scripts, profiling and benchmarks.
+It uses the same token, caches and preferences defaults as the extension.
+
+QUERY is what would be typed after the keyword in Ulauncher, e.g. "search daft punk"; no QUERY
+shows what is playing. --enter N picks the Nth item of the results, like pressing Enter on it.
+With --batch, every line of stdin is a query, or "!N" to pick the Nth item of the last results.
+All of them share one client, so the token, the connections and the caches stay warm.
+
+Usage: python -m spotify_api [--json] [--set KEY=VALUE ...] [--enter N] [QUERY ...]
+       python -m spotify_api --batch [--json] [--set KEY=VALUE ...] < commands
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+from . import engine, models
+from .engine import SpotifyEngine
+
+logger = logging.getLogger(__name__)
+
+
+class CommandLine:
+    # runs queries and picked items against one SpotifyEngine and prints what comes back
+
+    def __init__(self, spotify: SpotifyEngine, as_json: bool = False):
+        self.engine = spotify
+        self.as_json = as_json
+        self.items = []  # items of the last results, for picking one of them
+        self.failed = False
+
+    def query(self, argument: str) -> None:
+        started = time.time()
+        keyword = self.engine.preferences["main_keyword"]
+        result = self.engine.query(keyword, argument, None)
+        self._print({"query": argument}, result, started)
+
+    # pick the `number`th item (counting from 1) of the last results
+    def enter(self, number: int) -> None:
+        if not 0 < number <= len(self.items):
+            self._error(f"No item {number}, the last results have {len(self.items)}")
+            return
+        action = self.items[number - 1].action
+        started = time.time()
+
+        if isinstance(action, engine.SetUserQueryAction):
+            keyword = self.engine.preferences["main_keyword"]
+            argument = action.query
+            if argument.startswith(keyword):
+                argument = argument[len(keyword) :]
+            return self.query(argument.strip())
+        if isinstance(action, engine.CustomAction):
+            result = self.engine.on_item_enter(action.data)
+            # actions that run in the background are part of picking the item here
+            self.engine.actions.wait()
+            for name, e in self.engine.actions.failures(clear=True):
+                title, desc = self.engine.describe_error(e, failed=name)
+                self._error(f"{title}: {desc}")
+        else:
+            result = action
+        self._print({"enter": number}, result, started)
+
+    def _print(self, request: dict, result, started: float) -> None:
+        elapsed_ms = round((time.time() - started) * 1000)
+        if isinstance(result, engine.RenderResultListAction):
+            self.items = result.items
+        if self.as_json:
+            output = dict(request, elapsed_ms=elapsed_ms, result=_dump(result))
+            print(json.dumps(output), flush=True)
+            return
+
+        if isinstance(result, engine.RenderResultListAction):
+            for number, item in enumerate(result.items, 1):
+                print(f"{number}. {item.title}")
+                if item.description:
+                    print(f"   {item.description}")
+        elif isinstance(result, engine.OpenUrlAction):
+            print(result.url)
+        print(f"({elapsed_ms} ms)", file=sys.stderr, flush=True)
+
+    def _error(self, message: str) -> None:
+        self.failed = True
+        print(message, file=sys.stderr, flush=True)
+
+
+# engine records as plain JSON: {"type": "Item", "title": ..., ...}
+def _dump(obj):
+    if isinstance(obj, models.Model):
+        fields = {name: _dump(getattr(obj, name)) for name in obj.__slots__}
+        return dict(type=type(obj).__name__, **fields)
+    if isinstance(obj, (list, tuple)):
+        return [_dump(value) for value in obj]
+    if isinstance(obj, dict):
+        return {key: _dump(value) for key, value in obj.items()}
+    return obj
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("query", nargs="*", help="query, without the keyword")
+    parser.add_argument("--json", action="store_true", help="print JSON, one line each")
+    parser.add_argument("--batch", action="store_true", help="read commands from stdin")
+    parser.add_argument("--enter", type=int, help="pick this item of the results")
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="preference, as in the extension settings (e.g. search_results_limit=20)",
+    )
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    spotify = SpotifyEngine()
+    preferences = dict(spotify.preferences)
+    for setting in args.set:
+        key, _, value = setting.partition("=")
+        if key not in preferences:
+            parser.error(f"Unknown preference {key}")
+        preferences[key] = value
+    spotify.on_preferences(preferences)
+    spotify.set_language(spotify.preferences["main_language"])
+
+    cli = CommandLine(spotify, args.json)
+    try:
+        if args.batch:
+            for line in sys.stdin:
+                line = line.strip()
+                if line.startswith("!") and line[1:].isdigit():
+                    cli.enter(int(line[1:]))
+                else:
+                    cli.query(line)
+        else:
+            cli.query(" ".join(args.query))
+            if args.enter is not None:
+                cli.enter(args.enter)
+    finally:
+        spotify.api.save_snapshot()
+    return 1 if cli.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
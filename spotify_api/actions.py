@@ -0,0 +1,106 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import requests
+
+from .client import API_ERRORS
+from .session import never_sent
+
+logger = logging.getLogger(__name__)
+
+
+# raised by an action that can not be done, with a message for the user; never retried
+class ActionFailed(Exception):
+    pass
+
+
+class ActionExecutor:
+    # Runs the actions picked in the launcher (play, switch, volume, ...) on a daemon thread,
+    # one after the other in the order they were picked, so that the launcher hides right away.
+    # Within an action, every Web API call goes through attempt(), which retries it on
+    # transient errors that left it undone. Actions that fail anyway are kept until
+    # failures(clear=True) picks them up, and passed to `on_failure` (name, exception) as
+    # they happen.
+
+    ATTEMPTS = 3
+    BACKOFF = 1.0  # seconds before the first retry, doubled for every further one
+    MAX_RETRY_AFTER = 10  # seconds, longer rate limit waits fail the action instead
+    MAX_FAILURES = 5
+
+    def __init__(self, on_failure: Callable = None):
+        self.on_failure = on_failure
+        self._queue = queue.Queue()
+        self._failures = deque(maxlen=self.MAX_FAILURES)
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name="actions", daemon=True).start()
+
+    def submit(self, name: str, fn: Callable, *args, **kwargs) -> None:
+        self._queue.put((name, fn, args, kwargs))
+
+    # block until every action submitted so far is done
+    def wait(self) -> None:
+        self._queue.join()
+
+    # call `fn`, again after a backoff if it fails with a transient error before it was done
+    def attempt(self, fn: Callable, *args, **kwargs):
+        delay = self.BACKOFF
+        for attempt in range(1, self.ATTEMPTS + 1):
+            try:
+                return fn(*args, **kwargs)
+            except API_ERRORS as e:
+                wait = _retry_after(e, delay)
+                if attempt == self.ATTEMPTS or wait is None:
+                    raise
+                name = getattr(fn, "__name__", fn)
+                logger.debug(f"{name} failed ({e}), retrying in {wait}s")
+                time.sleep(wait)
+                delay *= 2
+
+    # (name, exception) of the actions that failed, oldest first
+    def failures(self, clear: bool = False) -> list:
+        with self._lock:
+            failures = list(self._failures)
+            if clear:
+                self._failures.clear()
+        return failures
+
+    def _run(self) -> None:
+        while True:
+            name, fn, args, kwargs = self._queue.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                logger.debug(f"Action {name} failed: {e}")
+                with self._lock:
+                    self._failures.append((name, e))
+                if self.on_failure is not None:
+                    try:
+                        self.on_failure(name, e)
+                    except Exception as error:
+                        logger.debug(f"Could not report failed {name}: {error}")
+            finally:
+                self._queue.task_done()
+
+
+# Seconds to wait before retrying after `e`, None if retrying will not help, or if the call
+# may have been done already: commands like next_track or add_to_queue must not run twice.
+def _retry_after(e: Exception, delay: float) -> Optional[float]:
+    if isinstance(e, requests.exceptions.RequestException):
+        return delay if never_sent(e) else None
+    if e.http_status == 429:
+        # spotipy turns server errors that used up the session's retries into a 429
+        # ("Max Retries") without headers, only a real rate limit says when to retry
+        headers = getattr(e, "headers", None) or {}
+        try:
+            wait = float(headers["Retry-After"])
+        except (KeyError, ValueError):
+            return None
+        return wait if wait <= ActionExecutor.MAX_RETRY_AFTER else None
+    # Spotify turned the call down, other server errors may come after it was done
+    if e.http_status == 503:
+        return delay
+    return None
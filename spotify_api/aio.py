@@ -0,0 +1,372 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+from typing import Optional
+
+import requests
+import spotipy
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import aiohttp
+except ImportError:
+    # optional: without aiohttp, requests run on threads through the blocking session,
+    # and a cancelled request is abandoned instead of aborted
+    aiohttp = None
+
+from .session import CircuitOpenError, NotSentError, ResilientSession
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.spotify.com/v1/"
+
+# aiohttp before 3.10 does not tell connect timeouts from read timeouts
+CONNECT_TIMEOUT = getattr(aiohttp, "ConnectionTimeoutError", ())
+
+
+class AsyncSpotify:
+    # Web API client running on its own asyncio event loop (a daemon thread).
+    # Endpoints are coroutines that take the same arguments as their spotipy counterparts and
+    # return the same JSON. submit() runs one from any thread and returns a concurrent Future;
+    # cancelling the future cancels the request itself.
+    # The token comes from the auth manager spotipy uses (and its token cache), and requests
+    # go through the circuit breaker and the per-endpoint timeouts of `session`.
+    # Concurrent identical reads are sent once, see _request().
+
+    def __init__(
+        self, auth_manager: spotipy.oauth2.SpotifyAuthBase, session: ResilientSession
+    ):
+        self.auth_manager = auth_manager
+        self.session = session
+        self.api_url = API_URL
+        self.loop = asyncio.new_event_loop()
+        self._http = None  # aiohttp.ClientSession, created on the loop
+        self._token = None
+        # (path, params) of a read in flight -> [its task, number of callers waiting]
+        self._inflight = {}
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="aio", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    # Close the HTTP session and the executor threads of the loop, then the loop itself.
+    # Requests still in flight are aborted.
+    def close(self, timeout: float = 5.0) -> None:
+        try:
+            self.submit(self._close()).result(timeout)
+        except Exception as e:
+            logger.debug(f"Could not close the HTTP session: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        if not self.loop.is_running():
+            self.loop.close()
+
+    async def _close(self) -> None:
+        for task, _ in list(self._inflight.values()):
+            task.cancel()
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+        # Python 3.9 and later
+        if hasattr(self.loop, "shutdown_default_executor"):
+            await self.loop.shutdown_default_executor()
+
+    async def _access_token(self) -> str:
+        if self._token is None or self._token["expires_at"] - 60 < time.time():
+            # reads the token cache and refreshes the token if needed, never asks the user
+            token = await self.loop.run_in_executor(
+                None, self.auth_manager.get_cached_token
+            )
+            if token is None:
+                raise spotipy.SpotifyOauthError("No cached token, authorize first")
+            self._token = token
+        return self._token["access_token"]
+
+    async def _request(self, method: str, path: str, payload=None, **params):
+        params = {k: v for k, v in params.items() if v is not None}
+        if method != "GET":
+            return await self._send(method, path, payload, params)
+
+        # Identical reads in flight share one request (and its result, which is not to be
+        # changed). A cancelled caller stops waiting, the request is aborted only once
+        # nobody waits for it anymore.
+        key = (path, tuple(sorted(params.items())))
+        if key not in self._inflight:
+            task = self.loop.create_task(self._send(method, path, None, params))
+            self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.debug(f"Joining the request in flight for {path}")
+        shared = self._inflight[key]
+        shared[1] += 1
+        try:
+            return await asyncio.shield(shared[0])
+        finally:
+            shared[1] -= 1
+            if not shared[1] and not shared[0].done():
+                shared[0].cancel()
+
+    async def _send(self, method: str, path: str, payload, params: dict):
+        url = self.api_url + path
+        headers = {
+            "Authorization": f"Bearer {await self._access_token()}",
+            "Content-Type": "application/json",
+        }
+        data = json.dumps(payload) if payload else None
+
+        if aiohttp is None:
+            send = partial(
+                self.session.request,
+                method,
+                url,
+                headers=headers,
+                params=params,
+                data=data,
+            )
+            response = await self.loop.run_in_executor(None, send)
+            return _result(response.status_code, response.text, url, response.headers)
+
+        if self.session.breaker.is_open:
+            raise CircuitOpenError(
+                f"Spotify is unreachable, not sending {method} {url}"
+            )
+        if self._http is None:
+            self._http = aiohttp.ClientSession()
+
+        # the same response cache the blocking session uses, see HttpCache
+        cache, entry = self.session.http_cache, None
+        if method == "GET" and cache is not None:
+            key = requests.Request(method, url, params=params).prepare().url
+            entry = await self.loop.run_in_executor(None, cache.get, key)
+            if entry and cache.is_fresh(entry):
+                return _result(200, entry["body"], url)
+            if entry and entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+
+        connect, read = self.session.timeout_for(url)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        try:
+            async with self._http.request(
+                method,
+                url,
+                headers=headers,
+                params=params,
+                data=data,
+                timeout=timeout,
+            ) as response:
+                status, text = response.status, await response.text()
+                response_headers = CaseInsensitiveDict(response.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.session.breaker.record_failure()
+            # callers handle connection problems the same way as with spotipy
+            message = f"{method} {url}: {e!r}"
+            if isinstance(e, (aiohttp.ClientConnectorError, CONNECT_TIMEOUT)):
+                raise NotSentError(message)
+            if isinstance(e, (aiohttp.ServerTimeoutError, asyncio.TimeoutError)):
+                raise requests.exceptions.ReadTimeout(message)
+            raise requests.exceptions.ConnectionError(message)
+
+        if status >= 500:
+            self.session.breaker.record_failure()
+        else:
+            self.session.breaker.record_success()
+
+        if status == 304 and entry:
+            logger.debug(f"Not modified, serving cached {url}")
+            revalidate = partial(cache.revalidated, key, entry, response_headers)
+            entry = await self.loop.run_in_executor(None, revalidate)
+            status, text = 200, entry["body"]
+        elif status == 200 and method == "GET" and cache is not None:
+            store = partial(cache.store, key, response_headers, text)
+            await self.loop.run_in_executor(None, store)
+        return _result(status, text, url, response_headers)
+
+    async def current_playback(self, market=None, additional_types=None):
+        return await self._request(
+            "GET", "me/player", market=market, additional_types=additional_types
+        )
+
+    async def devices(self):
+        return await self._request("GET", "me/player/devices")
+
+    async def queue(self):
+        return await self._request("GET", "me/player/queue")
+
+    async def current_user_recently_played(self, limit=50, after=None, before=None):
+        return await self._request(
+            "GET", "me/player/recently-played", limit=limit, after=after, before=before
+        )
+
+    async def search(self, q, limit=10, offset=0, type="track", market=None):
+        return await self._request(
+            "GET", "search", q=q, limit=limit, offset=offset, type=type, market=market
+        )
+
+    async def playlist_items(
+        self,
+        playlist_id,
+        fields=None,
+        limit=100,
+        offset=0,
+        market=None,
+        additional_types=("track", "episode"),
+    ):
+        return await self._request(
+            "GET",
+            f"playlists/{_id(playlist_id)}/tracks",
+            fields=fields,
+            limit=limit,
+            offset=offset,
+            market=market,
+            additional_types=",".join(additional_types),
+        )
+
+    async def album_tracks(self, album_id, limit=50, offset=0, market=None):
+        return await self._request(
+            "GET",
+            f"albums/{_id(album_id)}/tracks",
+            limit=limit,
+            offset=offset,
+            market=market,
+        )
+
+    async def artist_top_tracks(self, artist_id, country="from_token"):
+        return await self._request(
+            "GET", f"artists/{_id(artist_id)}/top-tracks", market=country
+        )
+
+    async def artist_albums(
+        self, artist_id, album_type=None, country=None, limit=20, offset=0
+    ):
+        return await self._request(
+            "GET",
+            f"artists/{_id(artist_id)}/albums",
+            include_groups=album_type,
+            market=country,
+            limit=limit,
+            offset=offset,
+        )
+
+    async def artist_related_artists(self, artist_id):
+        return await self._request("GET", f"artists/{_id(artist_id)}/related-artists")
+
+    async def current_user_playlists(self, limit=50, offset=0):
+        return await self._request("GET", "me/playlists", limit=limit, offset=offset)
+
+    async def current_user_saved_tracks(self, limit=20, offset=0, market=None):
+        return await self._request(
+            "GET", "me/tracks", limit=limit, offset=offset, market=market
+        )
+
+    async def current_user_saved_tracks_contains(self, tracks=None):
+        ids = ",".join(_id(t) for t in tracks or [])
+        return await self._request("GET", "me/tracks/contains", ids=ids)
+
+    async def current_user_saved_tracks_add(self, tracks=None):
+        ids = ",".join(_id(t) for t in tracks or [])
+        return await self._request("PUT", "me/tracks", ids=ids)
+
+    async def audio_features(self, tracks=None):
+        ids = ",".join(_id(t) for t in tracks or [])
+        results = await self._request("GET", "audio-features", ids=ids)
+        return results["audio_features"] if results else None
+
+    async def recommendations(
+        self, seed_artists=None, seed_genres=None, seed_tracks=None, limit=20
+    ):
+        return await self._request(
+            "GET",
+            "recommendations",
+            seed_artists=",".join(_id(a) for a in seed_artists or []) or None,
+            seed_genres=",".join(seed_genres or []) or None,
+            seed_tracks=",".join(_id(t) for t in seed_tracks or []) or None,
+            limit=limit,
+        )
+
+    async def start_playback(
+        self,
+        device_id=None,
+        context_uri=None,
+        uris=None,
+        offset=None,
+        position_ms=None,
+    ):
+        payload = {
+            "context_uri": context_uri,
+            "uris": uris,
+            "offset": offset,
+            "position_ms": position_ms,
+        }
+        payload = {k: v for k, v in payload.items() if v is not None}
+        return await self._request(
+            "PUT", "me/player/play", payload=payload, device_id=device_id
+        )
+
+    async def pause_playback(self, device_id=None):
+        return await self._request("PUT", "me/player/pause", device_id=device_id)
+
+    async def next_track(self, device_id=None):
+        return await self._request("POST", "me/player/next", device_id=device_id)
+
+    async def previous_track(self, device_id=None):
+        return await self._request("POST", "me/player/previous", device_id=device_id)
+
+    async def transfer_playback(self, device_id, force_play=True):
+        payload = {"device_ids": [device_id], "play": force_play}
+        return await self._request("PUT", "me/player", payload=payload)
+
+    async def shuffle(self, state, device_id=None):
+        return await self._request(
+            "PUT", "me/player/shuffle", state=str(state).lower(), device_id=device_id
+        )
+
+    async def repeat(self, state, device_id=None):
+        return await self._request(
+            "PUT", "me/player/repeat", state=state, device_id=device_id
+        )
+
+    async def volume(self, volume_percent, device_id=None):
+        return await self._request(
+            "PUT",
+            "me/player/volume",
+            volume_percent=volume_percent,
+            device_id=device_id,
+        )
+
+    async def add_to_queue(self, uri, device_id=None):
+        return await self._request(
+            "POST", "me/player/queue", uri=uri, device_id=device_id
+        )
+
+
+# "spotify:track:<id>" or an open.spotify.com url -> "<id>", like spotipy does
+def _id(value: str) -> str:
+    if value.count(":") >= 2:
+        return value.split(":")[-1]
+    if value.count("/") >= 2:
+        return value.split("/")[-1].split("?")[0]
+    return value
+
+
+# the parsed body of a response, errors are raised like spotipy raises them
+def _result(status: int, text: str, url: str, headers=None) -> Optional[dict]:
+    try:
+        body = json.loads(text) if text else None
+    except ValueError:
+        body = None
+    if status >= 400:
+        try:
+            msg = body["error"]["message"]
+        except (TypeError, KeyError):
+            msg = "error"
+        raise spotipy.SpotifyException(
+            status, -1, f"{url}:\n {msg}", headers=headers
+        )
+    return body
@@ -0,0 +1,57 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures. While open, callers are expected to
+    # fail fast instead of waiting for the network; a background thread calls `probe` every
+    # `probe_interval` seconds and closes the breaker as soon as a probe succeeds.
+
+    def __init__(
+        self,
+        probe: Callable[[], bool],
+        failure_threshold: int = 3,
+        probe_interval: float = 5.0,
+    ):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.opened_at = None
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self.opened_at is not None:
+                logger.debug("Circuit breaker closed")
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.opened_at is not None or self._failures < self.failure_threshold:
+                return
+            logger.debug(f"Circuit breaker opened after {self._failures} failures")
+            self.opened_at = time.time()
+
+        threading.Thread(target=self._probe_loop, daemon=True).start()
+
+    def _probe_loop(self) -> None:
+        while self.is_open:
+            time.sleep(self.probe_interval)
+            try:
+                recovered = self.probe()
+            except Exception as e:
+                logger.debug(f"Circuit breaker probe failed: {e}")
+                recovered = False
+            if recovered:
+                self.record_success()
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# sentinel for "no entry", since None is a perfectly valid cached response
+MISSING = object()
+
+
+class TTLCache:
+    # Thread-safe LRU cache with per-entry expiry.
+    # Expired entries are not dropped right away: they stay around until evicted,
+    # so they can still be served (with stale=True) when Spotify can not be reached.
+
+    def __init__(self, ttl: float, max_entries: int = 128):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None, stale: bool = False) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if not stale and expires_at < time.time():
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry else default
+
+    # snapshot of the keys, expired ones included
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._data)
+
+    # entries as (key, expires_at, value), least recently used first
+    def dump(self) -> list:
+        with self._lock:
+            return [(key, entry[0], entry[1]) for key, entry in self._data.items()]
+
+    # add entries from dump(), without replacing anything cached in the meantime
+    def load(self, entries: list) -> None:
+        with self._lock:
+            data = OrderedDict(
+                (key, (expires_at, value))
+                for key, expires_at, value in entries
+                if key not in self._data
+            )
+            data.update(self._data)
+            while len(data) > self.max_entries:
+                data.popitem(last=False)
+            self._data = data
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, MISSING) is not MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
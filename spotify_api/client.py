@@ -0,0 +1,718 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Optional
+
+import requests
+import spotipy
+
+from . import models, snapshot
+from .aio import AsyncSpotify
+from .cache import MISSING, TTLCache
+from .httpcache import HttpCache
+from .lyrics import LyricsCache
+from .memory import MemoryProfiler
+from .mpris import BUS_NAME, MprisPlayer
+from .playqueue import QueueMirror
+from .radio import Radio
+from .session import ResilientSession
+from .similarity import SimilarityIndex
+from .thumbnails import ThumbnailPrefetcher
+from .worker import LOW, BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+# what a failed Web API call can raise
+API_ERRORS = (requests.exceptions.RequestException, spotipy.SpotifyException)
+
+# only what the track listings show, playlist items are fetched with this `fields` filter;
+# keeps everything models.item() and models.track() read
+PLAYLIST_ITEMS_FIELDS = (
+    "items(track(id,type,name,uri,duration_ms,artists(id,name),"
+    "album(id,uri,name,images))),next,total"
+)
+
+
+# raised for reads made under cache_only() that have nothing cached yet
+class NotCached(Exception):
+    pass
+
+
+# raised for Web API calls of a query that was cancelled, see SpotifyClient.cancel()
+class QueryCancelled(Exception):
+    pass
+
+
+class SpotifyClient:
+    # Thin wrapper around spotipy.Spotify.
+    # Web API calls run on an asyncio engine (see aio.py), spotipy takes care of the authorization
+    # and of the endpoints the engine does not cover.
+    # Reads that the launcher shows (playback, devices, search, history) remember their last good
+    # response, which is served instead when Spotify can not be reached or the breaker is open.
+    # Playback commands go to the local desktop client over MPRIS when it is the active player.
+    # Everything else is forwarded to spotipy as is.
+
+    PREFETCH_INTERVAL = 2  # seconds between two prefetches of the same read
+    SNAPSHOT_INTERVAL = 60  # seconds between two cache snapshots
+    THUMBNAILS_SYNC_INTERVAL = 3600  # seconds between two walks through the library artwork
+    LYRICS_AHEAD = 3  # queued tracks whose lyrics are prefetched
+
+    def __init__(
+        self,
+        auth_manager: spotipy.oauth2.SpotifyAuthBase,
+        data_dir: str,
+        mpris_name: str = BUS_NAME,
+    ):
+        self.session = ResilientSession(
+            http_cache=HttpCache(os.path.join(data_dir, "http"))
+        )
+        self.sp = spotipy.Spotify(
+            auth_manager=auth_manager, requests_session=self.session
+        )
+        self.aio = AsyncSpotify(auth_manager, self.session)
+        self._inflight = {}  # query token -> futures of its Web API calls in flight
+        self._inflight_lock = threading.Lock()
+        self._readers = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gather")
+
+        self.playback_cache = TTLCache(ttl=5, max_entries=4)
+        self.devices_cache = TTLCache(ttl=30, max_entries=1)
+        self.search_cache = TTLCache(ttl=600, max_entries=64)
+        self.history_cache = TTLCache(ttl=60, max_entries=4)
+        # albums never change and playlist pages are keyed by snapshot_id, so these can live long
+        self.tracks_cache = TTLCache(ttl=86400, max_entries=256)
+        # artist catalogs rarely change: top tracks, albums and related artists are kept for hours
+        self.artists_cache = TTLCache(ttl=6 * 3600, max_entries=64)
+        # track id -> whether it is in the user's Liked Songs
+        self.liked_cache = TTLCache(ttl=600, max_entries=5000)
+        # tokens of cancelled queries, calls they still make are refused
+        self.cancelled_queries = TTLCache(ttl=60, max_entries=64)
+
+        self.worker = BackgroundWorker(name="prefetch")
+        self.radio = Radio(self)
+        self.play_queue = QueueMirror(self)
+        self.memory = MemoryProfiler(self)
+        self.similarity = SimilarityIndex(self, os.path.join(data_dir, "similarity"))
+        self.mpris = MprisPlayer(mpris_name, on_change=self._on_local_change)
+        # artwork is cached in the same folder the launcher reads it from
+        self.thumbnails = ThumbnailPrefetcher(os.path.join(data_dir, "cache"))
+        self._thumbnails_synced_at = 0
+        self.lyrics = LyricsCache(os.path.join(data_dir, "lyrics"), self.worker)
+        self._playing_id = None  # track whose lyrics were prefetched last
+        self.mpris.start()
+
+        self._local = threading.local()
+        # cache keys of prefetched results nobody read yet
+        self._prefetched = TTLCache(ttl=3600, max_entries=256)
+        # prefetches submitted within the last PREFETCH_INTERVAL
+        self._prefetch_times = TTLCache(ttl=self.PREFETCH_INTERVAL, max_entries=256)
+
+        # the caches are saved next to the token cache, so a restart does not start cold
+        self.snapshot_path = os.path.join(data_dir, "snapshot.pickle")
+        self._closed = threading.Event()
+        self._snapshot_thread = threading.Thread(
+            target=self._snapshot_loop, name="snapshot", daemon=True
+        )
+        self._snapshot_thread.start()
+
+    def __getattr__(self, name):
+        if name in ("sp", "aio"):
+            raise AttributeError(name)
+        # endpoints the engine covers go through it, everything else through spotipy
+        if not name.startswith("_") and asyncio.iscoroutinefunction(
+            getattr(AsyncSpotify, name, None)
+        ):
+            return partial(self._call, name)
+        return getattr(self.sp, name)
+
+    # Run the engine's `name` endpoint and wait for its result.
+    # Calls made within query(token) are aborted when the query is cancelled.
+    def _call(self, name: str, *args, **kwargs):
+        token = getattr(self._local, "query", None)
+        with self._inflight_lock:
+            if token is not None and token in self.cancelled_queries:
+                raise QueryCancelled(token)
+            future = self.aio.submit(getattr(self.aio, name)(*args, **kwargs))
+            if token is not None:
+                self._inflight.setdefault(token, set()).add(future)
+        try:
+            return future.result()
+        except CancelledError:
+            raise QueryCancelled(token)
+        finally:
+            if token is not None:
+                with self._inflight_lock:
+                    futures = self._inflight.get(token, set())
+                    futures.discard(future)
+                    if not futures:
+                        self._inflight.pop(token, None)
+
+    # Web API calls of the calling thread within this block belong to the query `token`
+    @contextmanager
+    def query(self, token):
+        previous, self._local.query = getattr(self._local, "query", None), token
+        try:
+            yield
+        finally:
+            self._local.query = previous
+
+    # abort the calls of the query `token` in flight, and refuse the ones it still makes
+    def cancel(self, token) -> None:
+        with self._inflight_lock:
+            self.cancelled_queries.set(token, True)
+            for future in self._inflight.pop(token, ()):
+                future.cancel()
+
+    # Call several of the reads below at the same time and return their results in order.
+    # Each read is (name, kwargs), e.g. ("devices", {}); they run in the query and the
+    # cache_only() mode of the calling thread.
+    def gather(self, *reads) -> list:
+        query, cache_only = getattr(self._local, "query", None), self.is_cache_only
+
+        def read(name, kwargs):
+            self._local.query, self._local.cache_only = query, cache_only
+            try:
+                return getattr(self, name)(**kwargs)
+            finally:
+                self._local.query, self._local.cache_only = None, False
+
+        futures = [self._readers.submit(read, name, kwargs) for name, kwargs in reads]
+        return [future.result() for future in futures]
+
+    def _snapshot_caches(self) -> dict:
+        return {
+            "playback": self.playback_cache,
+            "devices": self.devices_cache,
+            "search": self.search_cache,
+            "history": self.history_cache,
+            "tracks": self.tracks_cache,
+            "artists": self.artists_cache,
+            "liked": self.liked_cache,
+        }
+
+    # Drop what the named caches hold: those of _snapshot_caches(), and "lyrics" and "http"
+    # for the ones on disk. For when a change makes what they hold wrong.
+    def invalidate(self, *names) -> None:
+        caches = self._snapshot_caches()
+        for name in names:
+            logger.debug(f"Invalidating the {name} cache")
+            if name == "lyrics":
+                self.lyrics.clear()
+            elif name == "http":
+                self.session.http_cache.clear()
+            else:
+                caches[name].clear()
+
+    def save_snapshot(self) -> None:
+        try:
+            snapshot.save(self.snapshot_path, self._snapshot_caches())
+        except OSError as e:
+            logger.debug(f"Could not save the cache snapshot: {e}")
+
+    # load the last snapshot in the background right after startup, then save one now and then
+    def _snapshot_loop(self) -> None:
+        loaded = snapshot.load(self.snapshot_path, self._snapshot_caches())
+        logger.debug(f"Loaded {loaded} cache entries from the snapshot")
+        while not self._closed.wait(self.SNAPSHOT_INTERVAL):
+            self.save_snapshot()
+
+    # Stop everything running in the background (radio, snapshots, MPRIS, prefetching,
+    # artwork downloads) and close the connections, e.g. before another client takes over
+    # the same data folder. Does not save a snapshot, see save_snapshot().
+    def close(self) -> None:
+        logger.debug("Closing the Spotify client")
+        self._closed.set()
+        self.radio.stop()
+        self.mpris.stop()
+        self.worker.close()
+        self.thumbnails.configure(self.thumbnails.bandwidth, 0)
+        self._readers.shutdown(wait=False)
+        # a snapshot being saved right now is finished before anyone else writes one
+        self._snapshot_thread.join()
+        self.aio.close()
+        self.session.close()
+
+    # True while Spotify is considered unreachable and reads are served from the caches
+    @property
+    def offline(self) -> bool:
+        return self.session.breaker.is_open
+
+    # background work must never start the interactive authorization flow
+    @property
+    def authorized(self) -> bool:
+        return self.sp.auth_manager.get_cached_token() is not None
+
+    # Go through the authorization flow (opens the browser) and cache the token.
+    # The token may be of another account than the one the caches hold responses of
+    # (URLs like me/player are the same for every account), so they start over.
+    def authorize(self) -> None:
+        self.sp.auth_manager.get_access_token()
+        self.aio._token = None  # read again from the token cache
+        self.invalidate(*self._snapshot_caches(), "http")
+        self.radio.clear()
+
+    # True if the calling thread is inside cache_only()
+    @property
+    def is_cache_only(self) -> bool:
+        return getattr(self._local, "cache_only", False)
+
+    # within this block, cached reads of the calling thread never touch the network
+    # and return whatever is cached, however old it is
+    @contextmanager
+    def cache_only(self):
+        self._local.cache_only = True
+        try:
+            yield
+        finally:
+            self._local.cache_only = False
+
+    # Call one of the cached reads (by name) in the background, so that its result is there
+    # when needed. The same read is prefetched at most once every PREFETCH_INTERVAL seconds.
+    def prefetch(self, read: str, *args, **kwargs) -> None:
+        if self.offline:
+            return
+        key = (read, args, tuple(sorted(kwargs.items())))
+        if key in self._prefetch_times:
+            return
+        self._prefetch_times.set(key, True)
+        self.worker.submit(self._prefetch, read, args, kwargs, priority=LOW, key=key)
+
+    def _prefetch(self, read: str, args: tuple, kwargs: dict) -> None:
+        self._local.prefetching = True
+        try:
+            getattr(self, read)(*args, **kwargs)
+        finally:
+            self._local.prefetching = False
+
+    def _cached(self, cache: TTLCache, key, fetch, *args, **kwargs):
+        if self.is_cache_only:
+            result = cache.get(key, MISSING, stale=True)
+            if result is MISSING:
+                raise NotCached(key)
+            return result
+
+        prefetching = getattr(self._local, "prefetching", False)
+        # a prefetched result is served once, as long as it is fresh
+        if not prefetching and self._prefetched.pop(key, None):
+            result = cache.get(key, MISSING)
+            if result is not MISSING:
+                return result
+
+        try:
+            if prefetching:
+                result = fetch(*args, **kwargs)
+            else:
+                # somebody waits for this one, artwork downloads can wait instead
+                with self.thumbnails.pause():
+                    result = fetch(*args, **kwargs)
+        except API_ERRORS as e:
+            if isinstance(e, spotipy.SpotifyException) and e.http_status < 500:
+                raise
+            result = cache.get(key, MISSING, stale=True)
+            if result is MISSING:
+                raise
+            logger.debug(f"Spotify is unreachable ({e}), serving cached {key}")
+            return result
+
+        cache.set(key, result)
+        if prefetching:
+            self._prefetched.set(key, True)
+        self.thumbnails.add(_image_urls(result), urgent=not prefetching)
+        return result
+
+    # walk the artwork of the library in the background, at most once an hour
+    def sync_thumbnails_soon(self) -> None:
+        if time.time() - self._thumbnails_synced_at > self.THUMBNAILS_SYNC_INTERVAL:
+            self.worker.submit(self.sync_thumbnails, key="thumbnails-sync")
+
+    # queue the artwork of the first `max_saved` saved tracks and of the user's playlists
+    def sync_thumbnails(self, max_saved: int = 200) -> None:
+        if not self.authorized:
+            return
+        self._thumbnails_synced_at = time.time()
+        playlists = models.page(self._call("current_user_playlists", limit=50))
+        self.thumbnails.add(_image_urls(playlists))
+        for offset in range(0, max_saved, 50):
+            saved = self._call("current_user_saved_tracks", limit=50, offset=offset)
+            page = models.page(saved, unwrap=lambda item: item.get("track"))
+            self.thumbnails.add(_image_urls(page))
+            if not page.next:
+                break
+
+    def current_playback(self, market=None, additional_types=None):
+        key = ("playback", market, additional_types)
+        # the local player pushes its changes, so while it is active a recent state is up to date
+        if self._local_player_active():
+            result = self.playback_cache.get(key, MISSING)
+            if result is not MISSING:
+                return result
+
+        playback = self._cached(
+            self.playback_cache,
+            key,
+            _converted(models.playback, partial(self._call, "current_playback")),
+            market=market,
+            additional_types=additional_types,
+        )
+        self._on_playing(playback)
+        return playback
+
+    # the most recently used playback state, however old it is
+    def _last_playback(self) -> Optional[models.Playback]:
+        for key in reversed(self.playback_cache.keys()):
+            playback = self.playback_cache.get(key, stale=True)
+            if playback:
+                return playback
+        return None
+
+    # The local player is the active one if it is playing, or if it is paused
+    # and the Web API does not know of another device playing right now.
+    def _local_player_active(self) -> bool:
+        state = self.mpris.state()
+        if state is None or state["status"] not in ("Playing", "Paused"):
+            return False
+        if state["status"] == "Playing":
+            return True
+        playback = self._last_playback()
+        return not (playback and playback.is_playing)
+
+    # The local player pushed a new state, patch it into the cached playback states.
+    # Only if it is or was playing: a paused player may just show what another device plays.
+    def _on_local_change(self, previous: Optional[str], state: Optional[dict]) -> None:
+        if not state or "Playing" not in (previous, state["status"]):
+            return
+        for key in self.playback_cache.keys():
+            playback = self.playback_cache.get(key, stale=True)
+            if playback:
+                playback = _merge_local(playback, state)
+                self.playback_cache.set(key, playback)
+                self._on_playing(playback)
+
+    # Another track plays: prefetch its lyrics and those of the next LYRICS_AHEAD tracks
+    # in the queue, see LyricsCache.
+    def _on_playing(self, playback: Optional[models.Playback]) -> None:
+        track = playback.item if playback else None
+        if not isinstance(track, models.Track) or track.id == self._playing_id:
+            return
+        self._playing_id = track.id
+        self.lyrics.prefetch([track])
+        self.worker.submit(self._sync_queue, priority=LOW, key="queue-lyrics")
+
+    # the queue moved on: mirror it, and prefetch the lyrics of what is next
+    def _sync_queue(self) -> None:
+        self.play_queue.sync()
+        upcoming = self.play_queue.upcoming[: self.LYRICS_AHEAD]
+        self.lyrics.prefetch([i for i in upcoming if isinstance(i, models.Track)])
+
+    # Send a playback command to the local player if it is the active one (and the command
+    # has a local equivalent), to the Web API otherwise.
+    def _control(self, local: Optional[Callable], remote: Callable, *args, **kwargs):
+        self._local.local_command = bool(
+            local is not None and self._local_player_active() and local()
+        )
+        if not self._local.local_command:
+            return remote(*args, **kwargs)
+
+    def pause_playback(self, device_id=None):
+        local = self.mpris.pause if device_id is None else None
+        return self._control(
+            local, partial(self._call, "pause_playback"), device_id=device_id
+        )
+
+    def start_playback(self, device_id=None, context_uri=None, uris=None, offset=None):
+        local = None
+        if device_id is None and offset is None:
+            if not context_uri and not uris:
+                local = self.mpris.play
+            elif not uris:
+                local = partial(self.mpris.open_uri, context_uri)
+            elif not context_uri and len(uris) == 1:
+                local = partial(self.mpris.open_uri, uris[0])
+        return self._control(
+            local,
+            partial(self._call, "start_playback"),
+            device_id=device_id,
+            context_uri=context_uri,
+            uris=uris,
+            offset=offset,
+        )
+
+    def next_track(self, device_id=None):
+        local = self.mpris.next if device_id is None else None
+        return self._control(
+            local, partial(self._call, "next_track"), device_id=device_id
+        )
+
+    def previous_track(self, device_id=None):
+        local = self.mpris.previous if device_id is None else None
+        return self._control(
+            local, partial(self._call, "previous_track"), device_id=device_id
+        )
+
+    # Give the last playback command of the calling thread time to take effect, at most
+    # `timeout` seconds. The local player reports when it is done; what the Web API reports
+    # lags behind the player, so after a Web API command the full timeout is waited.
+    def wait_for_playback_change(self, timeout: float) -> None:
+        if getattr(self._local, "local_command", False):
+            self.mpris.wait_for_change(timeout)
+        else:
+            time.sleep(timeout)
+
+    def devices(self):
+        return self._cached(
+            self.devices_cache,
+            "devices",
+            _converted(models.devices, partial(self._call, "devices")),
+        )
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        key = (q, limit, offset, type, market)
+
+        # search results do not change within minutes, so a fresh cache hit saves the round trip
+        result = self.search_cache.get(key, MISSING)
+        if result is not MISSING:
+            return result
+
+        if self.is_cache_only:
+            result = self.search_cache.get(key, MISSING, stale=True)
+            if result is MISSING:
+                # while typing a longer query, narrow down what the shorter one returned
+                result = self.narrowed_search(q, limit, offset, type, market)
+            if result is None or result is MISSING:
+                raise NotCached(key)
+            return result
+
+        return self._cached(
+            self.search_cache,
+            key,
+            _converted(models.search_results, partial(self._call, "search")),
+            q,
+            limit=limit,
+            offset=offset,
+            type=type,
+            market=market,
+        )
+
+    def current_user_recently_played(self, limit=50, after=None, before=None):
+        return self._cached(
+            self.history_cache,
+            (limit, after, before),
+            _converted(
+                models.history, partial(self._call, "current_user_recently_played")
+            ),
+            limit=limit,
+            after=after,
+            before=before,
+        )
+
+    # One page of the tracks of an album or a playlist.
+    # Playlist pages are cached by the playlist's snapshot_id, which changes with every edit,
+    # so a page is downloaded again only if the playlist has changed since.
+    def collection_tracks(self, kind, id, snapshot_id=None, offset=0, limit=50):
+        key = (kind, id, snapshot_id, offset, limit)
+        result = self.tracks_cache.get(key, MISSING)
+        if result is not MISSING:
+            return result
+
+        if kind == "playlist":
+            fetch = partial(
+                _converted(
+                    partial(models.page, unwrap=lambda item: item.get("track")),
+                    partial(self._call, "playlist_items"),
+                ),
+                id,
+                fields=PLAYLIST_ITEMS_FIELDS,
+                limit=limit,
+                offset=offset,
+                additional_types=("track",),
+            )
+        else:
+            fetch = partial(
+                _converted(models.page, partial(self._call, "album_tracks")),
+                id,
+                limit=limit,
+                offset=offset,
+            )
+        return self._cached(self.tracks_cache, key, fetch)
+
+    # Queue `uri`, unless the extension queued it before and it has not played yet
+    # (see QueueMirror). Returns whether it was queued.
+    def add_to_queue(self, uri, device_id=None) -> bool:
+        if not self.play_queue.add(uri):
+            logger.debug(f"{uri} is in the queue already")
+            return False
+        try:
+            self._call("add_to_queue", uri, device_id=device_id)
+        except Exception:
+            self.play_queue.discard(uri)
+            raise
+        self.radio.mark_queued([uri])
+        self.play_queue.sync_soon()
+        return True
+
+    # A cached read of an artist's catalog, see artists_cache. A fresh cache hit does not
+    # touch the network at all.
+    def _artist_read(self, key, fetch, *args, **kwargs):
+        result = self.artists_cache.get(key, MISSING)
+        if result is not MISSING:
+            return result
+        return self._cached(self.artists_cache, key, fetch, *args, **kwargs)
+
+    def artist_top_tracks(self, artist_id, country="from_token"):
+        return self._artist_read(
+            ("top_tracks", artist_id, country),
+            _converted(
+                lambda data: models.page({"items": data["tracks"]}),
+                partial(self._call, "artist_top_tracks"),
+            ),
+            artist_id,
+            country=country,
+        )
+
+    def artist_albums(self, artist_id, album_type="album,single", limit=20):
+        return self._artist_read(
+            ("albums", artist_id, album_type, limit),
+            _converted(models.page, partial(self._call, "artist_albums")),
+            artist_id,
+            album_type=album_type,
+            limit=limit,
+        )
+
+    def artist_related_artists(self, artist_id):
+        return self._artist_read(
+            ("related", artist_id),
+            _converted(
+                lambda data: models.page({"items": data["artists"]}),
+                partial(self._call, "artist_related_artists"),
+            ),
+            artist_id,
+        )
+
+    # Liked state of the given track ids, as far as it is known.
+    # Ids that are not cached yet are looked up with one call per 50 of them;
+    # if that fails, they are simply left out.
+    def saved_tracks_contains(self, ids: list) -> dict:
+        unknown = [i for i in dict.fromkeys(ids) if i not in self.liked_cache]
+        if unknown and not self.is_cache_only:
+            try:
+                for chunk in _chunks(unknown, 50):
+                    liked = self._call("current_user_saved_tracks_contains", chunk)
+                    for track_id, state in zip(chunk, liked):
+                        self.liked_cache.set(track_id, state)
+            except API_ERRORS as e:
+                logger.debug(f"Could not look up liked state: {e}")
+
+        states = {i: self.liked_cache.get(i, MISSING, stale=True) for i in ids}
+        return {i: state for i, state in states.items() if state is not MISSING}
+
+    # saves in chunks of 50 (the most one request takes) and writes through to the liked state
+    def current_user_saved_tracks_add(self, tracks=None):
+        for chunk in _chunks(tracks or [], 50):
+            self._call("current_user_saved_tracks_add", chunk)
+            for track in chunk:
+                self.liked_cache.set(track.split(":")[-1], True)
+
+    # Results of the longest cached query that `q` extends, filtered locally: every word of `q`
+    # has to appear in the name, the artists or the album of an item. None if there is nothing
+    # to narrow down or nothing matches.
+    def narrowed_search(self, q, limit=10, offset=0, type="track", market=None):
+        q = q.lower()
+        prefixes = [
+            key
+            for key in self.search_cache.keys()
+            if key[1:] == (limit, offset, type, market) and q.startswith(key[0].lower())
+        ]
+        if not prefixes:
+            return None
+        key = max(prefixes, key=lambda k: len(k[0]))
+        result = self.search_cache.get(key, stale=True)
+        if not result:
+            return None
+
+        words = q.split()
+        narrowed = {
+            category: page.replace(
+                items=tuple(i for i in page.items if _matches(i, words))
+            )
+            for category, page in result.items()
+        }
+        if not any(page.items for page in narrowed.values()):
+            return None
+
+        logger.debug(f"Narrowed cached results of \"{key[0]}\" down to \"{q}\"")
+        return narrowed
+
+
+def _matches(item: models.Model, words: list) -> bool:
+    fields = [item.name, getattr(item, "artists", "")]
+    if getattr(item, "album", None):
+        fields.append(item.album.name)
+    text = " ".join(fields).lower()
+    return all(word in text for word in words)
+
+
+# Playback state (from the Web API) updated with the state of the local player.
+# The player knows less than the Web API: a track it switched to gets an item with
+# just what the launcher shows.
+def _merge_local(playback: models.Playback, state: dict) -> models.Playback:
+    playback = playback.replace(is_playing=state["status"] == "Playing")
+    metadata = state["metadata"]
+    # "spotify:track:<id>", or "/com/spotify/track/<id>" with newer clients
+    parts = re.split("[:/]", metadata.get("mpris:trackid", ""))
+    if len(parts) < 2 or parts[-2] not in ("track", "episode"):
+        return playback
+    kind, item_id = parts[-2], parts[-1]
+    if playback.item and playback.item.id == item_id:
+        return playback
+
+    uri = f"spotify:{kind}:{item_id}"
+    name = metadata.get("xesam:title", "")
+    album = metadata.get("xesam:album", "")
+    duration_ms = metadata.get("mpris:length", 0) // 1000
+    if kind == "track":
+        artists = metadata.get("xesam:artist", [])
+        item = models.Track(
+            item_id,
+            uri,
+            name,
+            (),
+            tuple(models.intern_name(artist) for artist in artists),
+            models.Album(
+                name=album, artist_names=(), image=metadata.get("mpris:artUrl")
+            ),
+            duration_ms,
+        )
+    else:
+        item = models.Episode(
+            item_id, uri, name, album, duration_ms, metadata.get("mpris:artUrl")
+        )
+    return playback.replace(item=item, currently_playing_type=kind, progress_ms=0)
+
+
+# image urls of whatever a cached read returned
+def _image_urls(result) -> list:
+    if isinstance(result, dict):
+        return [url for page in result.values() for url in _image_urls(page)]
+    if isinstance(result, models.Page):
+        return [item.image for item in result.items if item.image]
+    if isinstance(result, models.Playback) and result.item and result.item.image:
+        return [result.item.image]
+    return []
+
+
+# wraps `fetch` to convert what it returns into records
+def _converted(convert: Callable, fetch: Callable) -> Callable:
+    def fetch_converted(*args, **kwargs):
+        return convert(fetch(*args, **kwargs))
+
+    return fetch_converted
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
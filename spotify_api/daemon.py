@@ -0,0 +1,380 @@
+"""
+Optional long-lived process that owns the SpotifyClient: the spotipy session and its connection
+pool, the token, the caches, the prefetch worker, the radio and the similarity index.
+Launcher frontends talk to it over a Unix socket through DaemonClient, which stands in for
+SpotifyClient, so warm state survives launcher restarts and several frontends share one
+client (and one rate limit budget).
+
+Protocol: one JSON object per line in each direction.
+Requests are {"op": "hello" | "shutdown" | "get" | "len" | "call", "path": "radio.peek", ...},
+responses are {"result": ...} or {"error": {"type": ..., "msg": ...}}.
+"hello" answers with the protocol version and the options the daemon was started with, a
+frontend replaces a daemon that differs in either.
+Records (see models.py) are sent as {"__model__": ..., "fields": [...]} in both directions.
+
+Usage: python -m spotify_api.daemon --socket PATH --client-id ID --scope SCOPE
+       --redirect-uri URI --token-cache FILE --data-dir DIR
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Optional
+
+import requests
+import spotipy
+from spotipy.oauth2 import SpotifyPKCE
+
+from . import models
+from .client import NotCached, QueryCancelled, SpotifyClient
+from .mpris import BUS_NAME
+
+logger = logging.getLogger(__name__)
+
+# bumped whenever the protocol changes, a daemon speaking another version is replaced
+PROTOCOL = 5
+JSON_TYPES = (type(None), bool, int, float, str, list, tuple, dict, models.Model)
+
+
+def default_socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(runtime_dir, f"ulauncher-spotify-api-{os.getuid()}.sock")
+
+
+# exceptions travel over the socket as dicts and are raised again on the client side
+def _dump_error(e: Exception) -> dict:
+    if isinstance(e, spotipy.SpotifyException):
+        return {
+            "type": "spotify",
+            "msg": e.msg,
+            "http_status": e.http_status,
+            "code": e.code,
+        }
+    if isinstance(e, spotipy.SpotifyOauthError):
+        return {"type": "oauth", "msg": str(e)}
+    if isinstance(e, NotCached):
+        return {"type": "not_cached", "msg": str(e)}
+    if isinstance(e, QueryCancelled):
+        return {"type": "cancelled", "msg": str(e)}
+    if isinstance(e, requests.exceptions.RequestException):
+        return {"type": "connection", "msg": str(e)}
+    return {"type": "error", "msg": f"{type(e).__name__}: {e}"}
+
+
+def _load_error(error: dict) -> Exception:
+    if error["type"] == "spotify":
+        return spotipy.SpotifyException(error["http_status"], error["code"], error["msg"])
+    if error["type"] == "oauth":
+        return spotipy.SpotifyOauthError(error["msg"])
+    if error["type"] == "not_cached":
+        return NotCached(error["msg"])
+    if error["type"] == "cancelled":
+        return QueryCancelled(error["msg"])
+    if error["type"] == "connection":
+        return requests.exceptions.ConnectionError(error["msg"])
+    return RuntimeError(error["msg"])
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line, object_hook=models.from_json)
+                response = {"result": self.server.dispatch(request)}
+                # results that can not be sent are an error like any other
+                data = json.dumps(response, default=models.to_json)
+            except Exception as e:
+                data = json.dumps({"error": _dump_error(e)})
+            self.wfile.write(data.encode() + b"\n")
+
+
+class SpotifyDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, client: SpotifyClient, options: dict = None):
+        self.client = client
+        self.options = options or {}  # what the client was built from, see _options()
+        if os.path.exists(path):
+            os.unlink(path)
+        # the socket gives full access to the user's Spotify account, keep it private
+        umask = os.umask(0o077)
+        try:
+            super(SpotifyDaemon, self).__init__(path, _Handler)
+        finally:
+            os.umask(umask)
+        # a daemon replacing this one binds the same path, see main()
+        self.socket_inode = os.stat(path).st_ino
+
+    def dispatch(self, request: dict):
+        op = request["op"]
+        if op == "hello":
+            return {"protocol": PROTOCOL, "options": self.options}
+        if op == "shutdown":
+            threading.Thread(target=self.shutdown).start()
+            return None
+
+        target = self.client
+        for name in request["path"].split("."):
+            if name.startswith("_"):
+                raise AttributeError(f"{name} is private")
+            target = getattr(target, name)
+
+        if op == "get":
+            if callable(target):
+                return {"callable": True}
+            if not isinstance(target, JSON_TYPES):
+                return {"object": True}
+            return {"value": target}
+        if op == "len":
+            return len(target)
+        if op == "call":
+            with contextlib.ExitStack() as stack:
+                if request.get("cache_only"):
+                    stack.enter_context(self.client.cache_only())
+                if request.get("query") is not None:
+                    stack.enter_context(self.client.query(request["query"]))
+                return target(*request["args"], **request["kwargs"])
+        raise ValueError(f"Unknown operation {op}")
+
+
+class _RemoteObject:
+    # attribute path on the daemon's SpotifyClient, e.g. "radio"
+    def __init__(self, daemon: "DaemonClient", path: str):
+        self._daemon = daemon
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._daemon._get(f"{self._path}.{name}" if self._path else name)
+
+    def __len__(self) -> int:
+        return self._daemon._send({"op": "len", "path": self._path})
+
+
+class _RemoteMethod:
+    def __init__(self, daemon: "DaemonClient", path: str):
+        self._daemon = daemon
+        self._path = path
+        self.__name__ = path.rsplit(".", 1)[-1]
+
+    def __call__(self, *args, **kwargs):
+        return self._daemon._send(
+            {
+                "op": "call",
+                "path": self._path,
+                "args": args,
+                "kwargs": kwargs,
+                "cache_only": self._daemon.is_cache_only,
+                "query": getattr(self._daemon._local, "query", None),
+            }
+        )
+
+
+class DaemonClient(_RemoteObject):
+    # Stands in for SpotifyClient: attributes are looked up on the daemon's client,
+    # methods are called there. Every thread uses its own connection.
+
+    def __init__(self, path: str):
+        super(DaemonClient, self).__init__(self, "")
+        self.socket_path = path
+        self._local = threading.local()
+        self._kinds = {}  # attribute path -> _RemoteMethod or _RemoteObject
+
+    # cache_only() applies to the calling thread, so it is tracked here and sent along with calls
+    @property
+    def is_cache_only(self) -> bool:
+        return getattr(self._local, "cache_only", False)
+
+    def cache_only(self):
+        return _Scoped(self._local, "cache_only", True, False)
+
+    # the query token is tracked the same way, cancel() is called on the daemon
+    def query(self, token):
+        return _Scoped(self._local, "query", token, None)
+
+    # The daemon and its client keep running for the next launcher, only the connections
+    # of this one are closed. Never forwarded: it would close the daemon's client.
+    def close(self) -> None:
+        stream = getattr(self._local, "stream", None)
+        if stream is not None:
+            stream.close()
+            self._local.stream = None
+
+    def _connection(self):
+        stream = getattr(self._local, "stream", None)
+        if stream is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            stream = self._local.stream = sock.makefile("rwb")
+        return stream
+
+    def _send(self, request: dict):
+        try:
+            stream = self._connection()
+            data = json.dumps(request, default=models.to_json)
+            stream.write(data.encode() + b"\n")
+            stream.flush()
+            line = stream.readline()
+        except OSError as e:
+            self._local.stream = None
+            raise requests.exceptions.ConnectionError(f"Daemon is not reachable: {e}")
+        if not line:
+            self._local.stream = None
+            raise requests.exceptions.ConnectionError("Daemon closed the connection")
+
+        response = json.loads(line, object_hook=models.from_json)
+        if "error" in response:
+            raise _load_error(response["error"])
+        return response["result"]
+
+    def _get(self, path: str):
+        if path in self._kinds:
+            return self._kinds[path]
+        result = self._send({"op": "get", "path": path})
+        if "value" in result:
+            # plain values (properties, flags) can change, so they are never remembered
+            return result["value"]
+        kind = _RemoteMethod if result.get("callable") else _RemoteObject
+        self._kinds[path] = kind(self, path)
+        return self._kinds[path]
+
+    # {"protocol": ..., "options": ...} of the daemon, None if it is not running
+    def hello(self) -> Optional[dict]:
+        try:
+            return self._send({"op": "hello"})
+        except requests.exceptions.ConnectionError:
+            return None
+
+    def shutdown(self) -> None:
+        self._send({"op": "shutdown"})
+
+
+# sets a thread-local attribute for the duration of a with block
+class _Scoped:
+    def __init__(self, local: threading.local, name: str, value, default):
+        self._local = local
+        self._name = name
+        self._value = value
+        self._default = default
+
+    def __enter__(self):
+        setattr(self._local, self._name, self._value)
+
+    def __exit__(self, *exc):
+        setattr(self._local, self._name, self._default)
+
+
+# Connect to the daemon at `path`, starting it with `daemon_args` if it is not running,
+# or if it speaks another protocol version or was started with other arguments (e.g. another
+# redirect uri). None if it could not be reached.
+def connect(
+    path: str, daemon_args: List[str], timeout: float = 5.0
+) -> Optional[DaemonClient]:
+    client = DaemonClient(path)
+    expected = {
+        "protocol": PROTOCOL,
+        "options": _options(_parser().parse_args(["--socket", path, *daemon_args])),
+    }
+    found = client.hello()
+    if found == expected:
+        return client
+
+    if found is not None:
+        logger.debug(f"Replacing daemon {found}")
+        stop(client)
+
+    logger.debug(f"Starting daemon on {path}")
+    subprocess.Popen(
+        [sys.executable, "-m", "spotify_api.daemon", "--socket", path, *daemon_args],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,  # outlives the launcher
+    )
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if client.hello() == expected:
+            return client
+        time.sleep(0.1)
+    return None
+
+
+# Shut the daemon down and wait until it is gone, its radio and snapshots included;
+# False if it is still running after `timeout` seconds.
+def stop(client: DaemonClient, timeout: float = 5.0) -> bool:
+    try:
+        client.shutdown()
+    except requests.exceptions.ConnectionError:
+        return True
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if client.hello() is None:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+# the options of the client a daemon runs, as started with `args`
+def _options(args: argparse.Namespace) -> dict:
+    return {
+        name: value
+        for name, value in vars(args).items()
+        if name not in ("socket", "debug")
+    }
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--socket", default=default_socket_path())
+    parser.add_argument("--client-id", required=True)
+    parser.add_argument("--scope", required=True)
+    parser.add_argument("--redirect-uri", required=True)
+    parser.add_argument("--token-cache", required=True)
+    parser.add_argument("--data-dir", required=True)
+    parser.add_argument("--mpris-name", default=BUS_NAME)
+    parser.add_argument("--debug", action="store_true")
+    return parser
+
+
+def main():
+    args = _parser().parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    auth = SpotifyPKCE(
+        client_id=args.client_id,
+        redirect_uri=args.redirect_uri,
+        scope=args.scope,
+        cache_path=args.token_cache,
+    )
+    server = SpotifyDaemon(
+        args.socket,
+        SpotifyClient(auth, args.data_dir, args.mpris_name),
+        _options(args),
+    )
+    logger.info(f"Listening on {args.socket}")
+    try:
+        server.serve_forever()
+    finally:
+        server.client.save_snapshot()
+        server.client.close()
+        server.server_close()
+        # unless a daemon replacing this one has bound the path in the meantime
+        with contextlib.suppress(OSError):
+            if os.stat(args.socket).st_ino == server.socket_inode:
+                os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
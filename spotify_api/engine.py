@@ -0,0 +1,2193 @@
+"""
+The commands of the extension (search, history, switch, volume, ...), independent of Ulauncher.
+Queries and picked items go in, plain records describing what to show come out: main.py turns
+them into Ulauncher items, the command line (python -m spotify_api) prints them.
+"""
+
+import gettext
+import logging
+import math
+import os
+import random
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Union
+from urllib.parse import quote_plus
+
+import requests
+import spotipy
+from spotipy.oauth2 import SpotifyPKCE
+
+from . import daemon, thumbnails
+from .actions import ActionExecutor, ActionFailed
+from .client import API_ERRORS, NotCached, QueryCancelled, SpotifyClient
+from .models import Model
+
+logger = logging.getLogger(__name__)
+_ = gettext.gettext
+
+# where the extension lives: its images, translations, token and caches
+EXTENSION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# one entry of the result list
+class Item(Model):
+    __slots__ = ("title", "description", "icon", "small", "action", "alt_action")
+
+
+# What happens when an item is picked. The names follow the Ulauncher actions they stand for.
+class Action(Model):
+    __slots__ = ()
+
+
+class HideWindowAction(Action):
+    __slots__ = ()
+
+
+class DoNothingAction(Action):
+    __slots__ = ()
+
+
+class SetUserQueryAction(Action):
+    __slots__ = ("query",)
+
+
+class OpenUrlAction(Action):
+    __slots__ = ("url",)
+
+
+# `data` goes to SpotifyEngine.on_item_enter()
+class CustomAction(Action):
+    __slots__ = ("data", "keep_open")
+
+
+class RenderResultListAction(Action):
+    __slots__ = ("items",)
+
+
+class SpotifyEngine:
+    CLIENT_ID = "1f3a663c5fdd4056b4c0e122ea55a3af"
+    SCOPES = "user-modify-playback-state user-read-playback-state user-read-recently-played user-library-modify user-library-read"
+    CACHE_FOLDER = os.path.join(EXTENSION_DIR, "cache")
+    ACCESS_TOKEN_CACHE = os.path.join(EXTENSION_DIR, "cache.json")
+    POSSIBLE_PORTS = [8080, 5000, 5050, 6666]  # spotify API redirect uris
+    ICONS = {
+        "main": os.path.join(EXTENSION_DIR, "images/icon.png"),
+        "play": os.path.join(EXTENSION_DIR, "images/play.png"),
+        "pause": os.path.join(EXTENSION_DIR, "images/pause.png"),
+        "next": os.path.join(EXTENSION_DIR, "images/next.png"),
+        "prev": os.path.join(EXTENSION_DIR, "images/prev.png"),
+        "repeat_off": os.path.join(EXTENSION_DIR, "images/repeat_off.png"),
+        "repeat_context": os.path.join(
+            EXTENSION_DIR, "images/repeat_context.png"
+        ),
+        "repeat_track": os.path.join(
+            EXTENSION_DIR, "images/repeat_track.png"
+        ),
+        "shuffle": os.path.join(EXTENSION_DIR, "images/shuffle_on.png"),
+        "no_shuffle": os.path.join(EXTENSION_DIR, "images/shuffle_off.png"),
+        "question": os.path.join(EXTENSION_DIR, "images/question.png"),
+        "track": os.path.join(EXTENSION_DIR, "images/track.png"),
+        "album": os.path.join(EXTENSION_DIR, "images/album.png"),
+        "playlist": os.path.join(EXTENSION_DIR, "images/playlist.png"),
+        "artist": os.path.join(EXTENSION_DIR, "images/artist.png"),
+        "search": os.path.join(EXTENSION_DIR, "images/search.png"),
+        "devices": os.path.join(EXTENSION_DIR, "images/devices.png"),
+        "volume": os.path.join(EXTENSION_DIR, "images/volume.png"),
+        "mute": os.path.join(EXTENSION_DIR, "images/mute.png"),
+        "save": os.path.join(EXTENSION_DIR, "images/save.png"),
+        "lyrics": os.path.join(EXTENSION_DIR, "images/lyrics.png"),
+        "history": os.path.join(EXTENSION_DIR, "images/history.png"),
+        "note": os.path.join(EXTENSION_DIR, "images/note.png"),
+    }
+    LANGUAGES = [
+        "de",
+        "en",
+    ]
+    SEARCH_COMMANDS = ["album", "track", "artist", "playlist", "search"]
+    # what `search` looks for, in the order the categories are shown
+    SEARCH_CATEGORIES = ["track", "album", "artist", "playlist"]
+    # item commands that only change something on Spotify, see _run_command()
+    BACKGROUND_COMMANDS = [
+        "pause",
+        "play",
+        "radio",
+        "queue",
+        "next",
+        "prev",
+        "switch",
+        "shuffle",
+        "repeat",
+        "volume",
+        "save_tracks",
+        "recommendations",
+    ]
+    TRACKS_PAGE_SIZE = 50
+    # What a preference change has to redo, see on_preferences_update(). All other
+    # preferences are read where they are used, so they take effect with the next query and
+    # leave the client, its connections and its caches alone.
+    PREFERENCE_HOOKS = {
+        "auth_port": "_regenerate_api",
+        "use_daemon": "_regenerate_api",
+        "aliases": "_generate_aliases",
+        "thumbnail_bandwidth": "_configure_thumbnails",
+        "thumbnail_threads": "_configure_thumbnails",
+        "lyrics_provider": "_change_lyrics_provider",
+    }
+    # Web API reads commands start with, prefetched while the command is still being typed
+    SPECULATIVE_READS = {
+        "switch": ("devices", {}),
+        "repeat": ("current_playback", {}),
+        "shuffle": ("current_playback", {}),
+        "volume": ("current_playback", {"additional_types": "episode"}),
+        "save": ("current_playback", {"additional_types": "episode"}),
+        "lyrics": ("current_playback", {"additional_types": "episode"}),
+        "recommendations": ("current_playback", {"additional_types": "episode"}),
+        "similar": ("current_playback", {"additional_types": "episode"}),
+        "history": ("current_user_recently_played", {}),
+    }
+
+    def __init__(self):
+        # create image cache folder if it doesn't exist
+        if not os.path.exists(self.CACHE_FOLDER):
+            os.mkdir(self.CACHE_FOLDER)
+
+        # api placeholder
+        self.api = None
+
+        # preferences placeholder with default settings
+        # in case existing user upgrades and initial preferences are empty
+        self.preferences = {
+            "main_keyword": "sp",
+            "main_language": "en",
+            "auth_port": "8080",
+            "clear_cache": "No",
+            "show_help": "Yes",
+            "aliases": "s: search; song: track; vol: volume; like: save; reco: recommendations; ?: help",
+            "search_results_limit": "8",
+            "request_timeout": "0.5",
+            "query_deadline": "300",
+            "incremental_search": "Yes",
+            "use_daemon": "No",
+            "thumbnail_bandwidth": "200",
+            "thumbnail_threads": "2",
+            "failure_notifications": "No",
+            "search_fanout": "Yes",
+            "lyrics_provider": "none",
+        }
+
+        # aliases placeholder
+        self.aliases = {}
+
+        # commands picked without keeping the window open run here, see BACKGROUND_COMMANDS
+        self.actions = ActionExecutor(on_failure=self._on_action_failure)
+
+        # parts of one result list are built here at the same time, see _concurrently()
+        self.pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="sections")
+        # token and progress callback of the query the calling thread runs
+        self._local = threading.local()
+
+    def _generate_api(self):
+        logger.debug("Generating Spotipy object")
+        redirect_uri = "http://127.0.0.1:" + str(self.preferences["auth_port"])
+        if int(self.preferences["auth_port"]) not in self.POSSIBLE_PORTS:
+            logger.debug(
+                _("Port set in the preferences is not one of the supported ports.")
+            )
+            logger.debug(
+                _("Something went very wrong, please report this issue on github.")
+            )
+
+        if self.preferences["use_daemon"] == "Yes":
+            self.api = daemon.connect(
+                daemon.default_socket_path(),
+                [
+                    "--client-id",
+                    self.CLIENT_ID,
+                    "--scope",
+                    self.SCOPES,
+                    "--redirect-uri",
+                    redirect_uri,
+                    "--token-cache",
+                    self.ACCESS_TOKEN_CACHE,
+                    "--data-dir",
+                    EXTENSION_DIR,
+                ],
+            )
+            if self.api is None:
+                logger.debug("Could not reach the daemon, falling back to in-process client")
+        else:
+            self.api = None
+
+        if self.api is None:
+            auth = SpotifyPKCE(
+                client_id=self.CLIENT_ID,
+                redirect_uri=redirect_uri,
+                scope=self.SCOPES,
+                cache_path=self.ACCESS_TOKEN_CACHE,
+            )
+            self.api = SpotifyClient(auth, EXTENSION_DIR)
+
+        self._configure_thumbnails()
+        self._configure_lyrics()
+        return
+
+    # the preferences are free text, a typo falls back to the defaults
+    def _configure_thumbnails(self) -> None:
+        try:
+            bandwidth = max(int(self.preferences["thumbnail_bandwidth"]), 0)
+        except ValueError:
+            logger.debug("Thumbnail bandwidth is not a number, using the default")
+            bandwidth = 200
+        try:
+            threads = max(int(self.preferences["thumbnail_threads"]), 1)
+        except ValueError:
+            logger.debug("Thumbnail threads is not a number, using the default")
+            threads = 2
+        self.api.thumbnails.configure(bandwidth * 1024, threads)
+
+    def _configure_lyrics(self) -> None:
+        self.api.lyrics.configure(self.preferences["lyrics_provider"])
+
+    # lyrics from the previous provider are not what the user asked for anymore
+    def _change_lyrics_provider(self) -> None:
+        self._configure_lyrics()
+        self.api.invalidate("lyrics")
+
+    # generate aliases
+    def _generate_aliases(self):
+        logger.debug(f"Generating aliases")
+        self.aliases = {
+            k: v
+            for k, v in [p.split(": ") for p in self.preferences["aliases"].split("; ")]
+        }
+        return
+
+    def _clear_cache(self) -> None:
+        shutil.rmtree(self.CACHE_FOLDER, ignore_errors=True)
+        return
+
+    # download image to cache and return path to the cached image
+    def _dl_image(self, url: str) -> str:
+        cache_path = thumbnails.cache_path(self.CACHE_FOLDER, url)
+
+        if os.path.exists(cache_path):
+            return cache_path
+        elif self.api.is_cache_only:
+            # partial results are rendered without artwork that is not downloaded yet
+            return self.ICONS["main"]
+        else:
+            # usually the prefetcher was faster, otherwise background downloads wait for this one
+            try:
+                return self.api.thumbnails.download(url)
+            except requests.exceptions.RequestException as e:
+                logger.debug(f"Could not download {url}: {e}")
+                return self.ICONS["main"]
+
+    # helper for humanizing duration in ms
+    def _parse_duration(self, ms: int, short: bool = False) -> str:
+        hours, ms = divmod(ms, 3600000)
+        minutes, ms = divmod(ms, 60000)
+        seconds = float(ms) / 1000
+
+        if short:
+            if hours:
+                return f"{hours:.0f}:{minutes:02.0f}:{seconds:02.0f}"
+            return f"{minutes:.0f}:{seconds:02.0f}"
+        else:
+            duration = ""
+            if hours:
+                duration += f"{hours:.0f}h"
+            if minutes:
+                duration += f"{minutes:.0f}m"
+            if seconds:
+                duration += f" {seconds:.0f}s"
+            return duration
+
+    # a wrapper helper to generate an item
+    def _generate_item(
+        self,
+        title: str = "",
+        desc: str = "",
+        icon: str = "",
+        small: bool = False,
+        action: Union[dict, Action] = DoNothingAction(),
+        alt_action: Union[dict, Action] = DoNothingAction(),
+        keep_open: bool = False,
+        alt_keep_open: bool = None,
+    ) -> Item:
+
+        if alt_keep_open is None:
+            alt_keep_open = keep_open
+
+        if isinstance(action, dict):
+            action["_keep_app_open"] = keep_open
+            action = CustomAction(action, keep_open)
+        if isinstance(alt_action, dict):
+            alt_action["_keep_app_open"] = alt_keep_open
+            alt_action = CustomAction(alt_action, alt_keep_open)
+
+        return Item(
+            title or "",
+            desc or "",
+            icon or self.ICONS["main"],
+            small,
+            action or DoNothingAction(),
+            alt_action or DoNothingAction(),
+        )
+
+    # helper for the currently playing entries
+    def _generate_now_playing_menu(
+        self,
+        currently_playing: dict = None,
+        next: bool = True,
+        prev: bool = True,
+        help: bool = True,
+    ):
+
+        if not currently_playing:
+            currently_playing = self.api.current_playback(additional_types="episode")
+
+        if not currently_playing or not currently_playing.item:
+            return self._generate_item(
+                _("Nothing is playing at this moment"),
+                _("Start playing first"),
+                action=HideWindowAction(),
+            )
+
+        item = currently_playing.item
+        device = currently_playing.device
+        if currently_playing.currently_playing_type == "track":
+            artists = item.artists
+            song_name = item.name
+            album_name = item.album.name if item.album else ""
+            device_playing_on_type = device.type.lower() if device else ""
+            device_playing_on_name = device.name if device else ""
+            is_playing = currently_playing.is_playing
+            status = _("Playing") if is_playing else _("Paused")
+            track_progress = self._parse_duration(
+                currently_playing.progress_ms, short=True
+            )
+            track_duration = self._parse_duration(item.duration_ms, short=True)
+
+            items = [
+                self._generate_item(
+                    f"{artists} -- {song_name}",
+                    f'{_("Album")}: {album_name} | '
+                    f'{status} {_("on")}: {device_playing_on_type} {device_playing_on_name} | '
+                    f"{track_progress}/{track_duration}",
+                    self.ICONS["pause"] if is_playing else self.ICONS["play"],
+                    action={"command": "pause" if is_playing else "play"},
+                    keep_open=True if not is_playing else False,
+                )
+            ]
+
+        elif currently_playing.currently_playing_type == "episode":
+            show = item.show_name
+            episode = item.name
+            device_playing_on_type = device.type.lower() if device else ""
+            device_playing_on_name = device.name if device else ""
+            is_playing = currently_playing.is_playing
+            status = _("Playing") if is_playing else _("Paused")
+            episode_progress = self._parse_duration(
+                currently_playing.progress_ms, short=True
+            )
+            episode_duration = self._parse_duration(item.duration_ms, short=True)
+
+            items = [
+                self._generate_item(
+                    f"{episode}",
+                    f"{show} | "
+                    f'{status} {_("on")}: {device_playing_on_type} {device_playing_on_name} | '
+                    f"{episode_progress}/{episode_duration}",
+                    self.ICONS["pause"] if is_playing else self.ICONS["play"],
+                    action={"command": "pause" if is_playing else "play"},
+                    keep_open=True if not is_playing else False,
+                )
+            ]
+        else:
+            return
+
+        if next:
+            items.append(
+                self._generate_item(
+                    _("Next track"),
+                    _("Skip playback to next track"),
+                    self.ICONS["next"],
+                    action={"command": "next"},
+                    keep_open=True,
+                )
+            )
+
+        if prev:
+            items.append(
+                self._generate_item(
+                    _("Previous track"),
+                    _("Skip playback to previous track"),
+                    self.ICONS["prev"],
+                    action={"command": "prev"},
+                    keep_open=True,
+                )
+            )
+
+        if help and self.preferences["show_help"] == "Yes":
+            items.append(
+                self._generate_item(
+                    _("Extension cheatsheet"),
+                    _("List of all available commands"),
+                    self.ICONS["question"],
+                    action=SetUserQueryAction(f"sp help"),
+                )
+            )
+        return items
+
+    # helper for the entries shown when Spotify can not be reached
+    def _generate_offline_item(self, cached: bool = True):
+        if cached:
+            return self._generate_item(
+                _("Spotify is unreachable"),
+                _("Showing cached data, reconnecting in the background"),
+                self.ICONS["question"],
+                small=True,
+                action=DoNothingAction(),
+            )
+        return self._generate_item(
+            _("Spotify is unreachable"),
+            _("Check your internet connection and try again"),
+            self.ICONS["question"],
+            action=HideWindowAction(),
+        )
+
+    # search results (one page of them) as items
+    # `more_query` (the search of just this category) replaces paging, see search_fanout
+    def _generate_search_items(
+        self,
+        query: str,
+        type_search: str,
+        limit: int,
+        offset: int = 0,
+        more_query: str = None,
+    ) -> list:
+        search_results = self.api.search(
+            query, limit=limit, offset=offset, type=type_search
+        )
+        if not search_results:
+            return [
+                self._generate_item(
+                    f'{_("Nothing found for")} {query}',
+                    _("Try again with different query?"),
+                    action=DoNothingAction(),
+                )
+            ]
+
+        items = []
+        results = [item for page in search_results.values() for item in page.items]
+        liked = self.api.saved_tracks_contains(
+            [res.id for res in results if res.type == "track"]
+        )
+
+        for res in results:
+            category = res.type
+            context_or_track_uri = "uris" if category == "track" else "context_uri"
+            uri = res.uri
+            img = self._dl_image(res.image) if res.image else self.ICONS["main"]
+            alt_action = DoNothingAction()
+
+            if category == "album":
+                title = f"{res.artists} -- {res.name}"
+                desc = f'{_("Album")} | {res.total_tracks} {_("tracks")} | Released {res.release_date}'
+                alt_action = {
+                    "command": "tracks",
+                    "kind": category,
+                    "id": res.id,
+                    "uri": uri,
+                    "name": title,
+                    "icon": img,
+                }
+
+            elif category == "artist":
+                genres = ", ".join(res.genres).capitalize()
+                genres_output = f" | {genres}" if genres else ""
+
+                title = f"{res.name}"
+                desc = f'{_("Artist")}{genres_output} | {_("Popularity")} {res.popularity}%'
+                alt_action = {
+                    "command": "artist",
+                    "id": res.id,
+                    "uri": uri,
+                    "name": title,
+                    "icon": img,
+                }
+
+            elif category == "track":
+                album_name = res.album.name if res.album else ""
+                duration = self._parse_duration(res.duration_ms)
+
+                title = f"{res.artists} -- {res.name}"
+                kind = _("Liked track") if liked.get(res.id) else _("Track")
+                desc = f'{kind} | {duration} | {_("Popularity")} {res.popularity}% | {album_name}'
+                alt_action = {"command": "queue", "uri": uri}
+                uri = [uri]
+
+            elif category == "playlist":
+                description = f" | {res.description}" if res.description else ""
+
+                title = f"{res.name}"
+                desc = f'{_("Playlist by")} {res.owner} | {res.total_tracks} {_("tracks")}{description}'
+                alt_action = {
+                    "command": "tracks",
+                    "kind": category,
+                    "id": res.id,
+                    "uri": uri,
+                    "snapshot_id": res.snapshot_id,
+                    "name": title,
+                    "icon": img,
+                }
+            else:
+                raise RuntimeError("Wrong category received from Spotify api?")
+
+            items.append(
+                self._generate_item(
+                    title,
+                    desc,
+                    img,
+                    action={"command": "play", context_or_track_uri: uri},
+                    alt_action=alt_action,
+                    keep_open=False,
+                    # albums and playlists open their track listing on alt-enter,
+                    # artists their top tracks, albums and related artists
+                    alt_keep_open=category in ["album", "playlist", "artist"],
+                )
+            )
+
+        not_liked = [
+            res.uri
+            for res in results
+            if res.type == "track" and liked.get(res.id) is False
+        ]
+        if not_liked:
+            items.append(self._generate_save_all_item(not_liked))
+
+        if more_query and any(page.next for page in search_results.values()):
+            items.append(
+                self._generate_item(
+                    f'{_("More results")}: {more_query}',
+                    icon=self.ICONS["search"],
+                    small=True,
+                    action=SetUserQueryAction(more_query),
+                )
+            )
+        # offer the next page if any category has one, and fetch it in the meantime
+        elif any(page.next for page in search_results.values()):
+            next_page = {
+                "query": query,
+                "type": type_search,
+                "limit": limit,
+                "offset": offset + limit,
+            }
+            items.append(
+                self._generate_item(
+                    _("More results"),
+                    _("Load the next page of results"),
+                    self.ICONS["search"],
+                    action={"command": "search_page", **next_page},
+                    keep_open=True,
+                )
+            )
+            if not self.api.is_cache_only:
+                self.api.prefetch(
+                    "search",
+                    query,
+                    limit=limit,
+                    offset=offset + limit,
+                    type=type_search,
+                )
+
+        return items
+
+    # General search as one search per category, all sent at the same time.
+    # Every category shows up (in the order of SEARCH_CATEGORIES) as soon as it is there,
+    # artwork included, so a slow one does not hold up the others.
+    def _generate_fanout_search_items(self, keyword: str, query: str) -> list:
+        limit = int(self.preferences["search_results_limit"])
+
+        def category_items(category):
+            more_query = f"{keyword} {category} {query}"
+            return self._generate_search_items(
+                query, category, limit, more_query=more_query
+            )
+
+        def placeholder(category):
+            return self._generate_item(
+                f'{category.capitalize()}: {_("Loading...")}',
+                icon=self.ICONS[category],
+                small=True,
+            )
+
+        def failed(category, e):
+            return self._generate_section_error_item(category.capitalize(), e)
+
+        sections = self._concurrently(
+            self.SEARCH_CATEGORIES, category_items, placeholder, failed
+        )
+        items = [item for section in sections for item in section]
+        if not items:
+            return [
+                self._generate_item(
+                    f'{_("Nothing found for")} {query}',
+                    _("Try again with different query?"),
+                    action=DoNothingAction(),
+                )
+            ]
+        return items
+
+    # Track listing of an album or a playlist (one page of it), started from its search result.
+    # Every track row uses the collection's own artwork, which is already downloaded.
+    def _generate_collection_items(self, collection: dict, offset: int = 0) -> list:
+        page = self.api.collection_tracks(
+            collection["kind"],
+            collection["id"],
+            snapshot_id=collection.get("snapshot_id"),
+            offset=offset,
+            limit=self.TRACKS_PAGE_SIZE,
+        )
+
+        items = []
+        if offset == 0:
+            items.append(
+                self._generate_item(
+                    collection["name"],
+                    f'{_("Play all")} | {page.total} {_("tracks")}',
+                    collection["icon"],
+                    action={"command": "play", "context_uri": collection["uri"]},
+                )
+            )
+
+        for position, track in enumerate(page.items, start=offset + 1):
+            duration = self._parse_duration(track.duration_ms)
+            album_name = f" | {track.album.name}" if track.album else ""
+
+            items.append(
+                self._generate_item(
+                    f"{track.artists} -- {track.name}",
+                    f"{position}. {duration}{album_name}",
+                    collection["icon"],
+                    action={
+                        "command": "play",
+                        "context_uri": collection["uri"],
+                        "offset": {"uri": track.uri},
+                    },
+                    alt_action={"command": "queue", "uri": track.uri},
+                )
+            )
+
+        if page.next:
+            next_offset = offset + self.TRACKS_PAGE_SIZE
+            last = min(next_offset + self.TRACKS_PAGE_SIZE, page.total)
+            items.append(
+                self._generate_item(
+                    _("More tracks"),
+                    f'{next_offset + 1}-{last} {_("of")} {page.total}',
+                    self.ICONS["track"],
+                    action={"command": "tracks", **collection, "offset": next_offset},
+                    keep_open=True,
+                )
+            )
+            self.api.prefetch(
+                "collection_tracks",
+                collection["kind"],
+                collection["id"],
+                snapshot_id=collection.get("snapshot_id"),
+                offset=next_offset,
+                limit=self.TRACKS_PAGE_SIZE,
+            )
+
+        return items
+
+    # Artist drill-down, started from an artist search result: top tracks, albums and
+    # related artists, all fetched at the same time. The artist's catalog stays cached for
+    # hours (see SpotifyClient.artists_cache), so opening it again does not wait for Spotify.
+    def _generate_artist_items(self, artist: dict) -> list:
+        limit = int(self.preferences["search_results_limit"])
+        titles = {
+            "top_tracks": _("Top tracks"),
+            "albums": _("Albums"),
+            "related": _("Fans also like"),
+        }
+
+        def header(section):
+            return self._generate_item(
+                titles[section], icon=self.ICONS["artist"], small=True
+            )
+
+        def top_tracks():
+            page = self.api.artist_top_tracks(artist["id"])
+            for position, track in enumerate(page.items[:limit], start=1):
+                duration = self._parse_duration(track.duration_ms)
+                album_name = f" | {track.album.name}" if track.album else ""
+                yield self._generate_item(
+                    f"{track.artists} -- {track.name}",
+                    f"{position}. {duration}{album_name}",
+                    self._dl_image(track.image) if track.image else artist["icon"],
+                    action={"command": "play", "uris": [track.uri]},
+                    alt_action={"command": "queue", "uri": track.uri},
+                )
+
+        def albums():
+            page = self.api.artist_albums(artist["id"], limit=limit)
+            for album in page.items:
+                img = self.ICONS["album"]
+                if album.image:
+                    img = self._dl_image(album.image)
+                title = f"{album.artists} -- {album.name}"
+                yield self._generate_item(
+                    album.name,
+                    f'{album.total_tracks} {_("tracks")} | Released {album.release_date}',
+                    img,
+                    action={"command": "play", "context_uri": album.uri},
+                    alt_action={
+                        "command": "tracks",
+                        "kind": "album",
+                        "id": album.id,
+                        "uri": album.uri,
+                        "name": title,
+                        "icon": img,
+                    },
+                    alt_keep_open=True,
+                )
+
+        def related():
+            page = self.api.artist_related_artists(artist["id"])
+            for res in page.items[:limit]:
+                img = self._dl_image(res.image) if res.image else self.ICONS["artist"]
+                genres = ", ".join(res.genres).capitalize()
+                yield self._generate_item(
+                    res.name,
+                    genres or f'{_("Popularity")} {res.popularity}%',
+                    img,
+                    action={"command": "play", "context_uri": res.uri},
+                    alt_action={
+                        "command": "artist",
+                        "id": res.id,
+                        "uri": res.uri,
+                        "name": res.name,
+                        "icon": img,
+                    },
+                    alt_keep_open=True,
+                )
+
+        builders = {"top_tracks": top_tracks, "albums": albums, "related": related}
+
+        def section_items(section):
+            items = list(builders[section]())
+            return [header(section)] + items if items else []
+
+        def placeholder(section):
+            return self._generate_item(
+                f'{titles[section]}: {_("Loading...")}',
+                icon=self.ICONS["artist"],
+                small=True,
+            )
+
+        def failed(section, e):
+            return self._generate_section_error_item(titles[section], e)
+
+        sections = self._concurrently(
+            list(builders), section_items, placeholder, failed
+        )
+        play_all = self._generate_item(
+            artist["name"],
+            _("Play all"),
+            artist["icon"],
+            action={"command": "play", "context_uri": artist["uri"]},
+        )
+        return [play_all] + [item for section in sections for item in section]
+
+    # Memory accounting (see MemoryProfiler): resident memory and the estimated size of every
+    # cache, or with `option` "trace" the lines that allocated the most since the last look.
+    def _generate_memory_items(self, keyword: str, option: str) -> list:
+        memory = self.api.memory
+        if option == "stop":
+            memory.stop_tracing()
+        top = memory.top_allocations() if option == "trace" else []
+
+        usage = memory.usage()
+        caches = sorted(
+            usage["caches"].items(), key=lambda item: item[1]["bytes"], reverse=True
+        )
+        total = sum(cache["bytes"] for _name, cache in caches)
+        rss = _megabytes(usage["rss"]) if usage["rss"] is not None else "?"
+        tracing = _("tracing allocations") if usage["tracing"] else ""
+        items = [
+            self._generate_item(
+                f'{_("Resident memory")}: {rss} MB',
+                f'{_("Caches")}: {_megabytes(total)} MB {tracing}',
+                action=SetUserQueryAction(f"{keyword} stats mem"),
+            )
+        ]
+
+        if option == "trace":
+            if not top:
+                items.append(
+                    self._generate_item(
+                        _("Tracing allocations from now on"),
+                        f'{_("Run it again for what was allocated since")}: '
+                        f"{keyword} stats mem trace",
+                        action=SetUserQueryAction(f"{keyword} stats mem trace"),
+                    )
+                )
+            for where, size, diff, count in top:
+                change = f"{diff / 1024:+.0f} KB"
+                items.append(
+                    self._generate_item(
+                        where,
+                        f"{_megabytes(size)} MB ({change}) | {count} blocks",
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} stats mem trace"),
+                    )
+                )
+            return items
+
+        for name, cache in caches:
+            budget = f' / {cache["max_entries"]}' if cache["max_entries"] else ""
+            items.append(
+                self._generate_item(
+                    f'{name}: {_megabytes(cache["bytes"])} MB, '
+                    f'{cache["entries"]}{budget} {_("entries")}',
+                    small=True,
+                    action=DoNothingAction(),
+                )
+            )
+        return items
+
+    # bulk action to add all shown tracks that are not liked yet to Liked Songs
+    def _generate_save_all_item(self, uris: list):
+        return self._generate_item(
+            _("Save all shown tracks"),
+            f'{_("Add to your Liked Songs")}: {len(uris)} {_("tracks")}',
+            self.ICONS["save"],
+            action={"command": "save_tracks", "state": uris},
+        )
+
+    # placeholder for partial results when nothing is cached for the query yet
+    def _generate_loading_item(self):
+        return self._generate_item(
+            _("Loading..."),
+            _("Waiting for Spotify to respond"),
+            action=DoNothingAction(),
+        )
+
+    # what is shown while the results of a query are on their way
+    def loading(self) -> RenderResultListAction:
+        return self._render(self._generate_loading_item())
+
+    # another helper to render items or a single item
+    def _render(
+        self, i: Union[list, Item], partial: bool = False
+    ) -> RenderResultListAction:
+        if isinstance(i, Item):
+            i = [i]
+        if isinstance(i, list):
+            # while the circuit breaker is open, whatever is shown comes from the caches
+            if self.api is not None and self.api.offline:
+                i = [self._generate_offline_item()] + i
+            # background commands that failed since the last query; partial results
+            # (rendered from the caches or in parts) show them too, but leave them for the
+            # complete ones
+            clear = not partial and (self.api is None or not self.api.is_cache_only)
+            failures = self.actions.failures(clear=clear)
+            i = [self._generate_error_item(e, failed=name) for name, e in failures] + i
+            return RenderResultListAction(i)
+
+    # translate what is shown from now on, if there is a translation for `language`
+    def set_language(self, language: str) -> None:
+        domain = "base"
+        local_path = os.path.join(EXTENSION_DIR, "locales")
+        logger.debug(
+            f"Extension language is: {language}. Searching translation files in {local_path}."
+        )
+        # Only translate if need to
+        if language != "en":
+            if language in self.LANGUAGES:
+                translation_file_path = gettext.find(domain, local_path, [language])
+                logger.debug(f"Translation file path: {translation_file_path}")
+                try:
+                    translator = gettext.translation(
+                        domain=domain, localedir=local_path, languages=[language]
+                    )
+                    translator.install()
+                except FileNotFoundError:
+                    logger.debug("Translation file not found. Go with default.")
+                else:
+                    global _
+                    _ = translator.gettext
+
+    # Run a query under the query token `token` (see SpotifyClient.query()).
+    # Queries that build their results in parts pass what they have so far to `progress`.
+    def query(self, keyword: str, argument: str, token: str, progress=None):
+        self._local.token, self._local.progress = token, progress
+        try:
+            with self.api.query(token):
+                return self.on_keyword_query(keyword, argument)
+        except QueryCancelled:
+            logger.debug(f"Query {token} was cancelled, a newer one replaces it")
+            return None
+        except requests.exceptions.RequestException as e:
+            # nothing cached to fall back to
+            logger.debug(f"Spotify is unreachable: {e}")
+            return RenderResultListAction([self._generate_offline_item(cached=False)])
+        finally:
+            self._local.token, self._local.progress = None, None
+
+    # Build the sections of a result list at the same time, `build(key)` returns the items of one.
+    # Whenever one is done while others are not, the list so far goes to the progress callback:
+    # sections in the order of `keys`, `placeholder(key)` for those still on their way.
+    # A section whose Web API call fails is shown as the error row `failed(key, error)`, the
+    # others as usual; only if every section fails, the first error is raised.
+    def _concurrently(self, keys: list, build, placeholder, failed) -> list:
+        errors = {}
+
+        def section(key):
+            try:
+                return build(key)
+            except API_ERRORS as e:
+                logger.debug(f"Section {key} failed: {e}")
+                errors[key] = e
+                return [failed(key, e)]
+
+        if self.api.is_cache_only:
+            # nothing to wait for
+            sections = {key: section(key) for key in keys}
+        else:
+            sections = self._build_sections(keys, section, placeholder)
+        if len(errors) == len(keys) and keys:
+            raise errors[keys[0]]
+        return [sections[key] for key in keys]
+
+    def _build_sections(self, keys: list, build, placeholder) -> dict:
+        token = getattr(self._local, "token", None)
+        progress = getattr(self._local, "progress", None)
+
+        def run(key):
+            with self.api.query(token):
+                return build(key)
+
+        futures = {self.pool.submit(run, key): key for key in keys}
+        sections = {}
+        try:
+            for future in as_completed(futures):
+                sections[futures[future]] = future.result()
+                if progress is not None and len(sections) < len(keys):
+                    items = [
+                        item
+                        for key in keys
+                        for item in sections.get(key, [placeholder(key)])
+                    ]
+                    progress(self._render(items, partial=True))
+        except BaseException:
+            # the query is abandoned (cancelled, or NotCached), so are its other sections
+            for future in futures:
+                future.cancel()
+            raise
+        return sections
+
+    # one section of a result list could not be loaded, see _concurrently()
+    def _generate_section_error_item(self, label: str, e: Exception):
+        title, desc = self.describe_error(e)
+        return self._generate_item(
+            f"{label}: {title}",
+            desc,
+            self.ICONS["question"],
+            action=DoNothingAction(),
+            small=True,
+        )
+
+    # render the query from the caches only, None if they do not have what it needs
+    def partial_query(self, keyword: str, argument: str):
+        with self.api.cache_only():
+            try:
+                return self.on_keyword_query(keyword, argument)
+            except NotCached:
+                return None
+
+    # search queries whose results can be narrowed down locally while the user is typing
+    def is_incremental_search(self, argument: str) -> bool:
+        if self.preferences["incremental_search"] != "Yes" or not argument:
+            return False
+        command, *components = argument.split()
+        command = self.aliases.get(command, command)
+        return command in self.SEARCH_COMMANDS and len(components) > 0
+
+    # Users pause while typing (the query is debounced), so when the argument is the beginning of
+    # a command (e.g. "sw" for switch), start fetching what that command needs in the meantime.
+    def speculative_prefetch(self, argument: str):
+        typed = argument.strip() if argument else ""
+        # complete commands fetch what they need themselves
+        if len(typed) < 2 or " " in typed or typed in self.SPECULATIVE_READS:
+            return
+        if typed in self.aliases:
+            return
+
+        names = list(self.SPECULATIVE_READS) + list(self.aliases)
+        commands = {self.aliases.get(name, name) for name in names if name.startswith(typed)}
+        for command in commands & set(self.SPECULATIVE_READS):
+            read, kwargs = self.SPECULATIVE_READS[command]
+            if command == "history":
+                kwargs = {"limit": int(self.preferences["search_results_limit"])}
+            logger.debug(f'Prefetching {read} while "{command}" is being typed')
+            self.api.prefetch(read, **kwargs)
+
+    def on_system_exit(self):
+        logger.debug("Received system exit event")
+        self.api.save_snapshot()
+        self.api.close()
+
+        if self.preferences["clear_cache"] == "Yes":
+            logger.debug("Clearing downloaded image cache")
+            return self._clear_cache()
+
+    def on_preferences(self, preferences: dict):
+        logger.debug(f"Received preferences event: {preferences}")
+        for p in preferences:
+            self.on_preferences_update(p, self.preferences[p], preferences[p], False)
+
+        self._generate_api()
+        self._generate_aliases()
+
+    def on_preferences_update(
+        self, key: str, old_value: str, new_value: str, regenerate: bool = True
+    ):
+        if old_value == new_value or not new_value:
+            return
+
+        logger.debug(
+            f"Received preferences update event for {key}, changing from {old_value} to {new_value}"
+        )
+
+        self.preferences[key] = new_value
+
+        if regenerate and key in self.PREFERENCE_HOOKS:
+            getattr(self, self.PREFERENCE_HOOKS[key])()
+
+    # A new client (auth port or daemon changed), which starts from the caches the old one
+    # saved; connections and everything else in memory start over. The old one is closed
+    # first, so that its threads do not go on writing the snapshot or topping up the queue.
+    # A daemon that is given up is shut down, its radio with it; one started with another
+    # auth port is replaced by daemon.connect().
+    def _regenerate_api(self) -> None:
+        radio = False
+        if self.api is not None:
+            radio = self.api.radio.enabled
+            self.api.save_snapshot()
+            if isinstance(self.api, daemon.DaemonClient):
+                if self.preferences["use_daemon"] != "Yes":
+                    daemon.stop(self.api)
+            self.api.close()
+        self._generate_api()
+        if radio:
+            self.api.radio.start()
+
+    # The daemon can go away mid-session (killed, crashed): connect again, which starts a new
+    # one, or fall back to an in-process client the way _generate_api does at startup.
+    def check_api(self) -> None:
+        if isinstance(self.api, daemon.DaemonClient) and self.api.hello() is None:
+            logger.debug("Lost the daemon, reconnecting")
+            self.api.close()
+            self._generate_api()
+
+    def on_keyword_query(self, keyword: str, argument: str):
+        # if user is not authorized or no cached token => go through authorization flow and get the tokens
+        if not self.api.authorized:
+            return self._render(
+                self._generate_item(
+                    title=_("Authorization"),
+                    desc=_("Authorize the extension with your Spotify account"),
+                    action={"command": "auth"},
+                )
+            )
+
+        # keep the recommendations buffer filled and the artwork cached in the background
+        self.api.radio.refill_soon()
+        self.api.sync_thumbnails_soon()
+
+        # if user has a query => process the query
+        if argument:
+            # Parse arguments
+            command, *components = argument.split()
+            logger.debug(
+                f'Recognized query "{argument}", split into command "{command}" and components "{components}"'
+            )
+
+            if command in self.aliases:
+                logger.debug(
+                    f"Command {command} is an alias for {self.aliases[command]}"
+                )
+                command = self.aliases[command]
+
+            if command == "switch":
+                logger.debug(f"Playback transfer")
+
+                user_devices = self.api.devices()
+                if user_devices:
+                    items = []
+                    for device in user_devices:
+                        device_name = device.name
+                        device_id = device.id
+                        device_type = device.type.lower()
+                        current = _("Current device") + " | " if device.is_active else ""
+
+                        items.append(
+                            self._generate_item(
+                                title=_("Switch playback to")
+                                + f" {device_type} {device_name}",
+                                desc=f"{current}" + _("Device id") + f": {device_id}",
+                                icon=self.ICONS["devices"],
+                                action={"command": "switch", "device_id": device_id},
+                            )
+                        )
+                    return self._render(items)
+                else:
+                    return self._render(
+                        self._generate_item(
+                            title=_("No active devices running Spotify found"),
+                            desc=_("Open Spotify on one of your devices first"),
+                            action=SetUserQueryAction("Spotify"),
+                        )
+                    )
+
+            elif command in self.SEARCH_COMMANDS:
+                logger.debug(f"Searching")
+
+                if len(components) == 0:
+                    examples = {
+                        "album": [
+                            "sp album mick gordon doom",
+                            "sp album beach house bloom",
+                            "sp album foals holy fire",
+                        ],
+                        "artist": [
+                            "sp artist spice girls",
+                            "sp artist britney spears",
+                            "sp artist jakey",
+                        ],
+                        "track": [
+                            "sp track led zep no quarter",
+                            "sp track post malone congratulations",
+                            "sp track post malone wow",
+                        ],
+                        "playlist": [
+                            "sp playlist brain food",
+                            "sp playlist russian hardbass",
+                            "sp playlist spanish flamenco",
+                        ],
+                        "search": [
+                            "sp search bad guy",
+                            "sp search gojira",
+                            "sp search bonobo",
+                        ],
+                    }
+                    if command != "search":
+                        search_for = _("Search for") + f" {command}s"
+                    else:
+                        search_for = f"Enter your search query"
+                    return self._render(
+                        self._generate_item(
+                            f"{search_for}",
+                            f'{_("For example")}: {random.choice(examples[command])}',
+                            icon=self.ICONS["main"],
+                            action=DoNothingAction(),
+                        )
+                    )
+
+                if command == "search" and self.preferences["search_fanout"] == "Yes":
+                    query = " ".join(components)
+                    items = self._generate_fanout_search_items(keyword, query)
+                    return self._render(items)
+                elif command == "search":
+                    type_search = "album,track,artist,playlist"
+                    limit = math.ceil(int(self.preferences["search_results_limit"]) / 4)
+                else:
+                    type_search = command
+                    limit = int(self.preferences["search_results_limit"])
+
+                query = " ".join(components)
+                return self._render(
+                    self._generate_search_items(query, type_search, limit)
+                )
+
+            elif command == "repeat":
+                logger.debug(f"Playback repeat status")
+
+                currently_playing = self.api.current_playback()
+                if not currently_playing or not currently_playing.item:
+                    return self._render(
+                        self._generate_item(
+                            _("Nothing is playing at this moment"),
+                            _("Start playing first"),
+                            action=HideWindowAction(),
+                        )
+                    )
+
+                states = ["off", "context", "track"]
+                state_names = [
+                    _("do not repeat"),
+                    _("repeat context"),
+                    _("repeat track"),
+                ]
+                current_repeat_state: str = currently_playing.repeat_state
+                current_repeat_state_index = states.index(current_repeat_state)
+
+                items = [
+                    self._generate_item(
+                        f'{_("Current state")}: {state_names[current_repeat_state_index]}',
+                        small=True,
+                        icon=self.ICONS[f"repeat_{current_repeat_state}"],
+                        action=DoNothingAction(),
+                    )
+                ]
+
+                for i in range(len(states)):
+                    if i == current_repeat_state_index:
+                        continue
+                    items.append(
+                        self._generate_item(
+                            f'{_("Set to")} {state_names[i]}',
+                            small=True,
+                            icon=self.ICONS[f"repeat_{states[i]}"],
+                            action={"command": "repeat", "state": states[i]},
+                            keep_open=False,
+                        )
+                    )
+                return self._render(items)
+
+            elif command == "shuffle":
+                logger.debug(f"Playback shuffle status")
+
+                currently_playing = self.api.current_playback()
+                if not currently_playing or not currently_playing.item:
+                    return self._render(
+                        self._generate_item(
+                            _("Nothing is playing at this moment"),
+                            _("Start playing first"),
+                            action=HideWindowAction(),
+                        )
+                    )
+
+                current_shuffle_state = currently_playing.shuffle_state
+                states = [True, False]
+                state_names = [_("shuffle"), _("do not shuffle")]
+                state_icons = ["shuffle", "no_shuffle"]
+                current_shuffle_state_index = states.index(current_shuffle_state)
+
+                items = [
+                    self._generate_item(
+                        f'{_("Current state")}: {state_names[current_shuffle_state_index]}',
+                        small=True,
+                        icon=self.ICONS[state_icons[current_shuffle_state_index]],
+                        action=DoNothingAction(),
+                    )
+                ]
+
+                for i in range(len(states)):
+                    if i == current_shuffle_state_index:
+                        continue
+                    items.append(
+                        self._generate_item(
+                            f'{_("Set to")} {state_names[i]}',
+                            small=True,
+                            icon=self.ICONS[state_icons[i]],
+                            action={"command": "shuffle", "state": states[i]},
+                            keep_open=False,
+                        )
+                    )
+                return self._render(items)
+
+            elif command == "history":
+                logger.debug(f"History")
+
+                history = self.api.current_user_recently_played(
+                    limit=int(self.preferences["search_results_limit"])
+                )
+                if not history.items:
+                    return self._render(
+                        self._generate_item(
+                            _("No previously played songs found"),
+                            _("Maybe an API bug?"),
+                            icon=self.ICONS["question"],
+                            action=HideWindowAction(),
+                        )
+                    )
+
+                items = []
+                liked = self.api.saved_tracks_contains(
+                    [track.id for track in history.items]
+                )
+                for track in history.items:
+                    uri = track.uri
+
+                    album_name = track.album.name if track.album else ""
+                    duration = self._parse_duration(track.duration_ms)
+                    if track.image:
+                        img = self._dl_image(track.image)
+                    else:
+                        img = self.ICONS["main"]
+
+                    title = f"{track.artists} -- {track.name}"
+                    desc = (
+                        (_("Liked track") if liked.get(track.id) else _("Track"))
+                        + f" | {duration} | "
+                        + _("Popularity")
+                        + f" {track.popularity}% | {album_name}"
+                    )
+                    alt_action = {"command": "queue", "uri": uri}
+                    uri = [uri]
+
+                    items.append(
+                        self._generate_item(
+                            title,
+                            desc,
+                            img,
+                            action={"command": "play", "uris": uri},
+                            alt_action=alt_action,
+                            keep_open=False,
+                        )
+                    )
+
+                not_liked = list(
+                    dict.fromkeys(
+                        track.uri
+                        for track in history.items
+                        if liked.get(track.id) is False
+                    )
+                )
+                if not_liked:
+                    items.append(self._generate_save_all_item(not_liked))
+
+                return self._render(items)
+
+            elif command == "queue":
+                logger.debug(f"Queue")
+
+                # rendered from the mirror, which is kept up to date in the background
+                play_queue = self.api.play_queue
+                if not play_queue.synced_at:
+                    if self.api.is_cache_only:
+                        raise NotCached("queue")
+                    play_queue.sync()
+                else:
+                    play_queue.sync_soon()
+                upcoming, queued = play_queue.upcoming, play_queue.queued()
+
+                reported = {item.uri for item in upcoming}
+                items = [
+                    self._generate_item(
+                        _("Just queued"),
+                        f'{uri} | {_("Waiting for Spotify to report it")}',
+                        self.ICONS["note"],
+                        action=DoNothingAction(),
+                    )
+                    for uri in queued
+                    if uri not in reported
+                ]
+                for position, item in enumerate(upcoming, start=1):
+                    if item.type == "track":
+                        title = f"{item.artists} -- {item.name}"
+                    else:
+                        title = f"{item.show_name} -- {item.name}"
+                    by_you = f' | {_("Queued by you")}' if item.uri in queued else ""
+                    duration = self._parse_duration(item.duration_ms)
+                    items.append(
+                        self._generate_item(
+                            title,
+                            f"{position}. {duration}{by_you}",
+                            self._dl_image(item.image) if item.image else None,
+                            action={"command": "play", "uris": [item.uri]},
+                        )
+                    )
+
+                if not items:
+                    return self._render(
+                        self._generate_item(
+                            _("The queue is empty"),
+                            _("Alt-enter on a track to add it to the queue"),
+                            icon=self.ICONS["note"],
+                            action=HideWindowAction(),
+                        )
+                    )
+                return self._render(items)
+
+            elif command == "stats":
+                logger.debug(f"Stats {components}")
+                what = components[0] if components else "mem"
+                option = components[1] if len(components) > 1 else ""
+                if what != "mem" or option not in ("", "trace", "stop"):
+                    return self._render(
+                        self._generate_item(
+                            f"{keyword} stats mem [trace|stop]",
+                            _("Memory used by the extension and its caches"),
+                            icon=self.ICONS["question"],
+                            action=SetUserQueryAction(f"{keyword} stats mem"),
+                        )
+                    )
+                return self._render(self._generate_memory_items(keyword, option))
+
+            elif command == "volume":
+                logger.debug(f"Volume controls")
+
+                current_volume = self.api.current_playback(additional_types="episode")
+                if not current_volume or not current_volume.device:
+                    return self._render(
+                        self._generate_item(
+                            _("Can not set volume when nothing is playing"),
+                            icon=self.ICONS["volume"],
+                            action=HideWindowAction(),
+                        )
+                    )
+                current_volume = current_volume.device.volume_percent
+
+                if len(components) == 0:
+                    items = [
+                        self._generate_item(
+                            f'{_("Current volume")}: {current_volume}%',
+                            small=True,
+                            icon=self.ICONS["volume"],
+                            action=DoNothingAction(),
+                        ),
+                        self._generate_item(
+                            _("Mute: 0% volume"),
+                            small=True,
+                            icon=self.ICONS["mute"],
+                            action={"command": "volume", "state": 0},
+                        ),
+                        self._generate_item(
+                            _("Full volume: 100% volume"),
+                            small=True,
+                            icon=self.ICONS["volume"],
+                            action={"command": "volume", "state": 100},
+                        ),
+                    ]
+
+                    return self._render(items)
+                else:
+                    try:
+                        requested_volume = int(components[0])
+                        if (requested_volume < 0) or (requested_volume > 100):
+                            raise ValueError
+                    except ValueError:
+                        return self._render(
+                            self._generate_item(
+                                _("The volume must be from 0 to 100"),
+                                _("0 = mute; 100 = full volume"),
+                                icon=self.ICONS["volume"],
+                                action=SetUserQueryAction(f"{keyword} volume "),
+                            )
+                        )
+
+                    logger.debug(
+                        f'Interpreting "{components}" input as {requested_volume}'
+                    )
+
+                    return self._render(
+                        self._generate_item(
+                            _("Set volume to") + f" {requested_volume}%",
+                            icon=self.ICONS["volume"],
+                            action={"command": "volume", "state": requested_volume},
+                        )
+                    )
+
+            elif command == "next":
+                logger.debug(f"Next track")
+
+                return self._render(
+                    self._generate_item(
+                        _("Next track"),
+                        _("Skip playback to next track"),
+                        icon=self.ICONS["next"],
+                        action={"command": "next"},
+                    )
+                )
+
+            elif command == "previous":
+                logger.debug(f"Previous track")
+
+                return self._render(
+                    self._generate_item(
+                        _("Previous track"),
+                        _("Skip playback to previous track"),
+                        icon=self.ICONS["prev"],
+                        action={"command": "prev"},
+                    )
+                )
+
+            elif command == "mute":
+                logger.debug(f"Setting volume to 0")
+
+                return self._render(
+                    self._generate_item(
+                        _("Mute"),
+                        _("Set volume to 0%"),
+                        icon=self.ICONS["mute"],
+                        action={"command": "volume", "state": 0},
+                    )
+                )
+
+            elif command == "save":
+                logger.debug(f"Saving track")
+
+                current_track = self.api.current_playback(additional_types="episode")
+                if not current_track:
+                    return self._render(
+                        self._generate_item(
+                            _("Can not save a song when nothing is playing"),
+                            icon=self.ICONS["save"],
+                            action=HideWindowAction(),
+                        )
+                    )
+                if current_track.currently_playing_type != "track":
+                    return self._render(
+                        self._generate_item(
+                            _("You can save only tracks"),
+                            icon=self.ICONS["save"],
+                            action=HideWindowAction(),
+                        )
+                    )
+
+                artists = current_track.item.artists
+                song_name = current_track.item.name
+                song_uri = current_track.item.uri
+                return self._render(
+                    self._generate_item(
+                        f"{artists} -- {song_name}",
+                        desc=_("Add to your Liked Songs"),
+                        icon=self.ICONS["save"],
+                        action={"command": "save_tracks", "state": [song_uri]},
+                    )
+                )
+
+            elif command == "lyrics":
+                logger.debug("Lyrics search request")
+
+                current_track = self.api.current_playback(additional_types="episode")
+                if not current_track:
+                    return self._render(
+                        self._generate_item(
+                            _("Nothing is playing"),
+                            icon=self.ICONS["search"],
+                            action=HideWindowAction(),
+                        )
+                    )
+                if current_track.currently_playing_type != "track":
+                    return self._render(
+                        self._generate_item(
+                            _("You can search only tracks"),
+                            icon=self.ICONS["search"],
+                            action=HideWindowAction(),
+                        )
+                    )
+
+                track = current_track.item
+                artist = track.artist_names[0]
+                song_name = track.name
+
+                query = quote_plus(f"{artist} - {song_name}")
+
+                genius_link = "https://genius.com/search?q=" + query
+                azlyrics_link = "https://search.azlyrics.com/search.php?q=" + query
+                # TODO: any other popular lyrics provider?
+
+                search_items = [
+                    self._generate_item(
+                        _("Search genius.com"),
+                        desc=f"{genius_link}",
+                        icon=self.ICONS["search"],
+                        action=OpenUrlAction(genius_link),
+                    ),
+                    self._generate_item(
+                        _("Search azlyrics.com"),
+                        desc=f"{azlyrics_link}",
+                        icon=self.ICONS["search"],
+                        action=OpenUrlAction(azlyrics_link),
+                    ),
+                ]
+
+                # lyrics are looked up only once the user has picked a provider
+                if self.preferences["lyrics_provider"] == "none":
+                    hint = self._generate_item(
+                        _("Lyrics are off"),
+                        _("Set the Lyrics provider preference to lrclib to show them here"),
+                        icon=self.ICONS["lyrics"],
+                        action=DoNothingAction(),
+                    )
+                    return self._render(search_items + [hint])
+
+                # usually prefetched when the track started, see LyricsCache
+                entry = self.api.lyrics.get(track.id) if track.id else None
+                if entry is None and track.id:
+                    if self.api.is_cache_only:
+                        raise NotCached(("lyrics", track.id))
+                    try:
+                        entry = self.api.lyrics.fetch(track)
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        logger.debug(f"Could not look up the lyrics: {e}")
+                if not entry or not entry["lyrics"]:
+                    return self._render(search_items)
+
+                lines = [line for line in entry["lyrics"].splitlines() if line.strip()]
+                header = self._generate_item(
+                    f"{track.artists} -- {song_name}",
+                    f'{_("Lyrics from")} {entry["provider"]}',
+                    icon=self.ICONS["lyrics"],
+                    action=DoNothingAction(),
+                )
+                line_items = [
+                    self._generate_item(line, small=True, action=DoNothingAction())
+                    for line in lines
+                ]
+                return self._render([header] + line_items + search_items)
+
+            # Since Spotify-Web-API doesn't offer handling radio-playlists, we create an artificial
+            # radio, using the "Get Recommendations"-endpoint and input values from the current track
+            # and optionally number of tracks to add as argument
+            elif command == "recommendations":
+                logger.debug("Adding recommendation to song queue")
+
+                number_of_tracks = 10
+                if len(components) != 0 and components[0].isdigit():
+                    number_of_tracks = min(int(components[0]), number_of_tracks)
+
+                # recommendations buffered by the radio in the background are there instantly
+                buffered = self.api.radio.peek(number_of_tracks)
+                if buffered:
+                    uris = [track.uri for track in buffered]
+                    items = [
+                        self._generate_item(
+                            _("Add recommendations"),
+                            f'{_("Add recommendations based on recently played tracks to song-queue")}: '
+                            f'{len(uris)} {_("tracks")}',
+                            icon=self.ICONS["note"],
+                            action={"command": "recommendations", "state": {"uris": uris}},
+                        )
+                    ]
+                    for track in buffered:
+                        items.append(
+                            self._generate_item(
+                                f"{track.artists} -- {track.name}",
+                                _("Add to queue"),
+                                icon=self.ICONS["track"],
+                                small=True,
+                                action={
+                                    "command": "recommendations",
+                                    "state": {"uris": [track.uri]},
+                                },
+                            )
+                        )
+                    return self._render(items)
+
+                current_track = self.api.current_playback(additional_types="episode")
+
+                if current_track is None:
+                    return self._render(
+                        self._generate_item(
+                            _("Nothing is playing"),
+                            icon=self.ICONS["search"],
+                            action=HideWindowAction(),
+                        )
+                    )
+                
+                if current_track.currently_playing_type != "track":
+                    return self._render(
+                        self._generate_item(
+                            _("You can only create add recommendations based on tracks"),
+                            icon=self.ICONS["search"],
+                            action=HideWindowAction(),
+                        )
+                    )
+                
+                artists_ids = list(current_track.item.artist_ids)
+                # simplified albums (as in the current track) come without genres
+                genres = []
+                track_id = current_track.item.id
+
+                return self._render(
+                    self._generate_item(
+                        _("Add recommendations"),
+                        _("Add recommendations based on current playback to song-queue"),
+                        icon=self.ICONS["note"],
+                        action={
+                            "command": "recommendations",
+                            "state": {
+                                "artists_ids": artists_ids,
+                                "genres": genres,
+                                "track_id": track_id,
+                                "number_of_tracks": number_of_tracks
+                            }
+                        }
+                    )
+                )
+            
+            elif command == "similar":
+                logger.debug("Tracks similar to the current one")
+
+                current_track = self.api.current_playback(additional_types="episode")
+                if not current_track or current_track.currently_playing_type != "track":
+                    return self._render(
+                        self._generate_item(
+                            _("Nothing is playing"),
+                            _("Start playing a track first"),
+                            icon=self.ICONS["note"],
+                            action=HideWindowAction(),
+                        )
+                    )
+                if not self.api.similarity.available:
+                    return self._render(
+                        self._generate_item(
+                            _("Similar tracks need numpy"),
+                            _("Install it with: pip3 install numpy"),
+                            icon=self.ICONS["question"],
+                            action=HideWindowAction(),
+                        )
+                    )
+
+                track = current_track.item
+                similar = self.api.similarity.more_like(
+                    track.id,
+                    f"{track.artists} -- {track.name}",
+                    n=int(self.preferences["search_results_limit"]),
+                    fetch=not self.api.is_cache_only,
+                )
+                if not similar:
+                    return self._render(
+                        self._generate_item(
+                            _("No similar tracks found yet"),
+                            _("Your library is being indexed, try again in a minute"),
+                            icon=self.ICONS["note"],
+                            action=HideWindowAction(),
+                        )
+                    )
+
+                items = []
+                for track_id, name, score in similar:
+                    uri = f"spotify:track:{track_id}"
+                    items.append(
+                        self._generate_item(
+                            name,
+                            f'{_("Similarity")} {score:.0%}',
+                            self.ICONS["track"],
+                            action={"command": "play", "uris": [uri]},
+                            alt_action={"command": "queue", "uri": uri},
+                        )
+                    )
+                return self._render(items)
+
+            elif command == "radio":
+                logger.debug("Radio mode")
+
+                enabled = self.api.radio.enabled
+                state_name = _("on") if enabled else _("off")
+                return self._render(
+                    [
+                        self._generate_item(
+                            f'{_("Radio")}: {state_name}',
+                            f'{len(self.api.radio)} {_("recommendations buffered")}',
+                            icon=self.ICONS["note"],
+                            small=True,
+                            action=DoNothingAction(),
+                        ),
+                        self._generate_item(
+                            _("Turn radio off") if enabled else _("Turn radio on"),
+                            _("Keep the queue topped up with recommendations based on recently played tracks"),
+                            icon=self.ICONS["note"],
+                            action={"command": "radio", "state": not enabled},
+                        ),
+                    ]
+                )
+
+            elif command == "help":
+                items = [
+                    self._generate_item(
+                        f'{_("This help menu")}: {keyword} help',
+                        icon=self.ICONS["question"],
+                        small=True,
+                    ),
+                    self._generate_item(
+                        _("Add selected track to queue: Alt + Enter"),
+                        icon=self.ICONS["play"],
+                        small=True,
+                        action=HideWindowAction(),
+                    ),
+                    self._generate_item(
+                        _("Show tracks of selected album or playlist: Alt + Enter"),
+                        icon=self.ICONS["playlist"],
+                        small=True,
+                        action=HideWindowAction(),
+                    ),
+                    self._generate_item(
+                        f'{_("Switch playback between devices")}: {keyword} switch',
+                        icon=self.ICONS["devices"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} switch"),
+                    ),
+                    self._generate_item(
+                        f'{_("Change playback volume")}: {keyword} volume',
+                        icon=self.ICONS["volume"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} volume"),
+                    ),
+                    self._generate_item(
+                        f'{_("Save currently playing song to your Liked Songs")}: {keyword} save',
+                        icon=self.ICONS["save"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} save"),
+                    ),
+                    self._generate_item(
+                        f'{_("Change repeat state")}: {keyword} repeat',
+                        icon=self.ICONS["repeat_context"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} repeat"),
+                    ),
+                    self._generate_item(
+                        f'{_("Change shuffle state")}: {keyword} shuffle',
+                        icon=self.ICONS["shuffle"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} shuffle"),
+                    ),
+                    self._generate_item(
+                        f'{_("Search for a track")}: {keyword} track {_("-your-query-")}',
+                        icon=self.ICONS["track"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} track "),
+                    ),
+                    self._generate_item(
+                        f'{_("Search for an album")}: {keyword} album {_("-your-query-")}',
+                        icon=self.ICONS["album"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} album "),
+                    ),
+                    self._generate_item(
+                        f'{_("Search for an artist")}: {keyword} artist {_("-your-query-")}',
+                        icon=self.ICONS["artist"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} artist "),
+                    ),
+                    self._generate_item(
+                        f'{_("Search for a playlist")}: {keyword} playlist {_("-your-query-")}',
+                        icon=self.ICONS["playlist"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} playlist "),
+                    ),
+                    self._generate_item(
+                        f'{_("General search")}: {keyword} search {_("-your-query-")}',
+                        icon=self.ICONS["search"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} search "),
+                    ),
+                    self._generate_item(
+                        f'{_("Recently played tracks")}: {keyword} history',
+                        icon=self.ICONS["history"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} history"),
+                    ),
+                    self._generate_item(
+                        f'{_("Tracks up next in the playback queue")}: {keyword} queue',
+                        icon=self.ICONS["note"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} queue"),
+                    ),
+                    self._generate_item(
+                        f'{_("Lyrics of the currently playing track")}: {keyword} lyrics',
+                        icon=self.ICONS["lyrics"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} lyrics"),
+                    ),
+                    self._generate_item(
+                        f'{_("Add recommendations to playback queue")}: {keyword} reco',
+                        icon=self.ICONS["note"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} reco")
+                    ),
+                    self._generate_item(
+                        f'{_("Tracks from your library similar to the current one")}: {keyword} similar',
+                        icon=self.ICONS["note"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} similar"),
+                    ),
+                    self._generate_item(
+                        f'{_("Keep the queue topped up with recommendations")}: {keyword} radio',
+                        icon=self.ICONS["note"],
+                        small=True,
+                        action=SetUserQueryAction(f"{keyword} radio"),
+                    ),
+                ]
+                return self._render(items)
+
+        # no query: the playback state and the devices are fetched at the same time,
+        # which of them is shown depends on the playback state
+        current_playback, user_devices = self.api.gather(
+            ("current_playback", {"additional_types": "episode"}), ("devices", {})
+        )
+
+        # no query, but something is playing currently => show now playing menu
+        if current_playback:
+            return self._render(self._generate_now_playing_menu(current_playback))
+
+        # no query, nothing is playing, but there are devices online => offer user to start playback on one of them
+        if user_devices:
+            items = []
+            for device in user_devices:
+                device_name = device.name
+                device_id = device.id
+                device_type = device.type.lower()
+
+                items.append(
+                    self._generate_item(
+                        _("Start playback on") + f" {device_type} {device_name}",
+                        _("Device id") + f": {device_id}",
+                        self.ICONS["play"],
+                        action={"command": "play", "device_id": device_id},
+                        keep_open=True,
+                    )
+                )
+
+            return self._render(items)
+
+        # no query, nothing is playing, no devices online => prompt to open Spotify anywhere first
+        return self._render(
+            self._generate_item(
+                _("No active devices running Spotify found"),
+                _("Open Spotify on one of your devices first"),
+                action=SetUserQueryAction("Spotify"),
+            )
+        )
+
+    def on_item_enter(self, data: dict):
+        command = data.get("command", "")
+        keep_open = data.get("_keep_app_open", False)
+        logger.debug(f"Received command {command} ({data})")
+
+        try:
+            if command == "auth":
+                try:
+                    self.api.authorize()
+                    return
+                except spotipy.SpotifyOauthError as e:
+                    logger.debug(f"Could not authenticate", e)
+                    return
+
+            elif command == "search_page":
+                logger.debug(f"Search results from offset {data['offset']}...")
+                return self._render(
+                    self._generate_search_items(
+                        data["query"], data["type"], data["limit"], data["offset"]
+                    )
+                )
+
+            elif command == "tracks":
+                offset = data.get("offset", 0)
+                logger.debug(f"Listing tracks of {data['uri']} from offset {offset}...")
+                return self._render(self._generate_collection_items(data, offset))
+
+            elif command == "artist":
+                logger.debug(f"Opening artist {data['uri']}...")
+                return self._render(self._generate_artist_items(data))
+
+            elif command not in self.BACKGROUND_COMMANDS:
+                logger.debug("No handler for this command...")
+                return self._render(
+                    self._generate_item(
+                        "Empty or unknown command",
+                        "Please investigate or open a github issue!",
+                        action=HideWindowAction(),
+                    )
+                )
+
+            elif not keep_open:
+                # nothing to show afterwards, so the launcher does not have to wait for it
+                self.actions.submit(
+                    command, self._run_command, command, data, self.actions.attempt
+                )
+                return
+
+            self._run_command(command, data)
+            # Spotify api is asynchronous and without this wait,
+            # there might be a discrepancy in what's currently playing.
+            # For example, you press next, the request to skip is sent and successfully acknowledged (http 204)
+            # but what's currently playing depends on client and it still hasn't changed.
+            # Commands that went to the local player return as soon as it reports the change,
+            # for the Web API this still waits the full request_timeout.
+            self.api.wait_for_playback_change(
+                float(self.preferences["request_timeout"])
+            )
+            return self._render(self._generate_now_playing_menu())
+
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"Spotify is unreachable: {e}")
+            return RenderResultListAction([self._generate_offline_item(cached=False)])
+
+        except (spotipy.SpotifyException, ActionFailed) as e:
+            logger.debug(f"Received an exception, {e}")
+            return self._render(self._generate_error_item(e))
+
+    # Run one of the BACKGROUND_COMMANDS. Every Web API call goes through `call`,
+    # in the background that is ActionExecutor.attempt, which retries transient errors.
+    def _run_command(self, command: str, data: dict, call=None):
+        call = call or (lambda fn, *args, **kwargs: fn(*args, **kwargs))
+
+        if command == "pause":
+            logger.debug(f"Pausing...")
+            call(self.api.pause_playback)
+
+        elif command == "play":
+            device_id = data.get("device_id", None)
+            context_uri = data.get("context_uri", None)
+            uris = data.get("uris", [])
+            offset = data.get("offset", None)
+            if uris:
+                logger.debug(f"Playing (device_id: {device_id}, uris: {uris})...")
+                call(self.api.start_playback, device_id=device_id, uris=uris)
+            elif context_uri:
+                logger.debug(
+                    f"Playing (device_id: {device_id}, context_uri: {context_uri}, offset: {offset})..."
+                )
+                call(
+                    self.api.start_playback,
+                    device_id=device_id,
+                    context_uri=context_uri,
+                    offset=offset,
+                )
+            else:
+                logger.debug(f"Playing (device_id: {device_id})...")
+                call(self.api.start_playback, device_id=device_id)
+
+        elif command == "radio":
+            state = data.get("state", False)
+            logger.debug(f"Setting radio to {state}")
+            if state:
+                call(self.api.radio.start)
+            else:
+                call(self.api.radio.stop)
+
+        elif command == "queue":
+            uri = data.get("uri", None)
+            logger.debug(f"Adding {uri} to queue...")
+            call(self.api.add_to_queue, uri)
+
+        elif command == "next":
+            logger.debug(f"Skipping to next...")
+            call(self.api.next_track)
+
+        elif command == "prev":
+            logger.debug(f"Skipping to previous...")
+            call(self.api.previous_track)
+
+        elif command == "switch":
+            logger.debug(f"Switching device...")
+            call(self.api.transfer_playback, device_id=data.get("device_id", None))
+
+        elif command == "shuffle":
+            state = data.get("state", False)
+            logger.debug(f"Setting shuffle to {state}")
+            call(self.api.shuffle, state)
+
+        elif command == "repeat":
+            state = data.get("state", "off")
+            logger.debug(f"Setting repeat to {state}")
+            call(self.api.repeat, state)
+
+        elif command == "volume":
+            state = data.get("state", 0)
+            logger.debug(f"Setting volume to {state}")
+            call(self.api.volume, state)
+
+        elif command == "save_tracks":
+            state = data.get("state", [])
+            logger.debug(f"Saving tracks {state}")
+            call(self.api.current_user_saved_tracks_add, state)
+
+        elif command == "recommendations":
+            state = data.get("state")
+            logger.debug(f"Getting recommendations {state}")
+
+            # tracks picked from the radio buffer
+            if "uris" in state:
+                for uri in state["uris"]:
+                    call(self.api.add_to_queue, uri)
+                return
+
+            recommendations = call(
+                self.api.recommendations,
+                state["artists_ids"],
+                state["genres"],
+                [state["track_id"]],
+                state["number_of_tracks"],
+            )
+            if recommendations is None or len(recommendations) < 1:
+                raise ActionFailed(_("Can't find recommendations"))
+
+            for recommendation in recommendations["tracks"]:
+                call(self.api.add_to_queue, recommendation["uri"])
+
+    # what went wrong, as (title, description); `failed` names the background command
+    def describe_error(self, e: Exception, failed: str = None) -> tuple:
+        if isinstance(e, requests.exceptions.RequestException):
+            title = _("Spotify is unreachable")
+            desc = _("Check your internet connection and try again")
+        elif isinstance(e, ActionFailed):
+            title, desc = str(e), ""
+        elif e.http_status == 403:
+            title = _("Spotify: 403 Forbidden")
+            desc = _("Forbidden to access this endpoint or state has changed")
+        elif e.http_status == 401:
+            title = _("Spotify: 401 Unauthorized")
+            desc = _("Probably, scope of the request is not authorized")
+        elif e.http_status == 404:
+            title = _("Spotify: 404 Not Found")
+            desc = _("Probably, request is not complete and missing something")
+        elif e.http_status in spotipy.Spotify.default_retry_codes:
+            title = f"Spotify: {e.http_status}"
+            desc = _("Spotify asks to try again later")
+        else:
+            logger.debug("Unknown SpotifyException", e)
+            title = _("Spotify exception") + f": {e.http_status}"
+            desc = _("Code:") + f" {e.code}, " + _("msg:") + f" {e.msg}"
+
+        if failed:
+            desc = " | ".join(filter(None, (title, desc)))
+            return _("Could not complete") + f" {failed}", desc
+        return title, desc
+
+    def _generate_error_item(self, e: Exception, failed: str = None):
+        title, desc = self.describe_error(e, failed)
+        return self._generate_item(
+            title, desc, self.ICONS["question"], action=HideWindowAction()
+        )
+
+    # a background command failed: tell the user right away if they want that,
+    # otherwise it is shown with the results of the next query
+    def _on_action_failure(self, command: str, e: Exception):
+        if self.preferences["failure_notifications"] != "Yes":
+            return
+        if shutil.which("notify-send") is None:
+            logger.debug("notify-send is not installed, can not show the failure")
+            return
+        title, desc = self.describe_error(e, failed=command)
+        try:
+            subprocess.Popen(
+                [
+                    "notify-send",
+                    "--app-name=Ulauncher",
+                    f"--icon={self.ICONS['main']}",
+                    title,
+                    desc,
+                ]
+            )
+        except OSError as error:
+            logger.debug(f"Could not show the failure: {error}")
+            return
+        # shown, so it is not listed with the next query's results anymore
+        self.actions.failures(clear=True)
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f}"
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class HttpCache:
+    # Web API responses that came with an ETag or a max-age, one JSON file per URL in `folder`.
+    # A fresh response (within its max-age) is served without a request, a stale one is
+    # revalidated with If-None-Match and served again if the API answers 304 Not Modified.
+    # The cache is private to the user, so "private" responses are stored as well. Entries are
+    # keyed by URL only, the client clears them when an account signs in (see authorize()).
+
+    MAX_ENTRIES = 500
+    PRUNE_EVERY = 50  # stores between two checks of the number of entries
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self._stores = 0
+        self._lock = threading.Lock()
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.folder, hashlib.sha1(url.encode()).hexdigest())
+
+    # {"etag": ..., "expires_at": ..., "body": ...}, None if `url` is not cached
+    def get(self, url: str) -> Optional[dict]:
+        try:
+            with open(self._path(url)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def is_fresh(entry: dict) -> bool:
+        return entry["expires_at"] > time.time()
+
+    # remember a 200 response to `url`, if it can be revalidated or reused at all
+    def store(self, url: str, headers, body: str) -> None:
+        etag, max_age = headers.get("ETag"), _max_age(headers)
+        if "no-store" in headers.get("Cache-Control", "") or not (etag or max_age):
+            return
+        self._write(
+            url, {"etag": etag, "expires_at": time.time() + max_age, "body": body}
+        )
+
+    # the API answered 304 for `entry`: it is good for another max-age and returned again
+    def revalidated(self, url: str, entry: dict, headers) -> dict:
+        entry = dict(entry, expires_at=time.time() + _max_age(headers))
+        self._write(url, entry)
+        return entry
+
+    def _write(self, url: str, entry: dict) -> None:
+        path = self._path(url)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.debug(f"Could not cache the response to {url}: {e}")
+            return
+
+        with self._lock:
+            self._stores += 1
+            prune = self._stores % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def clear(self) -> None:
+        try:
+            for name in os.listdir(self.folder):
+                os.remove(os.path.join(self.folder, name))
+        except OSError as e:
+            logger.debug(f"Could not clear the response cache: {e}")
+
+    # drop the least recently stored entries above MAX_ENTRIES
+    def prune(self) -> None:
+        try:
+            names = os.listdir(self.folder)
+            paths = [os.path.join(self.folder, name) for name in names]
+            paths.sort(key=os.path.getmtime)
+            for path in paths[: -self.MAX_ENTRIES]:
+                os.remove(path)
+        except OSError as e:
+            logger.debug(f"Could not prune the response cache: {e}")
+
+
+class CachingAdapter(HTTPAdapter):
+    # Transport adapter that answers GET requests from an HttpCache where it can,
+    # see HttpCache. Responses served from the cache look like 200 responses to spotipy.
+
+    def __init__(self, cache: HttpCache, *args, **kwargs):
+        super(CachingAdapter, self).__init__(*args, **kwargs)
+        self.cache = cache
+
+    def send(self, request, *args, **kwargs):
+        if request.method != "GET":
+            return super(CachingAdapter, self).send(request, *args, **kwargs)
+
+        entry = self.cache.get(request.url)
+        if entry and self.cache.is_fresh(entry):
+            return _cached_response(request, entry)
+        if entry and entry["etag"]:
+            request.headers["If-None-Match"] = entry["etag"]
+
+        response = super(CachingAdapter, self).send(request, *args, **kwargs)
+        if response.status_code == 304 and entry:
+            logger.debug(f"Not modified, serving cached {request.url}")
+            entry = self.cache.revalidated(request.url, entry, response.headers)
+            return _cached_response(request, entry)
+        if response.status_code == 200:
+            self.cache.store(request.url, response.headers, response.text)
+        return response
+
+
+def _cached_response(request, entry: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = "OK"
+    response.url = request.url
+    response.request = request
+    response.encoding = "utf-8"
+    response.headers["Content-Type"] = "application/json; charset=utf-8"
+    response._content = entry["body"].encode("utf-8")
+    return response
+
+
+# seconds a response may be reused without asking, from its Cache-Control header
+def _max_age(headers) -> int:
+    cache_control = headers.get("Cache-Control", "")
+    if "no-cache" in cache_control:
+        return 0
+    match = re.search(r"max-age=(\d+)", cache_control)
+    return int(match.group(1)) if match else 0
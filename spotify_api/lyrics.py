@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import requests
+
+from . import models
+from .worker import LOW
+
+logger = logging.getLogger(__name__)
+
+
+class LyricsProvider:
+    # Where lyrics come from: lookup() returns the plain text lyrics of a models.Track,
+    # None if it has none for it. This one never has any, see provider() for the others.
+
+    name = "none"
+
+    def lookup(self, track: models.Track) -> Optional[str]:
+        return None
+
+
+class LrclibProvider(LyricsProvider):
+    # lrclib.net, free and without an API key. Searched by artist and title, the result
+    # closest to the track's duration wins.
+
+    name = "lrclib.net"
+    URL = "https://lrclib.net/api/search"
+    TIMEOUT = (2.0, 5.0)  # (connect, read) seconds
+    MAX_DURATION_DIFF = 5  # seconds between the track and the lyrics it was searched for
+
+    def lookup(self, track: models.Track) -> Optional[str]:
+        params = {"track_name": track.name}
+        if track.artist_names:
+            params["artist_name"] = track.artist_names[0]
+        headers = {"User-Agent": "ulauncher-spotify-api"}
+        response = requests.get(
+            self.URL, params=params, headers=headers, timeout=self.TIMEOUT
+        )
+        response.raise_for_status()
+
+        duration = track.duration_ms / 1000 if track.duration_ms else None
+        best, best_diff = None, None
+        for result in response.json():
+            if not result.get("plainLyrics"):
+                continue
+            diff = abs(result["duration"] - duration) if duration else 0
+            if duration and diff > self.MAX_DURATION_DIFF:
+                continue
+            if best is None or diff < best_diff:
+                best, best_diff = result, diff
+        return best["plainLyrics"] if best else None
+
+
+class FolderProvider(LyricsProvider):
+    # Local stand-in, e.g. for testing without network: `<folder>/<track id>.txt`
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.name = folder
+
+    def lookup(self, track: models.Track) -> Optional[str]:
+        try:
+            with open(os.path.join(self.folder, f"{track.id}.txt")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+
+# the provider for the lyrics_provider preference: "lrclib", "none" or a folder
+def provider(source: str) -> LyricsProvider:
+    if source == "lrclib":
+        return LrclibProvider()
+    if source == "none" or not source:
+        return LyricsProvider()
+    return FolderProvider(os.path.expanduser(source))
+
+
+class LyricsCache:
+    # Lyrics by track id, one JSON file per track in `folder`:
+    # {"lyrics": ..., "provider": ..., "fetched_at": ...}. Tracks the provider has no lyrics
+    # for are remembered as well, and looked up again after NOT_FOUND_TTL.
+    # prefetch() fetches them on the prefetch worker, so they are there when they are shown.
+
+    NOT_FOUND_TTL = 86400  # seconds
+
+    def __init__(self, folder: str, worker, source: str = "none"):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.worker = worker
+        self.provider = provider(source)
+
+    def configure(self, source: str) -> None:
+        self.provider = provider(source)
+
+    def clear(self) -> None:
+        for name in os.listdir(self.folder):
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError as e:
+                logger.debug(f"Could not remove cached lyrics {name}: {e}")
+
+    def _path(self, track_id: str) -> str:
+        return os.path.join(self.folder, f"{track_id}.json")
+
+    # the cached entry of `track_id`, None if there is none (or it is an expired "not found")
+    def get(self, track_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(track_id)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["lyrics"] is None and (
+            entry["provider"] != self.provider.name
+            or entry["fetched_at"] + self.NOT_FOUND_TTL < time.time()
+        ):
+            return None
+        return entry
+
+    # the entry of `track`, from the provider if it is not cached yet
+    def fetch(self, track: models.Track) -> dict:
+        entry = self.get(track.id)
+        if entry is not None:
+            return entry
+
+        logger.debug(f"Looking up the lyrics of {track.uri} on {self.provider.name}")
+        entry = {
+            "lyrics": self.provider.lookup(track),
+            "provider": self.provider.name,
+            "fetched_at": time.time(),
+        }
+        path = self._path(track.id)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.debug(f"Could not cache the lyrics of {track.uri}: {e}")
+        return entry
+
+    # fetch the lyrics of `tracks` in the background, those that are not cached yet
+    def prefetch(self, tracks: list) -> None:
+        if self.provider.name == LyricsProvider.name:
+            return
+        for track in tracks:
+            # local files have no id
+            if track.id and self.get(track.id) is None:
+                self.worker.submit(
+                    self.fetch, track, priority=LOW, key=("lyrics", track.id)
+                )
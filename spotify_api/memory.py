@@ -0,0 +1,164 @@
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import tracemalloc
+from collections import deque
+from typing import Optional
+
+from . import models
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+# Estimated bytes held by `obj` and everything it references, each object counted once.
+# Objects shared with others (interned names, for one) count wherever they are met first.
+def deep_size(obj, seen: set = None) -> int:
+    seen = set() if seen is None else seen
+    size, stack = 0, [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif isinstance(obj, models.Model):
+            stack.extend(getattr(obj, name) for name in obj.__slots__)
+    return size
+
+
+# resident memory of this process in bytes, None where /proc is not available
+def rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class MemoryProfiler:
+    # Memory accounting of a SpotifyClient: resident memory of the process, estimated bytes of
+    # every cache it keeps in memory, and tracemalloc snapshots taken on demand. Tracing slows
+    # every allocation down, so it only runs between start_tracing() and stop_tracing().
+
+    TRACE_FRAMES = 1  # frames kept per traced allocation
+
+    def __init__(self, client):
+        self.client = client
+        self._last = None  # last tracemalloc snapshot, what the next one is compared to
+        self._lock = threading.Lock()
+
+    # {"rss": ..., "caches": {name: {"entries": ..., "max_entries": ..., "bytes": ...}}}
+    def usage(self) -> dict:
+        caches = {}
+        for name, holder in self._holders().items():
+            if isinstance(holder, TTLCache):
+                entries = holder.dump()
+                caches[name] = {
+                    "entries": len(entries),
+                    "max_entries": holder.max_entries,
+                    "bytes": deep_size(entries),
+                }
+            else:
+                containers, budget = holder
+                caches[name] = {
+                    "entries": sum(len(part) for part in containers),
+                    "max_entries": budget,
+                    "bytes": deep_size(containers),
+                }
+
+        similarity = self.client.similarity
+        matrices = [m for m in (similarity.raw, similarity.matrix) if m is not None]
+        caches["similarity"] = {
+            "entries": len(similarity),
+            "max_entries": None,
+            "bytes": deep_size([similarity.ids, similarity.names])
+            + sum(m.nbytes for m in matrices),
+        }
+        return {"rss": rss(), "caches": caches, "tracing": tracemalloc.is_tracing()}
+
+    # What usage() accounts for besides the similarity index: TTLCaches, and
+    # (copies of the other containers that grow with use, their budget or None).
+    # Copying them is atomic, walking them while they change is not.
+    def _holders(self) -> dict:
+        client = self.client
+        thumbnails = client.thumbnails
+        holders = dict(client._snapshot_caches())
+        holders.update(
+            {
+                "cancelled_queries": client.cancelled_queries,
+                "prefetched": client._prefetched,
+                "prefetch_times": client._prefetch_times,
+                "thumbnails_queue": (
+                    [list(thumbnails._queue), set(thumbnails._seen)],
+                    thumbnails.MAX_QUEUED + thumbnails.MAX_SEEN,
+                ),
+                "radio": (
+                    [list(client.radio.buffer), list(client.radio.queued)],
+                    client.radio.BUFFER_SIZE + client.radio.MAX_QUEUED,
+                ),
+                "play_queue": ([list(client.play_queue.upcoming)], None),
+            }
+        )
+        return holders
+
+    def start_tracing(self) -> None:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.TRACE_FRAMES)
+            self._last = _snapshot()
+
+    def stop_tracing(self) -> None:
+        with self._lock:
+            tracemalloc.stop()
+            self._last = None
+
+    # The `limit` lines that hold the most traced memory, as
+    # [where, bytes, bytes since the previous call, blocks].
+    # Nothing if tracing was not running yet, it runs from now on.
+    def top_allocations(self, limit: int = 10) -> list:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.TRACE_FRAMES)
+                self._last = _snapshot()
+                return []
+            snapshot = _snapshot()
+            if self._last is not None:
+                stats = snapshot.compare_to(self._last, "lineno")
+            else:
+                stats = snapshot.statistics("lineno")
+            self._last = snapshot
+
+        top = []
+        for stat in sorted(stats, key=lambda s: s.size, reverse=True)[:limit]:
+            frame = stat.traceback[0]
+            where = f"{_short_path(frame.filename)}:{frame.lineno}"
+            top.append([where, stat.size, getattr(stat, "size_diff", 0), stat.count])
+        return top
+
+
+# what is traced right now, without what tracemalloc allocates itself
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+
+
+# "spotify_api/client.py" or "spotipy/client.py" rather than the whole path
+def _short_path(filename: str) -> str:
+    stdlib = sysconfig.get_paths()["stdlib"] + os.sep
+    if filename.startswith(stdlib):
+        return filename[len(stdlib) :]
+    if "site-packages" + os.sep in filename:
+        return filename.split("site-packages" + os.sep, 1)[1]
+    if "spotify_api" + os.sep in filename:
+        return filename[filename.rindex("spotify_api" + os.sep) :]
+    return filename
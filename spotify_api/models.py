@@ -0,0 +1,276 @@
+import sys
+from typing import Callable, Optional
+
+# Compact records for what the launcher shows of API responses.
+# The dicts spotipy returns carry everything (available markets, external urls, every image
+# size, ...); the caches keep these records instead, and rendering reads their fields.
+
+
+class Model:
+    # Fields are the __slots__, in order. Records are built by the converters below
+    # and not changed afterwards, replace() makes a changed copy.
+    __slots__ = ()
+
+    def __init__(self, *values, **fields):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+        for name in self.__slots__[len(values) :]:
+            setattr(self, name, fields.get(name))
+
+    def replace(self, **changes) -> "Model":
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return type(self)(**fields)
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Artist(Model):
+    __slots__ = ("id", "uri", "name", "genres", "popularity", "image")
+    type = "artist"
+
+
+class Album(Model):
+    __slots__ = (
+        "id",
+        "uri",
+        "name",
+        "artist_names",
+        "total_tracks",
+        "release_date",
+        "image",
+    )
+    type = "album"
+
+    @property
+    def artists(self) -> str:
+        return ", ".join(self.artist_names)
+
+
+class Track(Model):
+    __slots__ = (
+        "id",
+        "uri",
+        "name",
+        "artist_ids",
+        "artist_names",
+        "album",
+        "duration_ms",
+        "popularity",
+    )
+    type = "track"
+
+    @property
+    def artists(self) -> str:
+        return ", ".join(self.artist_names)
+
+    @property
+    def image(self) -> Optional[str]:
+        return self.album.image if self.album else None
+
+
+class Episode(Model):
+    __slots__ = ("id", "uri", "name", "show_name", "duration_ms", "image")
+    type = "episode"
+
+
+class Playlist(Model):
+    __slots__ = (
+        "id",
+        "uri",
+        "name",
+        "description",
+        "owner",
+        "total_tracks",
+        "snapshot_id",
+        "image",
+    )
+    type = "playlist"
+
+
+class Device(Model):
+    __slots__ = ("id", "name", "type", "is_active", "volume_percent")
+
+
+class Playback(Model):
+    __slots__ = (
+        "item",
+        "device",
+        "is_playing",
+        "progress_ms",
+        "shuffle_state",
+        "repeat_state",
+        "currently_playing_type",
+    )
+
+
+# one page of a listing: search results of one type, tracks of an album, play history
+class Page(Model):
+    __slots__ = ("items", "total", "next")
+
+
+def intern_name(name: Optional[str]) -> str:
+    # the same few artist names show up over and over, keep a single copy of each
+    return sys.intern(name) if name else ""
+
+
+def _smallest_image(images: list) -> Optional[str]:
+    if not images:
+        return None
+    return min(images, key=lambda image: image.get("height") or 0)["url"]
+
+
+def artist(data: dict) -> Artist:
+    return Artist(
+        data["id"],
+        data["uri"],
+        intern_name(data["name"]),
+        tuple(intern_name(genre) for genre in data.get("genres", [])),
+        data.get("popularity"),
+        _smallest_image(data.get("images")),
+    )
+
+
+def album(data: dict) -> Album:
+    return Album(
+        data.get("id"),
+        data.get("uri"),
+        data["name"],
+        tuple(intern_name(a["name"]) for a in data.get("artists", [])),
+        data.get("total_tracks"),
+        data.get("release_date"),
+        _smallest_image(data.get("images")),
+    )
+
+
+def track(data: dict) -> Track:
+    return Track(
+        data["id"],
+        data["uri"],
+        data["name"],
+        tuple(a["id"] for a in data["artists"]),
+        tuple(intern_name(a["name"]) for a in data["artists"]),
+        album(data["album"]) if data.get("album") else None,
+        data.get("duration_ms", 0),
+        data.get("popularity"),
+    )
+
+
+def episode(data: dict) -> Episode:
+    return Episode(
+        data["id"],
+        data["uri"],
+        data["name"],
+        data["show"]["name"] if data.get("show") else "",
+        data.get("duration_ms", 0),
+        _smallest_image(data.get("images")),
+    )
+
+
+def playlist(data: dict) -> Playlist:
+    images = data.get("images")
+    return Playlist(
+        data["id"],
+        data["uri"],
+        data["name"],
+        data.get("description") or "",
+        data["owner"]["display_name"],
+        data["tracks"]["total"],
+        data.get("snapshot_id"),
+        images[0]["url"] if images else None,
+    )
+
+
+def device(data: dict) -> Device:
+    return Device(
+        data.get("id"),
+        data.get("name", ""),
+        data.get("type", ""),
+        data.get("is_active", False),
+        data.get("volume_percent"),
+    )
+
+
+CONVERTERS = {
+    "artist": artist,
+    "album": album,
+    "track": track,
+    "episode": episode,
+    "playlist": playlist,
+}
+
+
+# any item of a listing, by its type; None for empty or unknown items (e.g. local files)
+def item(data: Optional[dict]) -> Optional[Model]:
+    if not data or not data.get("id") or data.get("type") not in CONVERTERS:
+        return None
+    return CONVERTERS[data["type"]](data)
+
+
+def playback(data: Optional[dict]) -> Optional[Playback]:
+    if not data:
+        return None
+    return Playback(
+        item(data.get("item")),
+        device(data["device"]) if data.get("device") else None,
+        data.get("is_playing", False),
+        data.get("progress_ms") or 0,
+        data.get("shuffle_state"),
+        data.get("repeat_state"),
+        data.get("currently_playing_type"),
+    )
+
+
+def devices(data: dict) -> list:
+    return [device(d) for d in data.get("devices") or []]
+
+
+# A page of items. `unwrap` gets the item out of its wrapper, e.g. playlist items and
+# play history entries wrap the track. Items that can not be shown are left out.
+def page(data: dict, unwrap: Callable = None) -> Page:
+    items = (unwrap(i) if unwrap and i else i for i in data["items"])
+    return Page(
+        tuple(filter(None, map(item, items))),
+        data.get("total"),
+        data.get("next"),
+    )
+
+
+# search results, as result type ("tracks", "albums", ...) -> Page
+def search_results(data: dict) -> dict:
+    return {category: page(results) for category, results in data.items()}
+
+
+def history(data: dict) -> Page:
+    return page(data, unwrap=lambda entry: entry.get("track"))
+
+
+# for sending records as JSON, see json.dumps(default=...) and json.loads(object_hook=...)
+MODELS = {
+    cls.__name__: cls
+    for cls in (Artist, Album, Track, Episode, Playlist, Device, Playback, Page)
+}
+
+
+def to_json(obj):
+    if not isinstance(obj, Model):
+        raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+    return {
+        "__model__": type(obj).__name__,
+        "fields": [getattr(obj, name) for name in obj.__slots__],
+    }
+
+
+def from_json(data: dict):
+    if "__model__" in data:
+        # JSON has no tuples, the records use them for every sequence
+        fields = [tuple(f) if isinstance(f, list) else f for f in data["fields"]]
+        return MODELS[data["__model__"]](*fields)
+    return data
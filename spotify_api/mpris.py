@@ -0,0 +1,142 @@
+import logging
+import threading
+from typing import Callable, Optional
+
+try:
+    from gi.repository import Gio, GLib
+except ImportError:
+    # optional: without PyGObject, playback is always controlled through the Web API
+    Gio = GLib = None
+
+logger = logging.getLogger(__name__)
+
+BUS_NAME = "org.mpris.MediaPlayer2.spotify"
+OBJECT_PATH = "/org/mpris/MediaPlayer2"
+PLAYER_INTERFACE = "org.mpris.MediaPlayer2.Player"
+CALL_TIMEOUT = 500  # milliseconds
+
+
+class MprisPlayer:
+    # The Spotify desktop client on this machine, reached over MPRIS on the session bus.
+    # Commands take a few milliseconds, and the player pushes its state (PropertiesChanged)
+    # instead of being polled. The proxy lives on its own thread with its own GLib main loop,
+    # `on_change` is called there with the previous playback status and the new state.
+    # The bus name can be pointed at any other MPRIS service, e.g. a stand-in for testing.
+
+    def __init__(self, bus_name: str = BUS_NAME, on_change: Callable = None):
+        self.bus_name = bus_name
+        self.on_change = on_change
+        self._proxy = None
+        self._status = None  # playback status before the last change
+        self._ready = threading.Event()
+        self._changed = threading.Event()
+        self._thread = None
+        self._context = None  # GLib.MainContext of the proxy's thread
+        self._loop = None
+
+    def start(self) -> None:
+        if Gio is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="mpris", daemon=True)
+        self._thread.start()
+        self._ready.wait(1.0)
+
+    # end the proxy's main loop and its thread; the player is not available afterwards
+    def stop(self) -> None:
+        if self._context is None:
+            return
+        # quits the loop once it runs, even if it is not running yet
+        source = GLib.idle_source_new()
+        source.set_callback(lambda *args: self._loop.quit())
+        source.attach(self._context)
+        self._proxy = None
+
+    def _run(self) -> None:
+        context = self._context = GLib.MainContext.new()
+        context.push_thread_default()
+        self._loop = GLib.MainLoop.new(context, False)
+        try:
+            # the proxy follows the name, so the player can come and go while we are running
+            self._proxy = Gio.DBusProxy.new_for_bus_sync(
+                Gio.BusType.SESSION,
+                Gio.DBusProxyFlags.DO_NOT_AUTO_START,
+                None,
+                self.bus_name,
+                OBJECT_PATH,
+                PLAYER_INTERFACE,
+                None,
+            )
+        except GLib.Error as e:
+            logger.debug(f"Session bus is not available: {e}")
+            return
+        finally:
+            self._ready.set()
+
+        self._status = (self.state() or {}).get("status")
+        self._proxy.connect("g-properties-changed", self._on_properties_changed)
+        self._loop.run()
+
+    # True if the player is running right now
+    @property
+    def available(self) -> bool:
+        return self._proxy is not None and self._proxy.get_name_owner() is not None
+
+    # {"status": "Playing" | "Paused" | "Stopped", "metadata": {...}}, None if not available
+    def state(self) -> Optional[dict]:
+        if not self.available:
+            return None
+        status = self._proxy.get_cached_property("PlaybackStatus")
+        metadata = self._proxy.get_cached_property("Metadata")
+        if status is None:
+            return None
+        return {
+            "status": status.unpack(),
+            "metadata": metadata.unpack() if metadata is not None else {},
+        }
+
+    def _on_properties_changed(self, proxy, changed, invalidated) -> None:
+        self._changed.set()
+        previous, state = self._status, self.state()
+        self._status = state["status"] if state else None
+        if self.on_change is not None:
+            try:
+                self.on_change(previous, state)
+            except Exception as e:
+                logger.debug(f"Could not handle player state change: {e}")
+
+    # block until the player reports a change since the last command, at most `timeout` seconds
+    def wait_for_change(self, timeout: float) -> bool:
+        return self._changed.wait(timeout)
+
+    # call a method of the player, True if it went through
+    def call(self, method: str, parameters=None) -> bool:
+        if not self.available:
+            return False
+        self._changed.clear()
+        try:
+            self._proxy.call_sync(
+                method,
+                parameters,
+                Gio.DBusCallFlags.NO_AUTO_START,
+                CALL_TIMEOUT,
+                None,
+            )
+        except GLib.Error as e:
+            logger.debug(f"Player could not {method}: {e}")
+            return False
+        return True
+
+    def play(self) -> bool:
+        return self.call("Play")
+
+    def pause(self) -> bool:
+        return self.call("Pause")
+
+    def next(self) -> bool:
+        return self.call("Next")
+
+    def previous(self) -> bool:
+        return self.call("Previous")
+
+    def open_uri(self, uri: str) -> bool:
+        return self.call("OpenUri", GLib.Variant("(s)", (uri,)))
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+
+from . import models
+from .worker import LOW
+
+logger = logging.getLogger(__name__)
+
+
+class QueueMirror:
+    # What is up next in the player, as the queue endpoint last reported it, and the uris the
+    # extension queued that have not played yet. Every add_to_queue goes through add(), so
+    # queueing one of those again is refused without a request.
+    # sync() reconciles the mirror with the player; the client runs it on the prefetch worker
+    # whenever something was queued or another track started.
+
+    PENDING_TTL = 120  # seconds a queued uri counts as queued before the player reports it
+
+    def __init__(self, client):
+        self.client = client
+        self.current = None  # what the player plays, as last reported
+        self.upcoming = []  # tracks and episodes up next, as last reported
+        self.synced_at = 0
+        self._queued = {}  # uri -> when the extension queued it
+        self._lock = threading.Lock()
+
+    # record `uri` as queued by the extension, False if it already is
+    def add(self, uri: str) -> bool:
+        with self._lock:
+            if uri in self._queued:
+                return False
+            self._queued[uri] = time.time()
+            return True
+
+    # the player did not take `uri` after all
+    def discard(self, uri: str) -> None:
+        with self._lock:
+            self._queued.pop(uri, None)
+
+    # uris queued by the extension that have not played yet, oldest first
+    def queued(self) -> list:
+        with self._lock:
+            return list(self._queued)
+
+    def sync_soon(self) -> None:
+        self.client.worker.submit(self.sync, priority=LOW, key="queue-sync")
+
+    def sync(self) -> None:
+        if self.client.offline or not self.client.authorized:
+            return
+        data = self.client.queue() or {}
+        current = models.item(data.get("currently_playing"))
+        upcoming = [item for item in map(models.item, data.get("queue", [])) if item]
+
+        now = time.time()
+        with self._lock:
+            reported_before = {item.uri for item in self.upcoming}
+            self.current, self.upcoming, self.synced_at = current, upcoming, now
+            reported = {item.uri for item in upcoming}
+            # what was reported before and is not anymore has played (or was skipped)
+            self._queued = {
+                uri: queued_at
+                for uri, queued_at in self._queued.items()
+                if uri in reported
+                or (
+                    uri not in reported_before
+                    and now - queued_at < self.PENDING_TTL
+                    and not _is(current, uri)
+                )
+            }
+        logger.debug(f"Queue synced, {len(upcoming)} up next")
+
+
+def _is(item, uri: str) -> bool:
+    return item is not None and item.uri == uri
@@ -0,0 +1,120 @@
+import logging
+import threading
+from collections import deque
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+
+class Radio:
+    # Rolling buffer of recommendations, seeded from recent plays and refilled in the background.
+    # Tracks that are in the play history or were already queued never make it into the buffer.
+    # While the radio is on, the player queue is topped up from the buffer whenever it runs low.
+
+    BUFFER_SIZE = 30
+    REFILL_BELOW = 10  # buffered tracks
+    QUEUE_LOW = 3  # upcoming tracks in the player queue
+    CHECK_INTERVAL = 30  # seconds
+    MAX_QUEUED = 1000  # queued track ids remembered, the oldest are forgotten above that
+
+    def __init__(self, client):
+        self.client = client
+        self.enabled = False
+        self.buffer = deque()
+        # ids of tracks queued through the extension, oldest first (a dict keeps the order)
+        self.queued = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    # first n buffered tracks, without taking them out of the buffer
+    def peek(self, n: int) -> list:
+        self.refill_soon()
+        with self._lock:
+            return list(self.buffer)[:n]
+
+    # take n tracks out of the buffer
+    def take(self, n: int) -> list:
+        with self._lock:
+            tracks = [self.buffer.popleft() for _ in range(min(n, len(self.buffer)))]
+        self.refill_soon()
+        return tracks
+
+    # record tracks as queued, and drop them from the buffer if they are there
+    def mark_queued(self, uris: list) -> None:
+        ids = {uri.split(":")[-1] for uri in uris}
+        with self._lock:
+            for track_id in ids:
+                self.queued.pop(track_id, None)
+                self.queued[track_id] = True
+            forget = max(len(self.queued) - self.MAX_QUEUED, 0)
+            for track_id in list(self.queued)[:forget]:
+                del self.queued[track_id]
+            self.buffer = deque(t for t in self.buffer if t.id not in ids)
+
+    # forget the buffer and what was queued, e.g. when another account signs in
+    def clear(self) -> None:
+        with self._lock:
+            self.buffer = deque()
+            self.queued = {}
+
+    def refill_soon(self) -> None:
+        if len(self.buffer) < self.REFILL_BELOW:
+            self.client.worker.submit(self.refill, key="radio-refill")
+
+    def refill(self) -> None:
+        if not self.client.authorized:
+            return
+
+        history = self.client.current_user_recently_played(limit=50)
+        played = [track.id for track in history.items]
+        seeds = list(dict.fromkeys(played))[:5]
+        if not seeds:
+            return
+
+        recommendations = self.client.recommendations(seed_tracks=seeds, limit=50)
+        with self._lock:
+            seen = set(played) | self.queued.keys()
+            seen.update(track.id for track in self.buffer)
+            for track in recommendations["tracks"]:
+                if len(self.buffer) >= self.BUFFER_SIZE:
+                    break
+                if track["id"] in seen:
+                    continue
+                seen.add(track["id"])
+                self.buffer.append(models.track(track))
+        logger.debug(f"Radio buffer refilled to {len(self.buffer)} tracks")
+
+    def start(self) -> None:
+        self.enabled = True
+        self._stopped.clear()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="radio", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self.enabled = False
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.top_up()
+            except Exception as e:
+                logger.debug(f"Could not top up the queue: {e}")
+            self._stopped.wait(self.CHECK_INTERVAL)
+
+    # add buffered tracks to the player queue if it has less than QUEUE_LOW upcoming tracks
+    def top_up(self) -> None:
+        self.client.play_queue.sync()
+        upcoming = self.client.play_queue.upcoming
+        self.mark_queued([item.uri for item in upcoming])
+
+        missing = self.QUEUE_LOW - len(upcoming)
+        for track in self.take(missing) if missing > 0 else []:
+            logger.debug(f"Radio is adding {track.uri} to the queue")
+            self.client.add_to_queue(track.uri)
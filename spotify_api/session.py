@@ -0,0 +1,128 @@
+import logging
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+
+from .breaker import CircuitBreaker
+from .httpcache import CachingAdapter, HttpCache
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/v1/"
+PROBE_URL = "https://api.spotify.com/v1/"
+
+
+# raised for requests that failed before any of it was sent, see never_sent()
+class NotSentError(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitOpenError(NotSentError):
+    pass
+
+
+# Whether the request that failed with `e` never reached Spotify, so that sending it again
+# can not do it twice. A read timeout or a dropped connection may come after Spotify got
+# the request, and after it acted on it.
+def never_sent(e: Exception) -> bool:
+    if isinstance(e, (NotSentError, requests.exceptions.ConnectTimeout)):
+        return True
+    if isinstance(e, requests.exceptions.ConnectionError) and e.args:
+        # connection refused, unknown host, ...: urllib3 gave up before sending
+        return isinstance(getattr(e.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+class ResilientSession(requests.Session):
+    # requests.Session handed to spotipy instead of the one it builds itself.
+    # Every request gets a timeout budget picked by its endpoint and goes through a circuit breaker,
+    # so when Spotify is unreachable a query fails in milliseconds instead of sitting in retries.
+
+    # (connect, read) timeouts in seconds, matched against the longest endpoint prefix
+    TIMEOUTS = {
+        "": (2.0, 5.0),
+        "me/player": (1.0, 2.0),
+        "me/player/recently-played": (1.0, 3.0),
+        "search": (1.0, 3.0),
+        "recommendations": (1.0, 4.0),
+    }
+    RETRY_CODES = (500, 502, 503, 504)
+    RETRY_METHODS = frozenset({"GET"})
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        probe_interval: float = 5.0,
+        http_cache: Optional[HttpCache] = None,
+    ):
+        super(ResilientSession, self).__init__()
+        self.breaker = CircuitBreaker(
+            self.probe,
+            failure_threshold=failure_threshold,
+            probe_interval=probe_interval,
+        )
+
+        # one quick retry of reads on server errors; commands (PUT, POST) may have been
+        # carried out already, and connection errors and 429 are handed back right away
+        options = dict(
+            total=1,
+            connect=0,
+            read=False,
+            status=1,
+            backoff_factor=0.3,
+            status_forcelist=self.RETRY_CODES,
+        )
+        try:
+            retry = Retry(allowed_methods=self.RETRY_METHODS, **options)
+        except TypeError:
+            # urllib3 before 1.26
+            retry = Retry(method_whitelist=self.RETRY_METHODS, **options)
+        # unchanged responses are revalidated instead of downloaded again, see HttpCache
+        self.http_cache = http_cache
+        if http_cache is not None:
+            adapter = CachingAdapter(http_cache, max_retries=retry)
+        else:
+            adapter = HTTPAdapter(max_retries=retry)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def timeout_for(self, url: str) -> Tuple[float, float]:
+        path = urlparse(url).path
+        endpoint = path[len(API_PREFIX) :] if path.startswith(API_PREFIX) else path
+        matches = [p for p in self.TIMEOUTS if endpoint.startswith(p)]
+        return self.TIMEOUTS[max(matches, key=len)]
+
+    def request(self, method, url, *args, **kwargs):
+        if self.breaker.is_open:
+            raise CircuitOpenError(
+                f"Spotify is unreachable, not sending {method} {url}"
+            )
+
+        # spotipy passes the same requests_timeout for everything, override it per endpoint
+        kwargs["timeout"] = self.timeout_for(url)
+        try:
+            response = super(ResilientSession, self).request(
+                method, url, *args, **kwargs
+            )
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.RetryError,
+        ):
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    # any HTTP answer from the API host means that it is reachable again
+    def probe(self) -> bool:
+        super(ResilientSession, self).request("HEAD", PROBE_URL, timeout=(1.0, 1.0))
+        return True
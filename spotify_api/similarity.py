@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    # optional: without numpy, "more like this" is simply not available
+    np = None
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# audio features that describe how a track sounds, in matrix column order
+FEATURES = [
+    "danceability",
+    "energy",
+    "loudness",
+    "speechiness",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "valence",
+    "tempo",
+]
+
+
+class SimilarityIndex:
+    # Audio features of the user's library and play history as a float32 matrix (one row per track),
+    # kept on disk as `<path>.npy` plus `<path>.json` for the track ids and names.
+    # In memory, rows are standardized and normalized once, so ranking all tracks against one
+    # of them is a single matrix-vector product, without a network call.
+
+    SYNC_INTERVAL = 86400  # seconds between library syncs
+
+    def __init__(self, client, path: str):
+        self.client = client
+        self.path = path
+        self.ids = []  # type: List[str]
+        self.names = {}  # track id -> "artists -- name"
+        self.raw = None  # features as fetched, this is what is stored
+        self.matrix = None  # normalized features, this is what is ranked
+        self._rows = {}  # track id -> row index
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._loaded = False
+        self._synced_at = 0
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, track_id: str) -> bool:
+        return track_id in self._rows
+
+    def load(self) -> bool:
+        self._loaded = True
+        if not self.available or not os.path.exists(self.path + ".npy"):
+            return False
+        try:
+            raw = np.load(self.path + ".npy")
+            with open(self.path + ".json") as f:
+                meta = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Could not load the similarity index: {e}")
+            return False
+
+        with self._lock:
+            self.raw = raw
+            self.matrix = _normalize(raw)
+            self.ids = meta["ids"]
+            self.names = meta["names"]
+            self._rows = {track_id: i for i, track_id in enumerate(self.ids)}
+        return True
+
+    def save(self) -> None:
+        with self._lock:
+            np.save(self.path + ".npy", self.raw)
+            with open(self.path + ".json", "w") as f:
+                json.dump({"ids": self.ids, "names": self.names}, f)
+
+    # Fetch audio features (100 ids per request) for tracks that are not indexed yet.
+    # `tracks` maps track ids to the names shown in the results.
+    def update(self, tracks: dict) -> int:
+        if not self.available:
+            return 0
+        with self._update_lock:
+            return self._update(tracks)
+
+    def _update(self, tracks: dict) -> int:
+        new = [track_id for track_id in tracks if track_id not in self._rows]
+        rows, ids = [], []
+        for i in range(0, len(new), 100):
+            for features in self.client.audio_features(new[i : i + 100]):
+                # tracks without analysis come back as None
+                if features:
+                    rows.append([features[f] for f in FEATURES])
+                    ids.append(features["id"])
+        if not ids:
+            return 0
+
+        raw = np.asarray(rows, dtype=np.float32)
+        with self._lock:
+            self.raw = raw if self.raw is None else np.vstack([self.raw, raw])
+            # mean and deviation change with every new row, so normalize everything again
+            self.matrix = _normalize(self.raw)
+            self.ids = self.ids + ids
+            self.names.update({track_id: tracks[track_id] for track_id in ids})
+            self._rows = {track_id: i for i, track_id in enumerate(self.ids)}
+        self.save()
+        logger.debug(f"Indexed audio features of {len(ids)} tracks")
+        return len(ids)
+
+    # Index the user's saved tracks and recently played tracks
+    def sync(self, max_saved: int = 2000) -> int:
+        if not self.client.authorized:
+            return 0
+        self._synced_at = time.time()
+        tracks = {}
+        for offset in range(0, max_saved, 50):
+            page = self.client.current_user_saved_tracks(limit=50, offset=offset)
+            page = models.page(page, unwrap=lambda item: item.get("track"))
+            tracks.update(_names(page.items))
+            if not page.next:
+                break
+        history = self.client.current_user_recently_played(limit=50)
+        tracks.update(_names(history.items))
+        return self.update(tracks)
+
+    # Up to n indexed tracks that sound the most like the given one, as (id, name, score).
+    # The index is loaded from disk on first use and synced in the background once a day;
+    # a track that is not indexed yet costs one audio features request, unless fetch is False.
+    def more_like(self, track_id: str, name: str, n: int = 10, fetch: bool = True):
+        if not self._loaded:
+            self.load()
+        if time.time() - self._synced_at > self.SYNC_INTERVAL:
+            self.client.worker.submit(self.sync, key="similarity-sync")
+        if track_id not in self and fetch:
+            self.update({track_id: name})
+        return self.similar(track_id, n)
+
+    # the n indexed tracks that sound the most like `track_id`, as (id, name, score)
+    def similar(self, track_id: str, n: int = 10) -> Optional[list]:
+        with self._lock:
+            row = self._rows.get(track_id)
+            if row is None or self.matrix is None:
+                return None
+            scores = self.matrix @ self.matrix[row]
+            ids = self.ids
+
+        scores[row] = -np.inf
+        n = min(n, len(ids) - 1)
+        if n <= 0:
+            return []
+        best = np.argpartition(-scores, n - 1)[:n]
+        best = best[np.argsort(-scores[best])]
+        return [(ids[i], self.names.get(ids[i], ""), float(scores[i])) for i in best]
+
+
+def _normalize(raw):
+    # standardize every feature (tempo and loudness live on very different scales)
+    # and scale rows to unit length, so that dot products are cosine similarities
+    std = raw.std(axis=0)
+    std[std == 0] = 1
+    matrix = (raw - raw.mean(axis=0)) / std
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+
+def _names(tracks) -> dict:
+    return {track.id: f"{track.artists} -- {track.name}" for track in tracks}
@@ -0,0 +1,50 @@
+import logging
+import os
+import pickle
+import time
+
+logger = logging.getLogger(__name__)
+
+# bumped whenever what is stored changes, snapshots of other versions are ignored
+VERSION = 2
+# entries that expired longer ago than this (seconds) are not even worth serving offline
+MAX_STALE = 86400
+
+
+# Write the entries of the given caches (name -> TTLCache) to `path`.
+# Expiry times are wall-clock times, so they stay valid across restarts.
+def save(path: str, caches: dict) -> None:
+    data = {
+        "version": VERSION,
+        "caches": {name: cache.dump() for name, cache in caches.items()},
+    }
+    # write to a temporary file first, a crash mid-write must not leave a broken snapshot
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+# Add the entries stored in `path` to the given caches, returns the number of entries loaded.
+# Expired entries are loaded as such: they are only served where stale data is acceptable.
+def load(path: str, caches: dict) -> int:
+    try:
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        # a broken snapshot only means a cold start
+        logger.debug(f"Could not load the cache snapshot: {e}")
+        return 0
+    if not isinstance(data, dict) or data.get("version") != VERSION:
+        return 0
+
+    oldest = time.time() - MAX_STALE
+    loaded = 0
+    for name, entries in data["caches"].items():
+        if name in caches:
+            entries = [entry for entry in entries if entry[1] > oldest]
+            caches[name].load(entries)
+            loaded += len(entries)
+    return loaded
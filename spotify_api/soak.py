@@ -0,0 +1,401 @@
+"""
+Soak benchmark: replays hours of synthetic launcher use (searches, history, the queue, artist
+and album drill-downs, partial results under the query deadline, queueing tracks) against a
+fake Web API, and samples resident memory and the caches along the way. It confirms that
+memory levels off under the cache budgets (the max_entries of every cache) instead of growing
+with use, and names the containers that keep growing if it does not.
+
+The fake API is a local HTTP server that answers every read of the extension with generated
+data, the artwork included. Queries run back to back, so hours of use take minutes; entries do
+not expire in that time, which is the worst case for memory. The real caches, the token and
+the network are never touched.
+
+Usage: python -m spotify_api.soak [--hours 4] [--per-minute 30] [--samples 20] [--seed 1]
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .client import SpotifyClient
+from .engine import SpotifyEngine
+
+logger = logging.getLogger(__name__)
+
+SYLLABLES = "ka lo mi ne ra su ti vo be da fu ge ho ji ku ma no pe ri sa".split()
+# every word of the fake catalog and of the queries, 400 of them
+WORDS = ["".join(pair) for pair in itertools.product(SYLLABLES, repeat=2)]
+
+# sizes of the fake catalog
+TRACKS, ALBUMS, ARTISTS, PLAYLISTS = 50000, 5000, 2000, 1000
+
+# second half growth of resident memory, relative to the first half, that still counts as
+# levelled off; or in bytes, for runs where memory barely grows at all
+TOLERANCE = 0.25
+MIN_GROWTH = 4 * 1024 * 1024
+
+
+class FakeWebApi:
+    # Local HTTP server answering the Web API reads of the extension with generated data,
+    # the same data for the same request. Commands (PUT and POST) succeed without doing anything.
+
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.api = self
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        self.url = f"{self.base}/v1/"
+        self.requests = 0
+        threading.Thread(
+            target=self.server.serve_forever, name="fake-api", daemon=True
+        ).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _images(self, key: str) -> list:
+        return [{"url": f"{self.base}/img/{key}.jpg", "height": 64, "width": 64}]
+
+    def _name(self, kind: str, n: int) -> str:
+        rng = random.Random(f"{kind}{n}")
+        return " ".join(rng.choice(WORDS) for _ in range(2)).capitalize()
+
+    def artist(self, n: int) -> dict:
+        n %= ARTISTS
+        return {
+            "id": f"ar{n}",
+            "uri": f"spotify:artist:ar{n}",
+            "type": "artist",
+            "name": self._name("artist", n),
+            "genres": [random.Random(n).choice(WORDS)],
+            "popularity": n % 100,
+            "images": self._images(f"ar{n}"),
+        }
+
+    def album(self, n: int) -> dict:
+        n %= ALBUMS
+        return {
+            "id": f"al{n}",
+            "uri": f"spotify:album:al{n}",
+            "type": "album",
+            "name": self._name("album", n),
+            "artists": [self.artist(n)],
+            "total_tracks": 10,
+            "release_date": f"{1960 + n % 60}-01-01",
+            "images": self._images(f"al{n}"),
+        }
+
+    def track(self, n: int) -> dict:
+        n %= TRACKS
+        return {
+            "id": f"tr{n}",
+            "uri": f"spotify:track:tr{n}",
+            "type": "track",
+            "name": self._name("track", n),
+            "artists": [self.artist(n), self.artist(n * 7)],
+            "album": self.album(n // 10),
+            "duration_ms": 150000 + n % 120000,
+            "popularity": n % 100,
+        }
+
+    def playlist(self, n: int) -> dict:
+        n %= PLAYLISTS
+        return {
+            "id": f"pl{n}",
+            "uri": f"spotify:playlist:pl{n}",
+            "type": "playlist",
+            "name": self._name("playlist", n),
+            "description": self._name("description", n),
+            "owner": {"display_name": self._name("user", n)},
+            "tracks": {"total": 100},
+            "snapshot_id": f"snapshot{n}",
+            "images": self._images(f"pl{n}"),
+        }
+
+    def _page(self, items: list, offset: int, total: int) -> dict:
+        more = offset + len(items) < total
+        return {"items": items, "total": total, "next": self.url if more else None}
+
+    # the JSON body answering GET `path`, None for 404
+    def read(self, path: str, params: dict):
+        # the same request gets the same data
+        rng = random.Random(zlib.crc32(f"{path}?{sorted(params.items())}".encode()))
+        limit, offset = int(params.get("limit", 20)), int(params.get("offset", 0))
+        numbers = [rng.randrange(1 << 30) for _ in range(limit)]
+        parts = path.split("/")
+
+        if path == "me/player":
+            return {
+                "item": self.track(int(time.time() / 180)),
+                "device": self.devices()["devices"][0],
+                "is_playing": True,
+                "progress_ms": 1000,
+                "shuffle_state": False,
+                "repeat_state": "off",
+                "currently_playing_type": "track",
+            }
+        if path == "me/player/devices":
+            return self.devices()
+        if path == "me/player/queue":
+            return {"currently_playing": None, "queue": []}
+        if path == "me/player/recently-played":
+            items = [{"track": self.track(n)} for n in numbers]
+            return self._page(items, offset, limit)
+        if path == "search":
+            results = {}
+            for kind in params["type"].split(","):
+                convert = getattr(self, kind)
+                results[kind + "s"] = self._page(
+                    [convert(n) for n in numbers], offset, 1000
+                )
+            return results
+        if parts[0] == "artists" and parts[-1] == "top-tracks":
+            return {"tracks": [self.track(n) for n in numbers[:10]]}
+        if parts[0] == "artists" and parts[-1] == "albums":
+            return self._page([self.album(n) for n in numbers], offset, 40)
+        if parts[0] == "artists" and parts[-1] == "related-artists":
+            return {"artists": [self.artist(n) for n in numbers]}
+        if parts[0] == "albums" and parts[-1] == "tracks":
+            tracks = [dict(self.track(n), album=None) for n in numbers[:10]]
+            return self._page(tracks, offset, 10)
+        if parts[0] == "playlists" and parts[-1] == "tracks":
+            items = [{"track": self.track(n)} for n in numbers]
+            return self._page(items, offset, 100)
+        if path == "me/playlists":
+            return self._page([self.playlist(n) for n in numbers], offset, 50)
+        if path == "me/tracks":
+            items = [{"track": self.track(n)} for n in numbers]
+            return self._page(items, offset, 200)
+        if path == "me/tracks/contains":
+            return [rng.random() < 0.2 for _ in params["ids"].split(",")]
+        if path == "recommendations":
+            return {"tracks": [self.track(n) for n in numbers]}
+        if path == "audio-features":
+            ids = params["ids"].split(",")
+            return {"audio_features": [self._features(i, rng) for i in ids]}
+        return None
+
+    def devices(self) -> dict:
+        device = {
+            "id": "soak",
+            "name": "Soak",
+            "type": "Computer",
+            "is_active": True,
+            "volume_percent": 50,
+        }
+        return {"devices": [device]}
+
+    def _features(self, track_id: str, rng: random.Random) -> dict:
+        features = {
+            name: rng.random()
+            for name in ("danceability", "energy", "speechiness", "acousticness")
+        }
+        features.update(instrumentalness=0.1, liveness=0.1, valence=0.5)
+        return dict(features, id=track_id, loudness=-8.0, tempo=120.0)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.api.requests += 1
+        url = urlparse(self.path)
+        if url.path.startswith("/img/"):
+            return self._reply(200, b"\xff\xd8" + bytes(2048), "image/jpeg")
+
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.server.api.read(url.path[len("/v1/") :], params)
+        if body is None:
+            return self._reply(404, b'{"error": {"message": "Not found"}}')
+        self._reply(200, json.dumps(body).encode())
+
+    def do_PUT(self):
+        self.server.api.requests += 1
+        self._reply(204, b"")
+
+    do_POST = do_PUT
+
+    def _reply(self, status: int, data: bytes, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _FakeAuth:
+    # stands in for the PKCE auth manager, the fake API takes any token
+
+    def get_cached_token(self) -> dict:
+        return {"access_token": "soak", "expires_at": time.time() + 3600}
+
+    def get_access_token(self, *args, **kwargs) -> str:
+        return "soak"
+
+
+class Soak:
+    # One SpotifyEngine with its own SpotifyClient in a temporary folder, talking to a
+    # FakeWebApi, and the synthetic launcher use replayed against it.
+
+    def __init__(self, data_dir: str, seed: int = 1):
+        self.api = FakeWebApi()
+        self.rng = random.Random(seed)
+        self.engine = SpotifyEngine()
+        self.engine.CACHE_FOLDER = os.path.join(data_dir, "cache")
+        self.engine.api = client = SpotifyClient(_FakeAuth(), data_dir)
+        client.aio.api_url = client.sp.prefix = self.api.url
+        client.lyrics.configure("none")
+        self.engine._generate_aliases()
+        self.keyword = self.engine.preferences["main_keyword"]
+        self.errors = 0
+        self._tokens = itertools.count()
+
+    def close(self) -> None:
+        self.engine.api.close()
+        self.api.close()
+
+    def _words(self) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(1, 2)))
+
+    # one query or picked item, picked at random with the weights of a typical session
+    def step(self) -> None:
+        rng = self.rng
+        kind = rng.choices(
+            ["search", "category", "now", "history", "queue", "artist", "album", "add"],
+            weights=[30, 15, 15, 10, 5, 10, 10, 5],
+        )[0]
+        try:
+            if kind == "search":
+                self._query(f"search {self._words()}")
+            elif kind == "category":
+                category = rng.choice(["track", "album", "artist", "playlist"])
+                self._query(f"{category} {self._words()}")
+            elif kind == "now":
+                self._query("")
+            elif kind in ("history", "queue"):
+                self._query(kind)
+            elif kind == "artist":
+                n = rng.randrange(ARTISTS)
+                self.engine.on_item_enter(
+                    {
+                        "command": "artist",
+                        "id": f"ar{n}",
+                        "uri": f"spotify:artist:ar{n}",
+                        "name": f"Artist {n}",
+                        "icon": self.engine.ICONS["artist"],
+                    }
+                )
+            elif kind == "album":
+                n = rng.randrange(ALBUMS)
+                self.engine.on_item_enter(
+                    {
+                        "command": "tracks",
+                        "kind": "album",
+                        "id": f"al{n}",
+                        "uri": f"spotify:album:al{n}",
+                        "name": f"Album {n}",
+                        "icon": self.engine.ICONS["album"],
+                    }
+                )
+            else:
+                uri = f"spotify:track:tr{rng.randrange(TRACKS)}"
+                self.engine.on_item_enter({"command": "queue", "uri": uri})
+        except Exception as e:
+            self.errors += 1
+            logger.debug(f"{kind} failed: {e!r}")
+
+    # like the launcher does it: partial results from the caches first, then the query
+    def _query(self, argument: str) -> None:
+        self.engine.partial_query(self.keyword, argument)
+        self.engine.query(self.keyword, argument, f"soak-{next(self._tokens)}")
+
+    # {"rss": ..., "caches": ...} of the engine's client, after a full garbage collection
+    def sample(self) -> dict:
+        gc.collect()
+        return self.engine.api.memory.usage()
+
+
+# Names of the containers without a budget that grew in the second half of the run,
+# and whether resident memory levelled off, see TOLERANCE.
+def verdict(samples: list) -> tuple:
+    first, middle, last = samples[0], samples[len(samples) // 2], samples[-1]
+    growing = [
+        name
+        for name, cache in last["caches"].items()
+        if cache["max_entries"] is None
+        and cache["entries"] > middle["caches"][name]["entries"]
+    ]
+    if last["rss"] is None:
+        return growing, not growing
+    early, late = middle["rss"] - first["rss"], last["rss"] - middle["rss"]
+    return growing, late <= max(TOLERANCE * early, MIN_GROWTH)
+
+
+def _megabytes(size) -> str:
+    return f"{size / 1024 / 1024:7.1f}" if size is not None else "      ?"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--hours", type=float, default=4, help="of simulated use")
+    parser.add_argument("--per-minute", type=float, default=30, help="queries")
+    parser.add_argument("--samples", type=int, default=20, help="memory samples")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    total = max(int(args.hours * 60 * args.per_minute), args.samples)
+    every = total // args.samples
+    data_dir = tempfile.mkdtemp(prefix="spotify-soak-")
+    soak = Soak(data_dir, args.seed)
+    samples = []
+    started = time.time()
+    print(" queries  hours  rss (MB)  caches (MB)  requests  errors", flush=True)
+    try:
+        for n in range(1, total + 1):
+            soak.step()
+            if n % every:
+                continue
+            sample = soak.sample()
+            samples.append(sample)
+            caches = sum(cache["bytes"] for cache in sample["caches"].values())
+            print(
+                f"{n:8d} {n / args.per_minute / 60:6.1f} {_megabytes(sample['rss'])}"
+                f"   {_megabytes(caches)}     {soak.api.requests:8d}  {soak.errors:6d}",
+                flush=True,
+            )
+    finally:
+        soak.engine.actions.wait()
+        soak.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(f"\n{total} queries in {time.time() - started:.0f}s, caches at the end:")
+    for name, cache in sorted(samples[-1]["caches"].items()):
+        budget = f"/{cache['max_entries']}" if cache["max_entries"] else ""
+        size = _megabytes(cache["bytes"])
+        print(f"  {name:22s} {cache['entries']:6d}{budget:6s} {size} MB")
+
+    growing, levelled = verdict(samples)
+    if growing:
+        print(f"Still growing without a budget: {', '.join(growing)}")
+    print("Resident memory levels off" if levelled else "Resident memory keeps growing")
+    return 0 if levelled and not growing else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
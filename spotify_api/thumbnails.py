@@ -0,0 +1,135 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+# where the image at `url` is cached, the same file for the launcher and the prefetcher
+def cache_path(folder: str, url: str) -> str:
+    return os.path.join(folder, os.path.basename(urlparse(url).path))
+
+
+class ThumbnailPrefetcher:
+    # Downloads artwork into the image cache before it is shown.
+    # Known image URLs (from history, the library, search results, ...) are queued and fetched
+    # by up to `threads` daemon threads, together at most `bandwidth` bytes per second.
+    # Background downloads wait while a foreground request is in flight (see pause()).
+
+    TIMEOUT = (2.0, 5.0)  # (connect, read) seconds
+    MAX_QUEUED = 1000  # urls waiting, the least urgent ones are dropped above that
+    MAX_SEEN = 10000  # urls remembered as queued, forgotten all at once above that
+
+    def __init__(self, folder: str, bandwidth: int = 200 * 1024, threads: int = 2):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.bandwidth = bandwidth
+        self.threads = 0
+        self._queue = deque(maxlen=self.MAX_QUEUED)
+        self._seen = set()  # urls queued at some point
+        self._foreground = 0  # requests in flight that background downloads wait for
+        self._condition = threading.Condition()
+        self._available_at = 0  # when the bandwidth budget allows the next download
+        self._lock = threading.Lock()
+        self.configure(bandwidth, threads)
+
+    # bandwidth in bytes per second (0 stops prefetching), threads is the concurrency cap
+    def configure(self, bandwidth: int, threads: int) -> None:
+        with self._condition:
+            self.bandwidth = bandwidth
+            running, self.threads = self.threads, max(threads, 0)
+            # threads above the new cap exit by themselves, see _run()
+            for i in range(running, self.threads):
+                threading.Thread(
+                    target=self._run, args=(i,), name=f"thumbnails-{i}", daemon=True
+                ).start()
+            self._condition.notify_all()
+
+    # queue image urls, urgent ones (what was just fetched) go before the rest
+    def add(self, urls, urgent: bool = False) -> None:
+        with self._condition:
+            for url in urls:
+                if not url or url in self._seen:
+                    continue
+                if len(self._seen) >= self.MAX_SEEN:
+                    # downloaded ones are skipped anyway, see _run()
+                    self._seen.clear()
+                if urgent:
+                    # drops the last one of a full queue
+                    self._queue.appendleft(url)
+                elif len(self._queue) < self.MAX_QUEUED:
+                    self._queue.append(url)
+                else:
+                    continue
+                self._seen.add(url)
+            self._condition.notify_all()
+
+    # background downloads wait while any block like this is running
+    @contextmanager
+    def pause(self):
+        with self._condition:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._foreground -= 1
+                self._condition.notify_all()
+
+    # download an image right away (it is about to be shown), returns its path
+    def download(self, url: str) -> str:
+        with self.pause():
+            return self._download(url)
+
+    def _download(self, url: str) -> str:
+        path = cache_path(self.folder, url)
+        if os.path.exists(path):
+            return path
+        response = requests.get(url, stream=True, timeout=self.TIMEOUT)
+        response.raise_for_status()
+        # rename when complete, so that a half written file is never shown
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            shutil.copyfileobj(response.raw, f)
+        os.replace(tmp, path)
+        return path
+
+    def _next(self, index: int):
+        with self._condition:
+            while True:
+                if index >= self.threads:
+                    return None
+                if self._queue and self.bandwidth > 0 and not self._foreground:
+                    return self._queue.popleft()
+                self._condition.wait()
+
+    # wait until `size` more bytes fit into the bandwidth budget
+    def _throttle(self, size: int) -> None:
+        if self.bandwidth <= 0:
+            return
+        with self._lock:
+            now = time.time()
+            self._available_at = max(self._available_at, now) + size / self.bandwidth
+            delay = self._available_at - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def _run(self, index: int) -> None:
+        while True:
+            url = self._next(index)
+            if url is None:
+                return
+            if os.path.exists(cache_path(self.folder, url)):
+                continue
+            try:
+                path = self._download(url)
+                self._throttle(os.path.getsize(path))
+            except (requests.exceptions.RequestException, OSError) as e:
+                logger.debug(f"Could not prefetch {url}: {e}")
@@ -0,0 +1,64 @@
+import itertools
+import logging
+import queue
+import threading
+from typing import Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+HIGH = 0
+NORMAL = 5
+LOW = 10
+
+
+class BackgroundWorker:
+    # Runs work that nobody waits for (prefetching and the like) on daemon threads,
+    # lowest priority value first. A task with a key is dropped while another one
+    # with the same key is still waiting or running.
+
+    def __init__(self, threads: int = 2, name: str = "worker"):
+        self._queue = queue.PriorityQueue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._counter = itertools.count()  # keeps FIFO order within a priority
+        self._threads = threads
+
+        for i in range(threads):
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True).start()
+
+    def submit(
+        self,
+        fn: Callable,
+        *args,
+        priority: int = LOW,
+        key: Optional[Hashable] = None,
+        **kwargs,
+    ) -> bool:
+        with self._lock:
+            if key is not None:
+                if key in self._pending:
+                    return False
+                self._pending.add(key)
+        self._queue.put((priority, next(self._counter), key, fn, args, kwargs))
+        return True
+
+    # Stop the threads once the tasks running now are done; waiting tasks are dropped.
+    def close(self) -> None:
+        for _ in range(self._threads):
+            # goes before every task, see _run()
+            self._queue.put((HIGH - 1, next(self._counter), None, None, (), {}))
+
+    def _run(self) -> None:
+        while True:
+            _, _, key, fn, args, kwargs = self._queue.get()
+            if fn is None:
+                return
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                name = getattr(fn, "__name__", fn)
+                logger.debug(f"Background task {name} failed: {e}")
+            finally:
+                if key is not None:
+                    with self._lock:
+                        self._pending.discard(key)
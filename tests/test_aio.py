@@ -0,0 +1,117 @@
+import asyncio
+import concurrent.futures
+import time
+import unittest
+
+from spotify_api.aio import AsyncSpotify
+from spotify_api.session import ResilientSession
+
+
+class _Auth:
+    def get_cached_token(self):
+        return {"access_token": "token", "expires_at": time.time() + 3600}
+
+
+class RequestCoalescingTest(unittest.TestCase):
+    # AsyncSpotify._request with _send replaced, nothing goes to the network
+
+    def setUp(self):
+        self.aio = AsyncSpotify(_Auth(), ResilientSession())
+        self.sent = []
+        self.release = None  # asyncio.Event the sent requests wait for, on the loop
+        self.aio._send = self.send
+
+    def tearDown(self):
+        self.aio.close()
+
+    async def send(self, method, path, payload, params):
+        self.sent.append((method, path, params))
+        await self.release.wait()
+        return {"path": path, "params": params}
+
+    # start `calls` (method, path, params) on the loop, all waiting for finish()
+    def start(self, *calls) -> list:
+        async def make_event():
+            self.release = asyncio.Event()
+
+        self.aio.submit(make_event()).result()
+        futures = [
+            self.aio.submit(self.aio._request(method, path, **params))
+            for method, path, params in calls
+        ]
+        time.sleep(0.05)
+        return futures
+
+    def finish(self) -> None:
+        self.aio.loop.call_soon_threadsafe(self.release.set)
+
+    def test_identical_reads_are_sent_once(self):
+        futures = self.start(*[("GET", "me/player", {"market": "DE"})] * 3)
+        self.finish()
+        results = [future.result(1) for future in futures]
+
+        self.assertEqual(len(self.sent), 1)
+        expected = {"path": "me/player", "params": {"market": "DE"}}
+        self.assertEqual(results, [expected] * 3)
+        self.assertEqual(self.aio._inflight, {})
+
+    def test_reads_with_other_params_are_sent_each(self):
+        futures = self.start(
+            ("GET", "search", {"q": "a"}),
+            ("GET", "search", {"q": "b"}),
+            ("GET", "me/player", {}),
+        )
+        self.finish()
+        for future in futures:
+            future.result(1)
+        self.assertEqual(len(self.sent), 3)
+
+    def test_params_that_are_none_do_not_count(self):
+        futures = self.start(
+            ("GET", "me/player", {"market": None}), ("GET", "me/player", {})
+        )
+        self.finish()
+        for future in futures:
+            future.result(1)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_commands_are_never_coalesced(self):
+        futures = self.start(*[("POST", "me/player/next", {})] * 2)
+        self.finish()
+        for future in futures:
+            future.result(1)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_a_read_is_sent_again_once_done(self):
+        futures = self.start(("GET", "me/player", {}))
+        self.finish()
+        futures[0].result(1)
+        futures = self.start(("GET", "me/player", {}))
+        self.finish()
+        futures[0].result(1)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_cancelled_caller_leaves_the_request_to_the_others(self):
+        first, second = self.start(*[("GET", "me/player", {})] * 2)
+        first.cancel()
+        time.sleep(0.05)
+        self.finish()
+
+        self.assertEqual(second.result(1), {"path": "me/player", "params": {}})
+        with self.assertRaises(concurrent.futures.CancelledError):
+            first.result(1)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_request_is_aborted_when_every_caller_is_cancelled(self):
+        futures = self.start(*[("GET", "me/player", {})] * 2)
+        [(task, _)] = self.aio._inflight.values()
+        for future in futures:
+            future.cancel()
+        time.sleep(0.05)
+
+        self.assertTrue(task.cancelled())
+        self.assertEqual(self.aio._inflight, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
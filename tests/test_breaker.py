@@ -0,0 +1,81 @@
+import threading
+import time
+import unittest
+
+from spotify_api.breaker import CircuitBreaker
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.recovered = threading.Event()
+        self.probes = 0
+        self.breaker = CircuitBreaker(
+            self.probe, failure_threshold=3, probe_interval=0.01
+        )
+
+    def probe(self) -> bool:
+        self.probes += 1
+        return self.recovered.is_set()
+
+    def wait_until(self, condition, timeout: float = 2.0) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open)
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open)
+        self.assertIsNotNone(self.breaker.opened_at)
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open)
+
+    def test_stays_open_while_probes_fail(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.assertTrue(self.wait_until(lambda: self.probes >= 3))
+        self.assertTrue(self.breaker.is_open)
+
+    def test_probe_that_fails_with_an_exception_keeps_it_open(self):
+        self.breaker.probe = lambda: 1 / 0
+        for _ in range(3):
+            self.breaker.record_failure()
+        time.sleep(0.05)
+        self.assertTrue(self.breaker.is_open)
+        self.breaker.record_success()
+
+    def test_closes_when_a_probe_succeeds(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.recovered.set()
+        self.assertTrue(self.wait_until(lambda: not self.breaker.is_open))
+        self.assertIsNone(self.breaker.opened_at)
+
+        # the count starts over after closing
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open)
+
+    def test_failures_while_open_start_no_more_probe_loops(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        threads = threading.active_count()
+        for _ in range(10):
+            self.breaker.record_failure()
+        self.assertLessEqual(threading.active_count(), threads)
+        self.breaker.record_success()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+
+from spotify_api.httpcache import CachingAdapter, HttpCache
+
+URL = "https://api.spotify.com/v1/me/playlists?limit=50"
+
+
+class HttpCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = HttpCache(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_response_with_max_age_is_fresh(self):
+        self.cache.store(URL, {"Cache-Control": "private, max-age=60"}, "body")
+        entry = self.cache.get(URL)
+        self.assertEqual(entry["body"], "body")
+        self.assertTrue(self.cache.is_fresh(entry))
+
+    def test_response_with_only_an_etag_is_kept_for_revalidation(self):
+        self.cache.store(URL, {"ETag": '"v1"'}, "body")
+        entry = self.cache.get(URL)
+        self.assertEqual(entry["etag"], '"v1"')
+        self.assertFalse(self.cache.is_fresh(entry))
+
+    def test_entry_expires_after_max_age(self):
+        self.cache.store(URL, {"ETag": '"v1"', "Cache-Control": "max-age=60"}, "body")
+        entry = self.cache.get(URL)
+        self.assertFalse(HttpCache.is_fresh(dict(entry, expires_at=time.time() - 1)))
+
+    def test_revalidated_entry_is_fresh_for_another_max_age(self):
+        self.cache.store(URL, {"ETag": '"v1"'}, "body")
+        entry = self.cache.revalidated(
+            URL, self.cache.get(URL), {"Cache-Control": "max-age=30"}
+        )
+        self.assertTrue(self.cache.is_fresh(entry))
+        self.assertEqual(self.cache.get(URL), entry)
+        self.assertEqual(entry["body"], "body")
+
+    def test_responses_that_can_not_be_reused_are_not_stored(self):
+        self.cache.store(URL, {}, "body")
+        self.cache.store(URL + "&a", {"ETag": '"v1"', "Cache-Control": "no-store"}, "")
+        self.cache.store(URL + "&b", {"Cache-Control": "no-cache, max-age=60"}, "")
+        self.assertIsNone(self.cache.get(URL))
+        self.assertIsNone(self.cache.get(URL + "&a"))
+        self.assertIsNone(self.cache.get(URL + "&b"))
+
+    def test_prune_keeps_the_most_recent_entries(self):
+        self.cache.MAX_ENTRIES = 2
+        for n in range(4):
+            self.cache.store(f"{URL}&n={n}", {"ETag": str(n)}, "")
+            time.sleep(0.01)
+        self.cache.prune()
+        kept = [n for n in range(4) if self.cache.get(f"{URL}&n={n}")]
+        self.assertEqual(kept, [2, 3])
+
+    def test_clear(self):
+        self.cache.store(URL, {"ETag": '"v1"'}, "body")
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(URL))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # answers with the server's etag and body, 304 if the client has them already
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.send_header("Cache-Control", f"max-age={server.max_age}")
+            self.end_headers()
+            return
+        body = server.body.encode()
+        self.send_response(200)
+        self.send_header("ETag", server.etag)
+        self.send_header("Cache-Control", f"max-age={server.max_age}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CachingAdapterTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.server = HTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.etag, self.server.body, self.server.max_age = '"v1"', "one", 0
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1/me/playlists"
+
+        self.session = requests.Session()
+        self.session.mount("http://", CachingAdapter(HttpCache(self.folder)))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
+        shutil.rmtree(self.folder)
+
+    def test_unchanged_response_is_revalidated(self):
+        self.assertEqual(self.session.get(self.url).text, "one")
+        response = self.session.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, "one")
+        self.assertEqual(self.server.requests, [None, '"v1"'])
+
+    def test_changed_response_replaces_the_entry(self):
+        self.session.get(self.url)
+        self.server.etag, self.server.body = '"v2"', "two"
+        self.assertEqual(self.session.get(self.url).text, "two")
+        self.assertEqual(self.session.get(self.url).text, "two")
+        self.assertEqual(self.server.requests, [None, '"v1"', '"v2"'])
+
+    def test_fresh_response_is_served_without_a_request(self):
+        self.server.max_age = 60
+        self.session.get(self.url)
+        self.assertEqual(self.session.get(self.url).text, "one")
+        self.assertEqual(self.server.requests, [None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+
+from spotify_api import models
+from spotify_api.client import PLAYLIST_ITEMS_FIELDS
+
+
+# `data` narrowed to a Web API `fields` filter, e.g. "items(track(name,uri)),total",
+# the way the Web API narrows its response
+def apply_fields(data, fields: str):
+    selection, rest = _parse_fields(fields)
+    assert not rest, fields
+    return _select(data, selection)
+
+
+def _parse_fields(text: str):
+    selection = {}
+    while text and not text.startswith(")"):
+        name = text.split(",")[0].split("(")[0].split(")")[0]
+        text = text[len(name) :]
+        if text.startswith("("):
+            selection[name], text = _parse_fields(text[1:])
+            text = text[1:]
+        else:
+            selection[name] = None
+        if text.startswith(","):
+            text = text[1:]
+    return selection, text
+
+
+def _select(data, selection):
+    if selection is None or data is None:
+        return data
+    if isinstance(data, list):
+        return [_select(value, selection) for value in data]
+    return {
+        name: _select(data[name], sub)
+        for name, sub in selection.items()
+        if name in data
+    }
+
+
+ARTIST = {
+    "id": "artist1",
+    "uri": "spotify:artist:artist1",
+    "type": "artist",
+    "name": "Artist",
+    "external_urls": {"spotify": "https://open.spotify.com/artist/artist1"},
+}
+
+PLAYLIST_ITEMS = {
+    "href": "https://api.spotify.com/v1/playlists/playlist1/tracks",
+    "items": [
+        {
+            "added_at": "2021-01-01T00:00:00Z",
+            "is_local": False,
+            "track": {
+                "id": "track1",
+                "uri": "spotify:track:track1",
+                "type": "track",
+                "name": "Track",
+                "duration_ms": 200000,
+                "popularity": 50,
+                "explicit": False,
+                "available_markets": ["DE", "US"],
+                "artists": [ARTIST],
+                "album": {
+                    "id": "album1",
+                    "uri": "spotify:album:album1",
+                    "type": "album",
+                    "name": "Album",
+                    "artists": [ARTIST],
+                    "images": [
+                        {"url": "https://i.scdn.co/large", "height": 640},
+                        {"url": "https://i.scdn.co/small", "height": 64},
+                    ],
+                },
+            },
+        },
+        # local files have no id and are left out
+        {"is_local": True, "track": {"id": None, "type": "track", "name": "Local"}},
+    ],
+    "limit": 50,
+    "offset": 0,
+    "next": None,
+    "total": 2,
+}
+
+
+class PlaylistItemsTest(unittest.TestCase):
+    def test_filtered_items_convert(self):
+        data = apply_fields(PLAYLIST_ITEMS, PLAYLIST_ITEMS_FIELDS)
+        page = models.page(data, unwrap=lambda item: item.get("track"))
+
+        self.assertEqual(page.total, 2)
+        self.assertIsNone(page.next)
+        self.assertEqual(len(page.items), 1)
+        track = page.items[0]
+        self.assertEqual(track.uri, "spotify:track:track1")
+        self.assertEqual(track.name, "Track")
+        self.assertEqual(track.artist_ids, ("artist1",))
+        self.assertEqual(track.artists, "Artist")
+        self.assertEqual(track.duration_ms, 200000)
+        self.assertEqual(track.album.name, "Album")
+        self.assertEqual(track.image, "https://i.scdn.co/small")
+
+    def test_filter_drops_what_is_not_shown(self):
+        data = apply_fields(PLAYLIST_ITEMS, PLAYLIST_ITEMS_FIELDS)
+        track = data["items"][0]["track"]
+        self.assertNotIn("available_markets", track)
+        self.assertNotIn("added_at", data["items"][0])
+        self.assertNotIn("href", data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+
+from spotify_api.playqueue import QueueMirror
+
+
+def _track(n: int) -> dict:
+    return {
+        "id": f"track{n}",
+        "uri": f"spotify:track:track{n}",
+        "type": "track",
+        "name": f"Track {n}",
+        "artists": [{"id": "artist1", "name": "Artist"}],
+    }
+
+
+class _Client:
+    # what QueueMirror uses of SpotifyClient, queue() reports `current` and `upcoming`
+    offline = False
+    authorized = True
+
+    def __init__(self):
+        self.current, self.upcoming = None, []
+
+    def queue(self):
+        return {
+            "currently_playing": self.current and _track(self.current),
+            "queue": [_track(n) for n in self.upcoming],
+        }
+
+
+class QueueMirrorTest(unittest.TestCase):
+    def setUp(self):
+        self.client = _Client()
+        self.mirror = QueueMirror(self.client)
+
+    def report(self, current=None, upcoming=()):
+        self.client.current, self.client.upcoming = current, list(upcoming)
+        self.mirror.sync()
+
+    def test_queueing_again_is_refused(self):
+        self.assertTrue(self.mirror.add("spotify:track:track1"))
+        self.assertFalse(self.mirror.add("spotify:track:track1"))
+        self.assertTrue(self.mirror.add("spotify:track:track2"))
+        self.assertEqual(
+            self.mirror.queued(), ["spotify:track:track1", "spotify:track:track2"]
+        )
+
+    def test_discarded_uri_can_be_queued_again(self):
+        self.mirror.add("spotify:track:track1")
+        self.mirror.discard("spotify:track:track1")
+        self.assertTrue(self.mirror.add("spotify:track:track1"))
+
+    def test_sync_mirrors_the_player(self):
+        self.report(current=1, upcoming=[2, 3])
+        self.assertEqual(self.mirror.current.uri, "spotify:track:track1")
+        self.assertEqual(
+            [item.uri for item in self.mirror.upcoming],
+            ["spotify:track:track2", "spotify:track:track3"],
+        )
+        self.assertGreater(self.mirror.synced_at, 0)
+
+    def test_queued_uri_stays_queued_until_the_player_reports_it(self):
+        self.mirror.add("spotify:track:track2")
+        self.report(current=1)
+        self.assertEqual(self.mirror.queued(), ["spotify:track:track2"])
+        self.report(current=1, upcoming=[2])
+        self.assertFalse(self.mirror.add("spotify:track:track2"))
+
+    def test_uri_is_played_once_it_is_no_longer_reported(self):
+        self.mirror.add("spotify:track:track2")
+        self.report(current=1, upcoming=[2, 3])
+        self.report(current=3)
+        self.assertEqual(self.mirror.queued(), [])
+        self.assertTrue(self.mirror.add("spotify:track:track2"))
+
+    def test_uri_is_played_once_it_is_playing(self):
+        self.mirror.add("spotify:track:track2")
+        self.report(current=2)
+        self.assertEqual(self.mirror.queued(), [])
+
+    def test_uri_the_player_never_reports_is_forgotten_after_the_ttl(self):
+        self.mirror.add("spotify:track:track2")
+        self.mirror.PENDING_TTL = 0
+        self.report(current=1)
+        self.assertEqual(self.mirror.queued(), [])
+
+    def test_no_sync_while_offline(self):
+        self.client.offline = True
+        self.mirror.add("spotify:track:track2")
+        self.report(current=2)
+        self.assertIsNone(self.mirror.current)
+        self.assertEqual(self.mirror.queued(), ["spotify:track:track2"])
+
+
+if __name__ == "__main__":
+    unittest.main()